@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+"""Import-time benchmark for the CLI, Lambda and matcher entry points.
+
+Runs `python -X importtime` in a fresh interpreter per entry point and
+reports the cumulative import time of each, best of `--repeat` runs. Run
+from the repo root:
+
+    python -m benchmarks.bench_import [--repeat 5] [--json] [--check]
+
+With `--check`, exits non-zero if an entry point is over its budget in
+`THRESHOLDS_MS`, or if it imports one of the heavy modules it shouldn't.
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+
+# budgets are generous on purpose: they're there to catch an eager boto3
+# import (~200ms) creeping back in, not to measure small changes.
+THRESHOLDS_MS = {
+    'ec2_reaper': 20,
+    'ec2_reaper.matcher': 40,
+    'ec2_reaper.cli': 120,
+    'ec2_reaper.aws_lambda': 100,
+}
+
+# modules each entry point must not pull in at import time
+FORBIDDEN = ('boto3', 'botocore', 'requests')
+
+
+def import_profile(module):
+    """Return (cumulative import time in microseconds, set of modules imported)."""
+    r = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)],
+                       stderr=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                       universal_newlines=True, check=True)
+    total, modules = 0, set()
+    for line in r.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative, name = [f.strip() for f in line[len('import time:'):].split('|')]
+        modules.add(name)
+        if name == module:
+            total = int(cumulative)
+    return total, modules
+
+
+def run(repeat=5):
+    results = []
+    for module, threshold in sorted(THRESHOLDS_MS.items()):
+        runs = [import_profile(module) for _ in range(repeat)]
+        best = min(t for t, _ in runs)
+        modules = runs[0][1]
+        results.append({
+            'benchmark': 'import',
+            'module': module,
+            'import_ms': best / 1000.0,
+            'threshold_ms': threshold,
+            'forbidden_imports': sorted(m for m in modules if m.split('.')[0] in FORBIDDEN),
+        })
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', action='store_true', help='Print results as JSON.')
+    parser.add_argument('--check', action='store_true', help='Exit non-zero on a regression.')
+    args = parser.parse_args(argv)
+
+    results = run(args.repeat)
+    failed = False
+    for r in results:
+        r['ok'] = r['import_ms'] <= r['threshold_ms'] and not r['forbidden_imports']
+        failed = failed or not r['ok']
+        if args.json:
+            print(json.dumps(r, sort_keys=True))
+        else:
+            print('{module:24} {import_ms:7.1f}ms  (budget {threshold_ms}ms){extra}'.format(
+                extra='  imports {}'.format(', '.join(r['forbidden_imports'])) if r['forbidden_imports'] else '',
+                **r))
+
+    return 1 if args.check and failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
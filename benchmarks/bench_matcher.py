@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+"""Tag matcher microbenchmark.
+
+Compares the original list-scanning `_check_tags` with the compiled
+`TagMatcher` over a synthetic fleet. Run from the repo root:
+
+    python -m benchmarks.bench_matcher [--instances 100000] [--json]
+"""
+
+import argparse
+import json
+import logging
+import sys
+import time
+
+from benchmarks.fleet import synthetic_tags
+from ec2_reaper.matcher import TagMatcher
+
+log = logging.getLogger()
+
+MATCHERS = [
+    {'tag': 'Name', 'includes': [], 'excludes': ['*']},
+    {'tag': 'Name', 'includes': ['cirunner'], 'excludes': []},
+    {'tag': 'env', 'includes': ['sandbox', 'scratch'], 'excludes': ['prod']},
+    {'tag': 'reapme', 'includes': ['*'], 'excludes': []},
+]
+
+# a longer policy, eg: one matcher per team's scratch naming convention
+LONG_MATCHERS = MATCHERS + [
+    {'tag': 'Name', 'includes': ['scratch-team-{}'.format(n)], 'excludes': []}
+    for n in range(28)]
+
+
+def _legacy_check_tags(instance_tags, matching_tags):
+    """`ec2_reaper._check_tags` as it was before the compiled matcher."""
+    log.debug('Comparing instance tags {} to filters {}'.format(
+    instance_tags, matching_tags))
+    instance_tags = instance_tags if instance_tags else []
+    for mt in matching_tags:
+        instance_tag_keys = [i['Key'] for i in instance_tags]
+
+        log.debug('excludes: {} (matches? {})'.format(
+            mt.get('excludes'), (mt.get('excludes') == [u'*'])))
+        log.debug('tag: {} (in instance tags? {})'.format(
+            mt.get('tag'), mt.get('tag') in instance_tag_keys))
+        if mt.get('excludes') == [u'*'] and mt.get('tag') not in instance_tag_keys:
+            log.debug('Tag "{}" not present; instance is reapable.'.format(mt.get('tag')))
+            return True
+
+        for it in instance_tags:
+            if it.get('Key') != mt.get('tag'):
+                continue
+            if mt.get('includes') == [u'*'] and it.get('Value'):
+                log.debug('Tag "{}" is present and `include` is wildcarded; instance is reapable.'.format(mt.get('tag')))
+                return True
+            if it.get('Value') in mt.get('includes') and it.get('Value') not in mt.get('excludes'):
+                log.debug('Tag "{}" present, its value is in `includes` and not in `excludes`; instance is reapable.'.format(mt.get('tag')))
+                return True
+    return False
+
+
+def _clock():
+    return time.perf_counter() if hasattr(time, 'perf_counter') else time.time()
+
+
+def _time(fn, fleet):
+    start = _clock()
+    matches = sum(1 for tags in fleet if fn(tags))
+    return _clock() - start, matches
+
+
+def run(instances=100000):
+    fleet = synthetic_tags(instances)
+    results = []
+    for name, matchers in (('short', MATCHERS), ('long', LONG_MATCHERS)):
+        legacy, legacy_matches = _time(lambda tags: _legacy_check_tags(tags, matchers), fleet)
+        uncached, uncached_matches = _time(TagMatcher(matchers, cache_size=0), fleet)
+        m = TagMatcher(matchers)
+        compiled, compiled_matches = _time(m, fleet)
+        assert legacy_matches == uncached_matches == compiled_matches
+
+        results.append({
+            'benchmark': 'matcher',
+            'policy': name,
+            'matchers': len(matchers),
+            'instances': instances,
+            'matches': legacy_matches,
+            'legacy_s': legacy,
+            'uncached_s': uncached,
+            'compiled_s': compiled,
+            'cache_size': m.cache_size,
+            'cache_hits': m.hits,
+            'cache_misses': m.misses,
+            'speedup': legacy / compiled,
+        })
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--instances', '-n', type=int, default=100000)
+    parser.add_argument('--json', action='store_true', help='Print results as JSON.')
+    parser.add_argument('--min-speedup', type=float, default=None,
+                        help='Exit non-zero if TagMatcher is not at least this much faster.')
+    args = parser.parse_args(argv)
+
+    # the point is to measure with DEBUG off, as in production
+    log.setLevel(logging.INFO)
+    results = run(args.instances)
+
+    for r in results:
+        if args.json:
+            print(json.dumps(r, sort_keys=True))
+            continue
+        print('{instances} instances, {matchers} matchers ({policy}), {matches} matches'.format(**r))
+        print('  legacy _check_tags:    {legacy_s:.3f}s'.format(**r))
+        print('  TagMatcher, no cache:  {uncached_s:.3f}s'.format(**r))
+        print('  TagMatcher:            {compiled_s:.3f}s  ({speedup:.1f}x, cache size {cache_size}, '
+              '{cache_hits} hits / {cache_misses} misses)'.format(**r))
+
+    if args.min_speedup and any(r['speedup'] < args.min_speedup for r in results):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+"""Fleet-scale benchmark for `reap()` and the Lambda `handler()`.
+
+Builds a synthetic fleet of N instances across M regions and sweeps it
+fully offline, either against moto or against `FakeEC2Client`, a much
+faster in-memory stand-in that can reach 100k instances. Run from the repo
+root:
+
+    python -m benchmarks.bench_reap --scale 10k --regions 4 [--backend stub|moto] [--json]
+
+Each measurement reports wall time (best of `--repeat`), API calls by
+operation, peak traced memory (from a separate tracemalloc run) and, for
+the matcher, cost per instance.
+"""
+
+import argparse
+import json
+import logging
+import sys
+import time
+import tracemalloc
+from collections import Counter
+
+from benchmarks.fleet import FakeEC2Client, launch_moto, synthetic_fleet
+
+if sys.version_info >= (3, 3):
+    from unittest.mock import patch
+else:
+    from mock import patch
+
+SCALES = {'1k': 1000, '10k': 10000, '100k': 100000}
+REGIONS = ['us-east-1', 'us-east-2', 'us-west-1', 'us-west-2', 'eu-west-1', 'eu-central-1',
+           'ap-southeast-1', 'ap-southeast-2', 'ap-northeast-1', 'sa-east-1']
+
+# the same policy bench_matcher calls "short"
+MATCHERS = [
+    {'tag': 'Name', 'includes': [], 'excludes': ['*']},
+    {'tag': 'Name', 'includes': ['cirunner'], 'excludes': []},
+    {'tag': 'env', 'includes': ['sandbox', 'scratch'], 'excludes': ['prod']},
+    {'tag': 'reapme', 'includes': ['*'], 'excludes': []},
+]
+
+
+def _measure(fn, repeat, calls):
+    """Best-of-`repeat` wall time, API calls for one run, and peak traced memory."""
+    times = []
+    for n in range(repeat):
+        calls.clear()
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+        if n == 0:
+            api_calls = dict(calls)
+
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, {'wall_s': min(times), 'api_calls': api_calls, 'peak_bytes': peak}
+
+
+def _backend(name, fleet):
+    """Set up `name` ('stub' or 'moto') and return (API call counter, teardown)."""
+    from ec2_reaper import clients
+
+    clients.reset()
+    if name == 'stub':
+        fakes = dict((region, FakeEC2Client(instances)) for region, instances in fleet.items())
+        calls = Counter()
+        for fake in fakes.values():
+            fake.calls = calls
+        p = patch.object(clients, 'get_client',
+                         lambda service, region, credentials=None: fakes[region])
+        p.start()
+        return calls, p.stop
+
+    from moto import mock_ec2
+    mock = mock_ec2()
+    mock.start()
+    launch_moto(fleet)
+    calls = Counter()
+
+    def _count(event_name, **kwargs):
+        calls[event_name.split('.')[-1]] += 1
+    clients.get_session().events.register('before-call.ec2', _count)
+
+    def _teardown():
+        mock.stop()
+        clients.reset()
+    return calls, _teardown
+
+
+def run(instances, regions, backend='stub', engine='client', workers=1, page_size=1000,
+        min_age=3600, repeat=3):
+    from ec2_reaper import aws_lambda
+    from ec2_reaper import ec2_reaper
+    from ec2_reaper.matcher import TagMatcher
+
+    regions = REGIONS[:regions]
+    fleet = synthetic_fleet(instances, regions)
+    common = {'benchmark': 'reap', 'backend': backend, 'engine': engine, 'workers': workers,
+              'instances': instances, 'regions': len(regions)}
+    results = []
+
+    calls, teardown = _backend(backend, fleet)
+    try:
+        reaperlog, r = _measure(lambda: ec2_reaper.reap(
+            MATCHERS, min_age=min_age, regions=regions, debug=True, workers=workers,
+            engine=engine, page_size=page_size), repeat, calls)
+        r.update(common, phase='reap', matched=len(reaperlog))
+        results.append(r)
+
+        with patch.multiple(aws_lambda, TAG_MATCHER=MATCHERS, MIN_AGE=min_age, REGIONS=regions,
+                             DEBUG=True, WORKERS=workers, SCAN_ENGINE=engine, PAGE_SIZE=page_size,
+                             SLACK_ENDPOINT=None):
+            response, r = _measure(lambda: aws_lambda.handler({}, {}), repeat, calls)
+        r.update(common, phase='handler', matched=response['body']['instances'])
+        results.append(r)
+    finally:
+        teardown()
+
+    tags = [i['Tags'] for region in fleet.values() for i in region]
+    matcher = TagMatcher(MATCHERS)
+    _, r = _measure(lambda: [matcher(t) for t in tags], repeat, Counter())
+    r.update(common, phase='matcher', per_instance_us=r['wall_s'] / max(len(tags), 1) * 1e6)
+    results.append(r)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', choices=sorted(SCALES), default=None,
+                        help='Fleet size preset; overrides --instances.')
+    parser.add_argument('--instances', '-n', type=int, default=1000)
+    parser.add_argument('--regions', '-m', type=int, default=4, help='Up to {}.'.format(len(REGIONS)))
+    parser.add_argument('--backend', choices=['stub', 'moto'], default='stub')
+    parser.add_argument('--engine', choices=['client', 'resource'], default='client',
+                        help='The resource engine needs the moto backend.')
+    parser.add_argument('--workers', '-w', type=int, default=1)
+    parser.add_argument('--page-size', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', action='store_true', help='Print results as JSON lines.')
+    args = parser.parse_args(argv)
+    if args.engine == 'resource' and args.backend != 'moto':
+        parser.error('--engine resource needs --backend moto')
+
+    # measure with logging off, as it would be in production
+    logging.disable(logging.CRITICAL)
+    instances = SCALES[args.scale] if args.scale else args.instances
+    results = run(instances, args.regions, backend=args.backend, engine=args.engine,
+                  workers=args.workers, page_size=args.page_size, repeat=args.repeat)
+
+    for r in results:
+        if args.json:
+            print(json.dumps(r, sort_keys=True))
+            continue
+        line = '{phase:8} {instances} instances / {regions} regions ({backend}, {engine}, {workers} workers): ' \
+               '{wall_s:.3f}s, peak {peak_mb:.1f}MB'.format(peak_mb=r['peak_bytes'] / 1048576.0, **r)
+        if r['api_calls']:
+            line += ', API calls {}'.format(', '.join('{}={}'.format(k, v) for k, v in sorted(r['api_calls'].items())))
+        if 'per_instance_us' in r:
+            line += ', {:.2f}us/instance'.format(r['per_instance_us'])
+        print(line)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+"""Reaperlog record memory benchmark.
+
+Holds a sweep's worth of reaperlog entries in memory, once as the dicts
+`reap` used to return (boto tag lists and tz-aware datetimes) and once as
+`Decision` records, and reports peak traced memory and build time for
+each. Run from the repo root:
+
+    python -m benchmarks.bench_records [--instances 100000] [--json]
+
+`bench_reap` measures the same thing end to end, through a full sweep.
+"""
+
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+
+from benchmarks.fleet import synthetic_fleet
+from ec2_reaper.decision import Decision
+from ec2_reaper.matcher import tag_dict
+from ec2_reaper.state import epoch
+
+
+def _dicts(instances):
+    # copies, since each entry would otherwise keep its page's tag list and datetime alive
+    return [{'id': i['InstanceId'], 'tag_match': True, 'age_match': True,
+             'tags': [dict(t) for t in i['Tags']], 'launch_time': i['LaunchTime'].replace(),
+             'reaped': False, 'region': 'us-east-1', 'account': None, 'policy': None}
+            for i in instances]
+
+
+def _decisions(instances):
+    return [Decision(i['InstanceId'], True, True, tag_dict(i['Tags']), int(epoch(i['LaunchTime'])),
+                     'us-east-1')
+            for i in instances]
+
+
+def _measure(build, instances):
+    start = time.perf_counter()
+    build(instances)
+    wall_s = time.perf_counter() - start
+
+    tracemalloc.start()
+    try:
+        records = build(instances)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'wall_s': wall_s, 'peak_bytes': peak, 'records': len(records)}
+
+
+def run(instances=100000):
+    fleet = synthetic_fleet(instances, ['us-east-1'])['us-east-1']
+    results = []
+    for kind, build in (('dict', _dicts), ('decision', _decisions)):
+        r = _measure(build, fleet)
+        r.update(benchmark='records', kind=kind, instances=instances,
+                 bytes_per_record=r['peak_bytes'] / float(max(instances, 1)))
+        results.append(r)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--instances', '-n', type=int, default=100000)
+    parser.add_argument('--json', action='store_true', help='Print results as JSON lines.')
+    args = parser.parse_args(argv)
+
+    for r in run(args.instances):
+        if args.json:
+            print(json.dumps(r, sort_keys=True))
+            continue
+        print('{kind:8} {instances} records: {wall_s:.3f}s, peak {mb:.1f}MB, {bytes_per_record:.0f} bytes/record'.format(
+            mb=r['peak_bytes'] / 1048576.0, **r))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
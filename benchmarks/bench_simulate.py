@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+"""Offline policy simulation benchmark.
+
+Writes a synthetic fleet as a column-block inventory snapshot and, for
+comparison, as plain JSON Lines with one object per instance. Then times
+reading each back and working out what a policy would reap: the snapshot
+through `inventory.simulate`, the plain file one instance at a time, as
+`reap` checks instances. Run from the repo root:
+
+    python -m benchmarks.bench_simulate [--instances 1000000] [--gzip] [--json]
+"""
+
+import argparse
+import gzip
+import io
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from benchmarks.bench_matcher import MATCHERS
+from benchmarks.fleet import synthetic_tags
+from ec2_reaper import inventory
+from ec2_reaper.matcher import TagMatcher, tag_dict
+
+NOW = 1500000000.0
+
+
+def _clock():
+    return time.perf_counter() if hasattr(time, 'perf_counter') else time.time()
+
+
+def _open(path, mode):
+    return gzip.open(path, mode + 'b') if path.endswith('.gz') else io.open(path, mode + 'b')
+
+
+def synthetic_records(n, regions=4):
+    """`n` snapshot records, launched within the two days before `NOW`."""
+    return [{'id': 'i-{:017x}'.format(i), 'region': 'region-{}'.format(i % regions),
+             'account': None, 'launch_time': NOW - (i * 7919) % (2 * 86400), 'tags': tag_dict(tags)}
+            for i, tags in enumerate(synthetic_tags(n))]
+
+
+def _rows(path, min_age):
+    """Read one JSON object per line, checking each instance on its own."""
+    matcher = TagMatcher(MATCHERS, cache_size=0)
+    cutoff = NOW - min_age
+    reaped = 0
+    with _open(path, 'r') as f:
+        for line in f:
+            r = json.loads(line.decode('utf-8'))
+            ct, ca = matcher.match(r['tags']), r['launch_time'] < cutoff
+            if ct or ca:
+                entry = {'id': r['id'], 'tag_match': ct, 'age_match': ca, 'tags': r['tags'],
+                         'launch_time': r['launch_time'], 'reaped': ct and ca,
+                         'region': r['region'], 'account': r['account']}
+                reaped += entry['reaped']
+    return reaped
+
+
+def _snapshot(path, min_age):
+    with inventory.Snapshot(path) as snapshot:
+        return sum(1 for e in inventory.simulate(snapshot, MATCHERS, min_age, now=snapshot.exported_at)
+                   if e['reaped'])
+
+
+def run(instances=1000000, min_age=3600, compress=False):
+    records = synthetic_records(instances)
+    suffix = '.gz' if compress else ''
+    tmp = tempfile.mkdtemp()
+    try:
+        rows_path = os.path.join(tmp, 'rows.jsonl' + suffix)
+        with _open(rows_path, 'w') as f:
+            for r in records:
+                f.write((json.dumps(r) + '\n').encode('utf-8'))
+
+        snapshot_path = os.path.join(tmp, 'inventory.jsonl' + suffix)
+        start = _clock()
+        inventory.export(snapshot_path, records=records, now=NOW)
+        export_s = _clock() - start
+
+        start = _clock()
+        rows_reaped = _rows(rows_path, min_age)
+        rows_s = _clock() - start
+
+        start = _clock()
+        reaped = _snapshot(snapshot_path, min_age)
+        simulate_s = _clock() - start
+        rows_bytes, snapshot_bytes = os.path.getsize(rows_path), os.path.getsize(snapshot_path)
+    finally:
+        shutil.rmtree(tmp)
+
+    assert rows_reaped == reaped
+    return [{'benchmark': 'simulate', 'instances': instances, 'reaped': reaped, 'gzip': compress,
+             'rows_bytes': rows_bytes, 'snapshot_bytes': snapshot_bytes, 'export_s': export_s,
+             'rows_s': rows_s, 'simulate_s': simulate_s, 'speedup': rows_s / simulate_s}]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--instances', '-n', type=int, default=1000000)
+    parser.add_argument('--min-age', type=int, default=3600)
+    parser.add_argument('--gzip', action='store_true', help='Gzip the snapshot.')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON.')
+    args = parser.parse_args(argv)
+
+    logging.disable(logging.CRITICAL)
+    for r in run(args.instances, args.min_age, args.gzip):
+        if args.json:
+            print(json.dumps(r, sort_keys=True))
+            continue
+        print('{instances} instances, {reaped} would be reaped'.format(**r))
+        print('  export snapshot:             {export_s:.3f}s'.format(**r))
+        print('  one object per line:         {rows_s:.3f}s  ({mb:.1f}MB)'.format(
+            mb=r['rows_bytes'] / 1048576.0, **r))
+        print('  snapshot and simulate():     {simulate_s:.3f}s  ({mb:.1f}MB, {speedup:.1f}x)'.format(
+            mb=r['snapshot_bytes'] / 1048576.0, **r))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
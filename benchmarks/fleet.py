@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+"""Synthetic fleets for the benchmarks, plus a local stand-in for the EC2 API."""
+
+import datetime
+import random
+from collections import Counter, OrderedDict
+
+import pytz
+
+
+def synthetic_tags(n, groups=200, unique=0.05, seed=42):
+    """Build `n` boto-style tag lists.
+
+    Most instances belong to one of `groups` autoscaling groups sharing a tag
+    set; a `unique` fraction get tags of their own.
+    """
+    rnd = random.Random(seed)
+    names = ['web', 'worker', 'cirunner', 'db', 'cache', '']
+    envs = ['prod', 'staging', 'sandbox', 'scratch']
+
+    def _make(i):
+        tags = [{'Key': 'aws:autoscaling:groupName', 'Value': 'asg-{}'.format(i)},
+                {'Key': 'env', 'Value': rnd.choice(envs)},
+                {'Key': 'team', 'Value': 'team-{}'.format(rnd.randint(0, 20))}]
+        if rnd.random() < 0.9:
+            tags.append({'Key': 'Name', 'Value': rnd.choice(names)})
+        if rnd.random() < 0.1:
+            tags.append({'Key': 'reapme', 'Value': 'yes'})
+        return tags
+
+    shared = [_make(g) for g in range(groups)]
+    # boto hands every instance its own tag list, so copy the shared ones
+    return [_make(groups + i) if rnd.random() < unique else
+            [dict(t) for t in shared[rnd.randrange(groups)]]
+            for i in range(n)]
+
+
+def synthetic_fleet(n, regions, seed=42):
+    """Spread `n` instances over `regions`, launched within the last two days.
+
+    Returns `{region: [DescribeInstances-style instance dicts]}`.
+    """
+    rnd = random.Random(seed)
+    now = datetime.datetime.now(pytz.utc)
+    fleet = OrderedDict((r, []) for r in regions)
+    for n, tags in enumerate(synthetic_tags(n, seed=seed)):
+        fleet[regions[n % len(regions)]].append({
+            'InstanceId': 'i-{:017x}'.format(n),
+            'LaunchTime': now - datetime.timedelta(seconds=rnd.randint(0, 2 * 86400)),
+            'Tags': tags,
+            'State': {'Code': 16, 'Name': 'running'},
+        })
+    return fleet
+
+
+def launch_moto(fleet):
+    """Launch `fleet` into moto, one RunInstances call per distinct tag set and region.
+
+    moto stamps its own launch times, so every instance is brand new.
+    """
+    import boto3
+    for region, instances in fleet.items():
+        client = boto3.client('ec2', region_name=region)
+        groups = Counter(tuple((t['Key'], t['Value']) for t in i['Tags']) for i in instances)
+        for tags, count in groups.items():
+            params = {'ImageId': 'ami-1234abcd', 'MinCount': count, 'MaxCount': count}
+            if tags:
+                params['TagSpecifications'] = [{'ResourceType': 'instance',
+                                                'Tags': [{'Key': k, 'Value': v} for k, v in tags]}]
+            client.run_instances(**params)
+
+
+def _parsed(instance):
+    # botocore parses every response afresh, so nothing is shared between sweeps
+    return dict(instance, Tags=[dict(t) for t in instance['Tags']],
+                LaunchTime=instance['LaunchTime'].replace())
+
+
+class FakeEC2Client(object):
+    """Just enough of an EC2 client to run `reap()` against an in-memory fleet.
+
+    Serves DescribeInstances pages and accepts TerminateInstances, counting
+    calls by operation name. Only the instance-state-name filter is honoured.
+    """
+
+    def __init__(self, instances):
+        self.instances = instances
+        self.calls = Counter()
+
+    def get_paginator(self, operation):
+        assert operation == 'describe_instances'
+        return self
+
+    def paginate(self, Filters=None, PaginationConfig=None):
+        page_size = (PaginationConfig or {}).get('PageSize', 1000)
+        states = set()
+        for f in Filters or []:
+            if f['Name'] == 'instance-state-name':
+                states.update(f['Values'])
+        instances = [i for i in self.instances if not states or i['State']['Name'] in states]
+        for n in range(0, max(len(instances), 1), page_size):
+            self.calls['DescribeInstances'] += 1
+            yield {'Reservations': [{'Instances': [_parsed(i) for i in instances[n:n + page_size]]}]}
+
+    def terminate_instances(self, InstanceIds):
+        self.calls['TerminateInstances'] += 1
+        return {'TerminatingInstances': [{'InstanceId': i} for i in InstanceIds]}
@@ -8,17 +8,58 @@ __author__ = """Shaun Martin"""
 __email__ = 'shaun@samsite.ca'
 __version__ = '0.1.8'
 
-if sys.version_info >= (3, 0):
+# names re-exported from submodules, which are only imported on first use so
+# that eg: `ec2-reaper --help` or `ec2_reaper.matcher` don't pay for boto3.
+_LAZY_ATTRS = {
+    'reap': 'ec2_reaper.ec2_reaper',
+    'reap_iter': 'ec2_reaper.ec2_reaper',
+    'DEFAULT_TAG_MATCHER': 'ec2_reaper.ec2_reaper',
+    'DEFAULT_MIN_AGE': 'ec2_reaper.ec2_reaper',
+    'DEFAULT_REGIONS': 'ec2_reaper.ec2_reaper',
+    'DEFAULT_WORKERS': 'ec2_reaper.ec2_reaper',
+    'DEFAULT_PUSHDOWN': 'ec2_reaper.ec2_reaper',
+    'DEFAULT_ENGINE': 'ec2_reaper.ec2_reaper',
+    'DEFAULT_PAGE_SIZE': 'ec2_reaper.ec2_reaper',
+    'LOCAL_TZ': 'ec2_reaper.ec2_reaper',
+}
+_LAZY_MODULES = ('aws_lambda',)
+
+if sys.version_info >= (3, 7):
+    import importlib
+
+    def __getattr__(name):
+        if name in _LAZY_ATTRS:
+            value = getattr(importlib.import_module(_LAZY_ATTRS[name]), name)
+        elif name in _LAZY_MODULES:
+            value = importlib.import_module('{}.{}'.format(__name__, name))
+        else:
+            raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+        globals()[name] = value
+        return value
+
+    def __dir__():
+        return sorted(set(globals()) | set(_LAZY_ATTRS) | set(_LAZY_MODULES))
+elif sys.version_info >= (3, 0):
     from ec2_reaper.ec2_reaper import reap
+    from ec2_reaper.ec2_reaper import reap_iter
     from ec2_reaper.ec2_reaper import DEFAULT_TAG_MATCHER
     from ec2_reaper.ec2_reaper import DEFAULT_MIN_AGE
     from ec2_reaper.ec2_reaper import DEFAULT_REGIONS
+    from ec2_reaper.ec2_reaper import DEFAULT_WORKERS
+    from ec2_reaper.ec2_reaper import DEFAULT_PUSHDOWN
+    from ec2_reaper.ec2_reaper import DEFAULT_ENGINE
+    from ec2_reaper.ec2_reaper import DEFAULT_PAGE_SIZE
     from ec2_reaper.ec2_reaper import LOCAL_TZ
     from ec2_reaper import aws_lambda
 else:
     from ec2_reaper import reap
+    from ec2_reaper import reap_iter
     from ec2_reaper import DEFAULT_TAG_MATCHER
     from ec2_reaper import DEFAULT_MIN_AGE
     from ec2_reaper import DEFAULT_REGIONS
+    from ec2_reaper import DEFAULT_WORKERS
+    from ec2_reaper import DEFAULT_PUSHDOWN
+    from ec2_reaper import DEFAULT_ENGINE
+    from ec2_reaper import DEFAULT_PAGE_SIZE
     from ec2_reaper import LOCAL_TZ
     import aws_lambda
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+"""Cross-account access for EC2 Reaper via STS AssumeRole.
+
+Credentials for each role are cached in-process until shortly before they
+expire, so warm Lambda containers and `--watch` sweeps only call STS about
+once an hour per role.
+"""
+
+import logging
+import threading
+import time
+
+from ec2_reaper import clients
+from ec2_reaper.state import epoch
+
+DEFAULT_SESSION_NAME = 'ec2-reaper'
+DEFAULT_DURATION = 3600
+DEFAULT_ACCOUNT_WORKERS = 4
+
+# refresh credentials this many seconds before they expire
+REFRESH_MARGIN = 300
+
+log = logging.getLogger()
+
+_cache = {}
+_locks = {}
+_lock = threading.Lock()
+
+
+def account_id(role_arn):
+    """Pull the account ID out of a role ARN, eg: arn:aws:iam::123456789012:role/reaper"""
+    parts = role_arn.split(':')
+    if len(parts) < 6 or parts[0] != 'arn' or not parts[4]:
+        raise ValueError('Not a role ARN: {}'.format(role_arn))
+    return parts[4]
+
+
+def load_accounts(path):
+    """Read role ARNs from a file, one per line. Blank lines and #comments are skipped."""
+    with open(path) as f:
+        lines = (line.split('#', 1)[0].strip() for line in f)
+        return [line for line in lines if line]
+
+
+def assume_role(role_arn, session_name=DEFAULT_SESSION_NAME, duration=DEFAULT_DURATION):
+    """assume_role - Get credentials for `role_arn`, reusing cached ones while they're fresh
+
+    Returns a dict of `aws_access_key_id`, `aws_secret_access_key` and
+    `aws_session_token`, ready for `clients.get_client`.
+    """
+    with _lock:
+        role_lock = _locks.setdefault(role_arn, threading.Lock())
+
+    # one STS call per role, even with several threads asking at once
+    with role_lock:
+        cached = _cache.get(role_arn)
+        if cached and cached['expires'] - REFRESH_MARGIN > time.time():
+            return cached['credentials']
+
+        log.debug('Assuming role {}'.format(role_arn))
+        sts = clients.get_client('sts', None)
+        r = sts.assume_role(RoleArn=role_arn, RoleSessionName=session_name,
+                            DurationSeconds=duration)
+        c = r['Credentials']
+        credentials = {'aws_access_key_id': c['AccessKeyId'],
+                       'aws_secret_access_key': c['SecretAccessKey'],
+                       'aws_session_token': c['SessionToken']}
+        _cache[role_arn] = {'credentials': credentials, 'expires': epoch(c['Expiration'])}
+        if cached:
+            # clients for the old credentials won't be used again
+            clients.forget(cached['credentials'])
+        return credentials
+
+
+def clear_cache():
+    with _lock:
+        _cache.clear()
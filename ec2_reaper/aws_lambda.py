@@ -1,13 +1,24 @@
-from datetime import datetime, timedelta
+from datetime import datetime
 import logging
-import requests
 import os
 import sys
 import json
 import pytz
+import time
 
 import ec2_reaper
-from ec2_reaper import reap
+from ec2_reaper import reap_iter
+from ec2_reaper import events
+from ec2_reaper.policy import load_policies
+from ec2_reaper.accounts import DEFAULT_ACCOUNT_WORKERS, account_id
+from ec2_reaper import slack
+# DateTimeJSONEncoder lived here before moving to slack; re-exported for existing callers
+from ec2_reaper.slack import DateTimeJSONEncoder  # noqa: F401
+from ec2_reaper.stats import DEFAULT_NAMESPACE, ReapStats
+from ec2_reaper.summary import ReapSummary
+
+# fanout, scheduler, sinks and state are imported by the branches of the handler
+# which use them, so that cold starts only load what their configuration needs.
 
 def _is_py3():
     return sys.version_info >= (3, 0)
@@ -18,11 +29,60 @@ MIN_AGE = os.environ.get('MIN_AGE', ec2_reaper.DEFAULT_MIN_AGE)
 REGIONS = os.environ.get('REGIONS', ec2_reaper.DEFAULT_REGIONS)
 REGIONS = REGIONS.split(' ') if isinstance(REGIONS, str) else REGIONS
 
+WORKERS = int(os.environ.get('WORKERS', ec2_reaper.DEFAULT_WORKERS))
+PUSHDOWN = str(os.environ.get('PUSHDOWN', ec2_reaper.DEFAULT_PUSHDOWN)).lower() == 'true'
+SCAN_ENGINE = os.environ.get('SCAN_ENGINE', ec2_reaper.DEFAULT_ENGINE)
+PAGE_SIZE = int(os.environ.get('PAGE_SIZE', ec2_reaper.DEFAULT_PAGE_SIZE))
+
+# IAM roles to assume, one per account to reap. space separated string.
+ROLES = os.environ.get('ROLES', '').split()
+ACCOUNT_WORKERS = int(os.environ.get('ACCOUNT_WORKERS', DEFAULT_ACCOUNT_WORKERS))
+
 strclasses = str if _is_py3() else (str, unicode)
 TAG_MATCHER = os.environ.get('TAG_MATCHER', ec2_reaper.DEFAULT_TAG_MATCHER)
 TAG_MATCHER = json.loads(TAG_MATCHER) if isinstance(TAG_MATCHER, strclasses) else TAG_MATCHER
 
+# named policies, each with its own tags and min_age, as a JSON list or a file holding one.
+# all of them are evaluated in one scan, replacing TAG_MATCHER and MIN_AGE.
+POLICIES = os.environ.get('POLICIES', None)
+POLICIES = load_policies(POLICIES) if POLICIES else None
+
 SLACK_ENDPOINT = os.environ.get('SLACK_ENDPOINT', None)
+SLACK_RETRIES = int(os.environ.get('SLACK_RETRIES', slack.DEFAULT_RETRIES))
+SLACK_TIMEOUT = float(os.environ.get('SLACK_TIMEOUT', slack.DEFAULT_TIMEOUT))
+
+# 'full' returns every reaperlog entry in the response body, 'summary' only the counts.
+# big fleets can blow through Lambda's 6MB response limit in 'full' mode.
+RESPONSE_MODE = os.environ.get('RESPONSE_MODE', 'full').lower()
+
+# where to write the full reaperlog as gzipped JSON Lines, eg: s3://bucket/prefix
+LOG_SINK = os.environ.get('LOG_SINK', None)
+
+# SQLite file to keep instance state in, eg: /tmp/reaper.db. /tmp only lasts as long
+# as the container, so this mostly saves work across warm invocations.
+STATE_DB = os.environ.get('STATE_DB', None)
+
+# SQLite file to queue too-young matches in until they're old enough to reap. with
+# this set, {"action": "recheck"} events only check instances which have just expired.
+EXPIRY_DB = os.environ.get('EXPIRY_DB', None)
+
+# print CloudWatch Embedded Metric Format lines at the end of each run
+METRICS = str(os.environ.get('METRICS', True)).lower() != 'false'
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', DEFAULT_NAMESPACE)
+
+# fan sweeps out to worker invocations, one per shard: 'region' shards by region,
+# 'account' by account (one per ROLES entry) and region. off by default.
+FANOUT = os.environ.get('FANOUT', '').lower()
+FANOUT = FANOUT if FANOUT not in ('', 'off', 'false') else None
+if FANOUT is not None:
+    from ec2_reaper import fanout
+    if FANOUT not in fanout.SHARD_BY:
+        raise ValueError('FANOUT must be one of {}, got {}'.format(fanout.SHARD_BY, FANOUT))
+# how workers are invoked ('lambda' or 'local'), and which function they run in
+FANOUT_INVOKER = os.environ.get('FANOUT_INVOKER', 'lambda')
+FANOUT_FUNCTION = os.environ.get('FANOUT_FUNCTION', None)
+# worker invocations in flight at once. Default: every shard at once
+FANOUT_WORKERS = int(os.environ['FANOUT_WORKERS']) if os.environ.get('FANOUT_WORKERS') else None
 
 DEBUG = os.environ.get('DEBUG', True)
 log.debug('startup: got value for DEBUG: {} ({})'.format(DEBUG, type(DEBUG)))
@@ -39,64 +99,269 @@ else:
     logging.getLogger('botocore').setLevel(logging.WARNING)
     logging.getLogger('boto3').setLevel(logging.WARNING)
 
-# so that we can send tz-aware datetimes through json
-class DateTimeJSONEncoder(json.JSONEncoder):
-    def default(self, o):
-        if isinstance(o, datetime):
-            return o.isoformat()
-        return json.JSONEncoder.default(self, o)
-
 def _respond(body, error=True, headers=None, status_code=500):
     o = {'statusCode': status_code}
     if headers:
         o['headers'] = headers
 
     # just in case body contains untranslatable datetimes
-    o['body'] = json.loads(json.dumps(body, cls=DateTimeJSONEncoder))
+    from ec2_reaper.sinks import jsonable
+    o['body'] = jsonable(body)
     return o
 
+def _log_name(context, shard=None):
+    run_id = getattr(context, 'aws_request_id', None) or os.getpid()
+    if shard is not None:
+        # in-process workers share a pid
+        run_id = '-'.join([str(run_id)] + (shard.get('regions') or []) +
+                          [account_id(r) for r in shard.get('roles') or []])
+    return 'reaperlog-{}-{}.jsonl.gz'.format(datetime.utcnow().strftime('%Y%m%dT%H%M%SZ'), run_id)
+
 def _get_expires(launch_time, min_age=MIN_AGE):
     # if launch_time is naive, assume UTC
     if launch_time.tzinfo is None or launch_time.tzinfo.utcoffset(launch_time) is None:
         launch_time = launch_time.replace(tzinfo=pytz.utc)
-    min_age_dt = datetime.now() - timedelta(seconds=min_age)
-    min_age_dt = min_age_dt.replace(tzinfo=ec2_reaper.LOCAL_TZ)
-    log.info('Comparing launch_time {} to min_age_dt {}'.format(launch_time, min_age_dt))
-    return (launch_time - min_age_dt).seconds
+    from ec2_reaper.scheduler import expires_at
+    return int(expires_at(launch_time, min_age) - time.time())
 
 
-def _notify(msg, attachments=[]):
+def _notify(msg, attachments=[], stats=None):
     if not SLACK_ENDPOINT:
         log.warning('Slack endpoint not configured!')
         return -1
 
-    data = {'text': msg, 'attachments': attachments}
-    headers = {'Content-Type': 'application/json'}
-    r = requests.post(SLACK_ENDPOINT, headers=headers,
-                      data=json.dumps(data, cls=DateTimeJSONEncoder))
+    return slack.post(SLACK_ENDPOINT, msg, attachments, retries=SLACK_RETRIES,
+                      timeout=SLACK_TIMEOUT, stats=stats)
+
+
+def _notify_all(notifications, stats=None):
+    """Send each `(msg, attachments)` at the same time. Returns their status codes."""
+    if len(notifications) < 2:
+        return [_notify(msg, attachments, stats=stats) for msg, attachments in notifications]
 
-    if r.status_code != 200:
-        log.error('Slack notification failed: (HTTP {}) {}'.format(r.status_code, r.text))
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=len(notifications)) as pool:
+        futures = [pool.submit(_notify, msg, attachments, stats=stats)
+                   for msg, attachments in notifications]
+        return [f.result() for f in futures]
 
-    return r.status_code
+
+def _account_field(entry):
+    account = entry.get('account')
+    return [{'title': 'Account', 'value': account, 'short': True}] if account else []
+
+
+def _policy_field(entry):
+    policy = entry.get('policy')
+    return [{'title': 'Policy', 'value': policy, 'short': True}] if policy else []
+
+
+def _min_age(entry):
+    """The min_age `entry` is judged by: its policy's, or MIN_AGE."""
+    return POLICIES.min_age_of(entry.get('policy')) if POLICIES is not None else MIN_AGE
+
+
+def _reap_entries(targets, stats, state, account=None, shard=None):
+    """Sweep everything, or if `targets` is set, only check the instances it names.
+
+    account: The account an event came from. Instances in accounts listed in
+        ROLES are checked by assuming that account's role
+    shard: A fan-out shard's `{'regions': [...], 'roles': [...]}` to sweep in place of REGIONS and ROLES
+    """
+    kwargs = {'min_age': MIN_AGE, 'debug': DEBUG, 'engine': SCAN_ENGINE, 'page_size': PAGE_SIZE,
+              'stats': stats, 'state': state, 'policies': POLICIES}
+    if shard is not None:
+        return reap_iter(TAG_MATCHER, regions=shard.get('regions'), workers=WORKERS,
+                         pushdown=PUSHDOWN, roles=shard.get('roles'),
+                         account_workers=ACCOUNT_WORKERS, **kwargs)
+    if targets is None:
+        return reap_iter(TAG_MATCHER, regions=REGIONS, workers=WORKERS, pushdown=PUSHDOWN,
+                         roles=ROLES, account_workers=ACCOUNT_WORKERS, **kwargs)
+
+    kwargs['roles'] = [r for r in ROLES if account_id(r) == account] or None
+
+    if REGIONS:
+        ignored = [r for r in targets if r not in REGIONS]
+        if ignored:
+            log.info('Ignoring event for regions outside of REGIONS: {}'.format(ignored))
+        targets = dict((r, ids) for r, ids in targets.items() if r in REGIONS)
+    return (entry for region, ids in sorted(targets.items())
+            for entry in reap_iter(TAG_MATCHER, regions=region, instance_ids=ids, **kwargs))
 
 
 def handler(event, context):
     log.info("starting lambda_ec2_reaper at " + str(datetime.now()))
 
-    log.debug('Filter expression set: {}'.format(TAG_MATCHER))
-    log.debug('Minimum age set to {} seconds'.format(MIN_AGE))
+    # only fan-out and its workers need the fan-out protocol
+    fanning = FANOUT or (isinstance(event, dict) and 'action' in event)
+    if fanning:
+        from ec2_reaper import fanout
+
+    # fan-out workers sweep the shard they're given and hand the results back
+    if fanning and fanout.is_worker(event):
+        return _work(event.get('shard') or {}, context)
+
+    # EC2 and CloudTrail events only need the instances they name checking
+    recheck = events.is_recheck(event)
+    targets = None if recheck else events.instance_targets(event)
+    if targets is not None:
+        log.info('Checking instances named by the event: {}'.format(targets))
+
+    if POLICIES is not None:
+        for p in POLICIES.policies:
+            log.debug('Policy {}: {} after {} seconds'.format(p.name, p.tags, p.min_age))
+    else:
+        log.debug('Filter expression set: {}'.format(TAG_MATCHER))
+        log.debug('Minimum age set to {} seconds'.format(MIN_AGE))
     if not REGIONS:
         log.debug('Searching all available regions.')
     else:
         log.debug('Searching the following regions: {}'.format(REGIONS))
+    log.debug('Scanning with {} workers'.format(WORKERS))
+    log.debug('Server-side tag filtering {}'.format('on' if PUSHDOWN else 'off'))
+
+    if targets is None and not recheck and fanning and (FANOUT or fanout.is_fanout(event)):
+        summary, stats, extra = _orchestrate()
+        mode = 'fanout'
+    else:
+        summary, stats, extra = _sweep(recheck, targets, event, context)
+        mode = 'recheck' if recheck else 'sweep' if targets is None else 'event'
+
+    _report(summary, stats)
+
+    stats.finish()
+    # fan-out workers emit their own metrics
+    if METRICS and mode != 'fanout':
+        _emit_metrics(stats)
+
+    r = summary.as_dict()
+    r['mode'] = mode
+    r.update(extra)
+    if summary.log is not None:
+        r['log'] = summary.log
+    r['stats'] = stats.as_dict()
+    return _respond(r, error=False, status_code=200)
+
+
+def _sweep(recheck, targets, event, context, shard=None):
+    """Reap, recheck or check an event's instances, depending on what's asked.
+
+    shard: Sweep only this fan-out shard's regions and roles
+
+    Returns `(summary, stats, extra response body)`.
+    """
+    stats = ReapStats()
+    # fan-out workers only hand their log back through LOG_SINK, never in their response
+    summary = ReapSummary(keep_matches=True, keep_log=RESPONSE_MODE != 'summary' and shard is None)
+    if LOG_SINK:
+        from ec2_reaper.sinks import get_sink
+        writer = get_sink(LOG_SINK).open(_log_name(context, shard))
+    else:
+        writer = None
+    if STATE_DB:
+        from ec2_reaper.state import StateStore
+        state = StateStore(STATE_DB)
+    else:
+        state = None
+    if recheck or EXPIRY_DB:
+        from ec2_reaper import scheduler
+    expiries = scheduler.SQLiteExpiryQueue(EXPIRY_DB) if EXPIRY_DB else None
+    extra = {}
+    try:
+        if recheck:
+            if expiries is None:
+                log.warning('Got a recheck event, but EXPIRY_DB is not set')
+                entries = []
+            else:
+                entries = scheduler.recheck(expiries, TAG_MATCHER, min_age=MIN_AGE, debug=DEBUG,
+                                            engine=SCAN_ENGINE, page_size=PAGE_SIZE, stats=stats,
+                                            state=state, roles=ROLES, policies=POLICIES)
+        else:
+            account = event.get('account') if targets is not None else None
+            entries = _reap_entries(targets, stats, state, account=account, shard=shard)
+            if expiries is not None:
+                entries = scheduler.schedule(expiries, entries, POLICIES or MIN_AGE)
+
+        for entry in entries:
+            summary.add(entry)
+            if writer is not None:
+                writer.write(entry)
+        if expiries is not None:
+            extra['next_expiry'] = expiries.next_due()
+    finally:
+        if writer is not None:
+            writer.close()
+        if state is not None:
+            state.close()
+        if expiries is not None:
+            expiries.close()
+    if writer is not None:
+        extra['log_location'] = writer.location
+    return summary, stats, extra
 
-    reaperlog = reap(TAG_MATCHER, min_age=MIN_AGE, regions=REGIONS, debug=DEBUG)
+
+def _work(shard, context):
+    """Sweep a fan-out shard, returning everything the orchestrator needs to merge."""
+    from ec2_reaper import fanout
+
+    log.info('Sweeping shard {}'.format(shard))
+    summary, stats, extra = _sweep(False, None, {}, context, shard=shard)
+    stats.finish()
+    if METRICS:
+        _emit_metrics(stats)
+    r = fanout.worker_body(summary)
+    r['mode'] = 'worker'
+    r['shard'] = shard
+    r.update(extra)
+    r['stats'] = stats.as_dict()
+    return _respond(r, error=False, status_code=200)
+
+
+def _orchestrate():
+    """Split a sweep into shards, sweep each with a worker and merge the results."""
+    from ec2_reaper import fanout
+    from ec2_reaper.regions import get_regions
+
+    regions = REGIONS or None
+    if not regions and not (FANOUT == fanout.BY_ACCOUNT and ROLES):
+        regions = list(get_regions())
+    shards = fanout.shards(regions, ROLES, by=FANOUT or fanout.BY_REGION)
+    log.info('Fanning out over {} shards with the {} invoker'.format(len(shards), FANOUT_INVOKER))
+    kwargs = {'function': FANOUT_FUNCTION} if FANOUT_FUNCTION else {}
+    invoker = fanout.get_invoker(FANOUT_INVOKER, **kwargs)
+
+    stats = ReapStats()
+    # workers' logs are only in LOG_SINK, listed in log_locations
+    summary = ReapSummary(keep_matches=True)
+    failed, next_expiry, locations = [], [], []
+    for shard, body, error in fanout.dispatch(invoker, shards, workers=FANOUT_WORKERS):
+        if error is not None:
+            failed.append({'shard': shard, 'error': str(error)})
+            continue
+        summary.merge(fanout.worker_summary(body))
+        stats.merge(body.get('stats', {}))
+        if body.get('next_expiry') is not None:
+            next_expiry.append(body['next_expiry'])
+        if body.get('log_location'):
+            locations.append(body['log_location'])
+
+    extra = {'shards': len(shards), 'failed_shards': failed}
+    if next_expiry:
+        extra['next_expiry'] = min(next_expiry)
+    if locations:
+        extra['log_locations'] = locations
+    return summary, stats, extra
+
+
+def _report(summary, stats):
+    """Send the reaped and too-young reports to Slack."""
+    # the reaped and too-young reports go out together once both are built
+    notifications = []
 
     # notify slack if anything was reaped
-    reaped = [i for i in reaperlog if i['reaped']]
+    reaped = summary.reaped
     log.info('{} instances reaped out of {} matched in {} regions.'.format(
-        len(reaped), len(reaperlog), len(REGIONS) if REGIONS else 'all'))
+        len(reaped), summary.instances, len(REGIONS) if REGIONS else 'all'))
     if len(reaped) > 0:
         msg = "The following instances have been terminated:"
         attachments = []
@@ -108,15 +373,15 @@ def handler(event, context):
                     {'title': 'Launch Time', 'value': i['launch_time'], 'short': True},
                     {'title': 'Region', 'value': i['region'], 'short': True},
                     {'title': 'Tags', 'value': i['tags'], 'short': True},
-                ]
+                ] + _account_field(i) + _policy_field(i)
             })
-        _notify(msg, attachments)
+        notifications.append((msg, attachments))
 
     # notify slack if anything matches but isn't old enough to be reaped
-    too_young = [i for i in reaperlog if i['tag_match'] and not i['age_match'] and not i['reaped']]
+    too_young = summary.too_young
     if len(too_young) > 0:
         log.info('{} instances out of {} matched were too young to reap.'.format(
-            len(too_young), len(reaperlog)))
+            len(too_young), summary.instances))
 
         msg = '@channel *WARNING*: The following instances are active but do not have tags. If they are left running untagged, they will be _*terminated*_.'
         attachments = []
@@ -127,14 +392,17 @@ def handler(event, context):
                 'fields': [
                     {'title': 'Launch Time', 'value': i['launch_time'], 'short': True},
                     {'title': 'Expires In', 'short': True,
-                        'value': "{} secs".format(_get_expires(i['launch_time']))},
+                        'value': "{} secs".format(_get_expires(i['launch_time'], _min_age(i)))},
                     {'title': 'Region', 'value': i['region'], 'short': True},
                     {'title': 'Tags', 'value': i['tags'], 'short': True},
-                ]
+                ] + _account_field(i) + _policy_field(i)
             })
-        _notify(msg, attachments)
+        notifications.append((msg, attachments))
 
-    r = {'reaped': len(reaped), 'matches_under_min_age': len(too_young),
-         'tag_matches': len([i for i in reaperlog if i['tag_match']]),
-         'instances': len(reaperlog), 'log': reaperlog}
-    return _respond(r, error=False, status_code=200)
+    _notify_all(notifications, stats=stats)
+
+
+def _emit_metrics(stats):
+    # Lambda ships stdout to CloudWatch Logs, which turns EMF lines into metrics
+    for doc in stats.to_emf(METRICS_NAMESPACE):
+        print(json.dumps(doc))
@@ -5,26 +5,105 @@
 import click
 import json
 import logging
-import botocore
 import sys
+import threading
+import time
 from datetime import datetime
 
+import ec2_reaper
+import ec2_reaper.accounts
+import ec2_reaper.regions
+import ec2_reaper.scan
+from ec2_reaper.matcher import TagMatcher
+from ec2_reaper.policy import load_policies
+from ec2_reaper.stats import ReapStats
+from ec2_reaper.summary import ReapSummary
+
+# state, scheduler, watch, inventory, output and plan are imported by the
+# commands and options which use them, to keep `ec2-reaper --help` quick.
+
 log = logging.getLogger()
 log.setLevel(logging.INFO)
 ch = logging.StreamHandler()
 log.addHandler(ch)
 
-
-try:
-    import ec2_reaper
-except botocore.exceptions.NoCredentialsError as e:
-    log.error('boto3 was unable to find any AWS credentials. Please run `aws configure`')
-    sys.exit(1)
-
 def _is_py3():
     return sys.version_info >= (3, 0)
 
-@click.command()
+class DefaultGroup(click.Group):
+    """A group which runs `default` when not given one of its commands.
+
+    Keeps `ec2-reaper [options] <tag matcher>` working alongside subcommands.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.default = kwargs.pop('default')
+        super(DefaultGroup, self).__init__(*args, **kwargs)
+
+    def parse_args(self, ctx, args):
+        if args != ['--help'] and (not args or args[0] not in self.commands):
+            args.insert(0, self.default)
+        return super(DefaultGroup, self).parse_args(ctx, args)
+
+
+@click.group(cls=DefaultGroup, default='reap')
+def main():
+    """ec2-reaper [reap] [options] <JSON filter expression>
+
+    Terminate running instances matching tag requirements and a minimum age.
+    Runs `reap` unless another command is given.
+    """
+
+
+def _roles(roles, accounts_file):
+    """Merge --role options with the ARNs in --accounts-file."""
+    return list(roles) + (ec2_reaper.accounts.load_accounts(accounts_file) if accounts_file else [])
+
+
+def _regions(regions):
+    regions = list(regions) if isinstance(regions, tuple) else regions
+    regions = regions if isinstance(regions, list) else [regions]
+    return [r.decode('utf-8') if not _is_py3() and isinstance(r, unicode) else r for r in regions]
+
+
+def _state(path):
+    """A `StateStore` for --state, or None."""
+    if not path:
+        return None
+    from ec2_reaper.state import StateStore
+    return StateStore(path)
+
+
+def _output_format(ctx, param, value):
+    """Check --output against `ec2_reaper.output`'s formats, only importing it when given."""
+    if value is not None:
+        from ec2_reaper import output
+        if value not in output.formats():
+            raise click.BadParameter('must be one of {}'.format(', '.join(output.formats())))
+    return value
+
+
+def _writer(output_format):
+    """An `ec2_reaper.output` writer to stdout for --output, or None."""
+    if not output_format:
+        return None
+    from ec2_reaper import output
+    # logs go to stderr, so stdout carries nothing but the records
+    return output.get_writer(output_format, sys.stdout)
+
+
+def _fraction(ctx, param, value):
+    """Check an option is between 0 and 1. click.FloatRange needs click 7."""
+    if value is not None and not 0 <= value <= 1:
+        raise click.BadParameter('{} is not between 0 and 1'.format(value))
+    return value
+
+
+def _default(value, default):
+    return default if value is None else value
+
+
+@main.command(short_help='Terminate matching instances. The default command.')
 @click.argument('tagfilterstr', type=click.STRING, default=json.dumps(ec2_reaper.DEFAULT_TAG_MATCHER))
 @click.option('--min-age', '-m', 'min_age', default=ec2_reaper.DEFAULT_MIN_AGE, type=click.INT,
     help='Instance must be (int)N seconds old before it will be considered for termination. Default: 300')
@@ -32,8 +111,52 @@ def _is_py3():
     help='Enable debug output and skip terminations.')
 @click.option('--regions', '-r', type=click.STRING, multiple=True, default=ec2_reaper.DEFAULT_REGIONS,
     help='One or more regions to search. Searches all available regions by default.')
-def main(tagfilterstr, min_age, dry_run, regions):
-    """ec2-reaper [--min-age <seconds>] [--region region-1 --region region-2 ...] [--dry-run] <JSON filter expression>
+@click.option('--workers', '-w', default=ec2_reaper.DEFAULT_WORKERS, type=click.INT,
+    help='Number of regions to scan concurrently. Default: 1')
+@click.option('--pushdown', '-p', 'pushdown', is_flag=True, default=ec2_reaper.DEFAULT_PUSHDOWN,
+    help='Filter on tags server-side where possible. Only tag matches are reported.')
+@click.option('--engine', '-e', type=click.Choice(ec2_reaper.scan.ENGINES), default=ec2_reaper.DEFAULT_ENGINE,
+    help='Scan with a low-level client (fast) or boto3 resource objects. Default: client')
+@click.option('--page-size', 'page_size', default=ec2_reaper.DEFAULT_PAGE_SIZE, type=click.IntRange(5, 1000),
+    help='Instances per DescribeInstances page. Default: 1000')
+@click.option('--region-cache', 'region_cache', type=click.Path(dir_okay=False), default=None,
+    help='Cache the list of available regions in this file.')
+@click.option('--region-cache-ttl', 'region_cache_ttl', type=click.INT,
+    default=ec2_reaper.regions.DEFAULT_REGION_CACHE_TTL,
+    help='Seconds a cached region list stays fresh for. Default: 86400')
+@click.option('--refresh-regions', 'refresh_regions', is_flag=True,
+    help='Look up available regions even if they are cached.')
+@click.option('--state', 'state_path', type=click.Path(dir_okay=False), default=None,
+    help='SQLite file to keep instance state and history in. Unchanged instances skip tag evaluation.')
+@click.option('--watch', is_flag=True,
+    help='Keep running, sweeping every --interval seconds until SIGTERM.')
+@click.option('--interval', default=None, type=click.IntRange(1),
+    help='Seconds between sweeps in --watch mode. Default: 300')
+@click.option('--min-interval', 'min_interval', default=None,
+    type=click.IntRange(1), help='Shortest the interval gets while matches are waiting to age. Default: 30')
+@click.option('--max-interval', 'max_interval', default=None,
+    type=click.IntRange(1), help='Longest the interval gets while sweeps find nothing. Default: 3600')
+@click.option('--jitter', default=None, type=click.FLOAT, callback=_fraction,
+    help='Randomly vary each interval by up to this fraction. Default: 0.1')
+@click.option('--role', 'roles', type=click.STRING, multiple=True,
+    help='IAM role ARN to assume, once per account to reap. Can be given more than once.')
+@click.option('--accounts-file', 'accounts_file', type=click.Path(exists=True, dir_okay=False), default=None,
+    help='File of role ARNs to assume, one per line.')
+@click.option('--account-workers', 'account_workers', default=ec2_reaper.accounts.DEFAULT_ACCOUNT_WORKERS,
+    type=click.IntRange(1), help='Number of accounts to scan concurrently. Default: 4')
+@click.option('--policies', type=click.STRING, default=None,
+    help='JSON list of named policies, or a file holding one, each with its own "tags" and "min_age". '
+         'Replaces the tag matcher and --min-age.')
+@click.option('--output', '-o', 'output_format', type=click.STRING, default=None, callback=_output_format,
+    help='Stream every matching instance\'s decision to stdout in this format (jsonl, csv or json) '
+         'as it is made.')
+@click.option('--plan-out', 'plan_out', type=click.Path(dir_okay=False, writable=True), default=None,
+    help='Write the instances this run would reap to a plan file for `apply`. Implies --dry-run.')
+def reap(tagfilterstr, min_age, dry_run, regions, workers, pushdown, engine, page_size,
+         region_cache, region_cache_ttl, refresh_regions, state_path, watch, interval,
+         min_interval, max_interval, jitter, roles, accounts_file, account_workers, policies,
+         output_format, plan_out):
+    """ec2-reaper [reap] [--min-age <seconds> | --policies <json or file>] [--region region-1 --region region-2 ...] [--workers N] [--pushdown] [--engine client|resource] [--page-size N] [--region-cache <file>] [--state <file>] [--watch [--interval N]] [--role <arn> ... | --accounts-file <file>] [--output jsonl|csv|json] [--plan-out <file>] [--dry-run] <JSON filter expression>
 
     Terminate running instances matching tag requirements and a minimum age
 
@@ -49,6 +172,10 @@ def main(tagfilterstr, min_age, dry_run, regions):
     - Instances must match *all* tag conditions if multiple are specified.
     - Stopped instances are always ignored.
     """
+    if plan_out:
+        if watch:
+            raise click.UsageError('--plan-out can\'t be used with --watch')
+        dry_run = True
     if dry_run:
         log.setLevel(logging.DEBUG)
         log.warning('Dry Run mode enabled.')
@@ -56,30 +183,280 @@ def main(tagfilterstr, min_age, dry_run, regions):
     logging.getLogger('botocore').setLevel(logging.WARNING)
     logging.getLogger('boto3').setLevel(logging.WARNING)
 
+    # botocore is only needed once we're actually talking to AWS
+    from botocore.exceptions import NoCredentialsError
+
     tagfilter = json.loads(tagfilterstr)
+    # compiled once, so watch mode keeps its decision cache between sweeps
+    if policies:
+        policies = load_policies(policies)
+        matcher = None
+        for p in policies.policies:
+            log.debug('Policy {}: {} after {} seconds'.format(p.name, p.tags, p.min_age))
+    else:
+        matcher = TagMatcher(tagfilter)
+        log.debug('Filter expression set: {}'.format(tagfilter))
+        log.debug('Minimum age set to {} seconds'.format(min_age))
+    roles = _roles(roles, accounts_file)
+    if roles:
+        log.debug('Assuming {} roles: {}'.format(len(roles), roles))
 
-    log.debug('Filter expression set: {}'.format(tagfilter))
-    log.debug('Minimum age set to {} seconds'.format(min_age))
-    if not regions:
+    explicit_regions = bool(regions)
+    if not regions and roles:
+        # every account looks up its own regions
         log.debug('Searching all available regions.')
+        regions = None
+    elif not regions:
+        log.debug('Searching all available regions.')
+        try:
+            regions = ec2_reaper.regions.get_regions(refresh=refresh_regions, ttl=region_cache_ttl,
+                                                     cache_file=region_cache)
+        except NoCredentialsError:
+            log.error('boto3 was unable to find any AWS credentials. Please run `aws configure`')
+            sys.exit(1)
     else:
-        regions = list(regions) if isinstance(regions, tuple) else regions
-        regions = regions if isinstance(regions, list) else [regions]
-        regions = [r.decode('utf-8') if not _is_py3() and \
-                   isinstance(r, unicode) else r for r in regions]
+        regions = _regions(regions)
         log.debug('Searching the following regions: {}'.format(regions))
 
+    log.debug('Scanning with {} workers'.format(workers))
+    log.debug('Server-side tag filtering {}'.format('on' if pushdown else 'off'))
+    log.debug('Scanning with the {} engine, {} instances per page'.format(engine, page_size))
+
     log.info('Started ec2-reaper at {}'.format(datetime.now()))
-    reaplog = ec2_reaper.reap(tagfilter, min_age=min_age, debug=dry_run, regions=regions)
-    log.info('{} instances reaped out of {} found in {} regions.'.format(
-        len([i for i in reaplog if i['reaped']]), len(reaplog),
-        len(regions) if regions else 'all'))
+    state = _state(state_path)
+    output = _writer(output_format)
+    if watch:
+        from ec2_reaper import scheduler
+        expiries = scheduler.ExpiryQueue()
+    else:
+        expiries = None
+    discover_regions = not explicit_regions and not roles
+    if plan_out:
+        from ec2_reaper.plan import Plan
+        plan = Plan(None if policies else tagfilter, min_age,
+                    policies.matching_tags if policies else None, roles)
+    else:
+        plan = None
+
+    def _sweep(stop=None):
+        sweep_regions = regions
+        if watch and discover_regions:
+            # cached in-process; looked up again once region_cache_ttl passes
+            sweep_regions = ec2_reaper.regions.get_regions(ttl=region_cache_ttl, cache_file=region_cache)
+        stats = ReapStats()
+        entries = ec2_reaper.reap_iter(matcher, min_age=min_age, debug=dry_run, regions=sweep_regions,
+                                       workers=workers, pushdown=pushdown, engine=engine,
+                                       page_size=page_size, stats=stats, state=state,
+                                       roles=roles, account_workers=account_workers,
+                                       policies=policies)
+        if expiries is not None:
+            entries = scheduler.schedule(expiries, entries, policies or min_age)
+        if plan is not None:
+            entries = (plan.add(e) for e in entries)
+        summary = _consume(entries, stop, output)
+        log.info('{} instances reaped out of {} found in {} regions.'.format(
+            summary.reaped_count, summary.instances,
+            len(stats.regions)))
+        for policy, count in sorted(summary.reaped_by_policy.items()):
+            log.info('  {} reaped by policy {}'.format(count, policy))
+        for account, error in stats.account_errors.items():
+            log.error('Account {} was skipped: {}'.format(account, error))
+        log.debug('Run stats: {}'.format(json.dumps(stats.as_dict())))
+        return summary
+
+    def _recheck(stop=None):
+        summary = _consume(scheduler.recheck(expiries, matcher, min_age=min_age, debug=dry_run,
+                                             engine=engine, page_size=page_size, state=state,
+                                             roles=roles, policies=policies), stop, output)
+        log.info('{} instances reaped out of {} re-checked.'.format(
+            summary.reaped_count, summary.instances))
+        return summary
 
-    if len(reaplog) > 0:
+    try:
+        if watch:
+            from ec2_reaper import watch as daemon
+            stop = threading.Event()
+            daemon.handle_signals(stop)
+            daemon.watch(_sweep, recheck=_recheck, expiries=expiries,
+                         interval=_default(interval, daemon.DEFAULT_INTERVAL),
+                         min_interval=_default(min_interval, daemon.DEFAULT_MIN_INTERVAL),
+                         max_interval=_default(max_interval, daemon.DEFAULT_MAX_INTERVAL),
+                         jitter=_default(jitter, daemon.DEFAULT_JITTER), stop=stop)
+            log.info('Stopped ec2-reaper at {}'.format(datetime.now()))
+            sys.exit(0)
+        summary = _sweep()
+        if plan is not None:
+            plan.write(plan_out)
+    except NoCredentialsError:
+        log.error('boto3 was unable to find any AWS credentials. Please run `aws configure`')
+        sys.exit(1)
+    finally:
+        if state is not None:
+            state.close()
+        if output is not None:
+            output.close()
+
+    if summary.instances > 0:
         sys.exit(0)
     else:
         sys.exit(1)
 
 
+@main.command(short_help='Reap the instances in a plan from reap --plan-out.')
+@click.argument('plan', type=click.Path(exists=True, dir_okay=False))
+@click.option('--dry-run', '-d', 'dry_run', is_flag=True,
+    help='Enable debug output and skip terminations.')
+@click.option('--engine', '-e', type=click.Choice(ec2_reaper.scan.ENGINES), default=ec2_reaper.DEFAULT_ENGINE,
+    help='Scan with a low-level client (fast) or boto3 resource objects. Default: client')
+@click.option('--page-size', 'page_size', default=ec2_reaper.DEFAULT_PAGE_SIZE, type=click.IntRange(5, 1000),
+    help='Instances per DescribeInstances page. Default: 1000')
+@click.option('--state', 'state_path', type=click.Path(dir_okay=False), default=None,
+    help='SQLite file to keep instance state and history in.')
+@click.option('--output', '-o', 'output_format', type=click.STRING, default=None, callback=_output_format,
+    help='Stream every planned instance\'s decision to stdout in this format (jsonl, csv or json) '
+         'as it is made.')
+def apply(plan, dry_run, engine, page_size, state_path, output_format):
+    """ec2-reaper apply [--dry-run] [--output jsonl|csv|json] <plan file>
+
+    Re-check just the instances in a plan written by `reap --plan-out`, with
+    batched DescribeInstances calls per account and region, and terminate
+    those which still match the plan's tag matcher and minimum age. Instances
+    which are gone or no longer match are skipped.
+    """
+    if dry_run:
+        log.setLevel(logging.DEBUG)
+        log.warning('Dry Run mode enabled.')
+    logging.getLogger('botocore').setLevel(logging.WARNING)
+    logging.getLogger('boto3').setLevel(logging.WARNING)
+
+    from botocore.exceptions import NoCredentialsError
+    from ec2_reaper.plan import Plan, apply as apply_plan
+
+    try:
+        plan = Plan.load(plan)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='plan')
+    log.info('Applying a plan from {} to reap {} instances'.format(
+        datetime.fromtimestamp(plan.created_at), len(plan.instances)))
+    stats = ReapStats()
+    state = _state(state_path)
+    output = _writer(output_format)
+    try:
+        summary = _consume(apply_plan(plan, debug=dry_run, engine=engine, page_size=page_size,
+                                      stats=stats, state=state),
+                           output=output)
+    except NoCredentialsError:
+        log.error('boto3 was unable to find any AWS credentials. Please run `aws configure`')
+        sys.exit(1)
+    finally:
+        if state is not None:
+            state.close()
+        if output is not None:
+            output.close()
+    log.info('{} instances reaped out of {} planned, in {} DescribeInstances calls.'.format(
+        summary.reaped_count, len(plan.instances), stats.totals()['pages']))
+    for account, error in stats.account_errors.items():
+        log.error('Account {} was skipped: {}'.format(account, error))
+
+
+@main.command(short_help='Write an inventory snapshot for simulate.')
+@click.argument('output', type=click.Path(dir_okay=False, writable=True))
+@click.option('--regions', '-r', type=click.STRING, multiple=True, default=ec2_reaper.DEFAULT_REGIONS,
+    help='One or more regions to export. Exports all available regions by default.')
+@click.option('--workers', '-w', default=ec2_reaper.DEFAULT_WORKERS, type=click.INT,
+    help='Number of regions to scan concurrently. Default: 1')
+@click.option('--engine', '-e', type=click.Choice(ec2_reaper.scan.ENGINES), default=ec2_reaper.DEFAULT_ENGINE,
+    help='Scan with a low-level client (fast) or boto3 resource objects. Default: client')
+@click.option('--page-size', 'page_size', default=ec2_reaper.DEFAULT_PAGE_SIZE, type=click.IntRange(5, 1000),
+    help='Instances per DescribeInstances page. Default: 1000')
+@click.option('--role', 'roles', type=click.STRING, multiple=True,
+    help='IAM role ARN to assume, once per account to export. Can be given more than once.')
+@click.option('--accounts-file', 'accounts_file', type=click.Path(exists=True, dir_okay=False), default=None,
+    help='File of role ARNs to assume, one per line.')
+@click.option('--account-workers', 'account_workers', default=ec2_reaper.accounts.DEFAULT_ACCOUNT_WORKERS,
+    type=click.IntRange(1), help='Number of accounts to scan concurrently. Default: 4')
+def export(output, regions, workers, engine, page_size, roles, accounts_file, account_workers):
+    """ec2-reaper export [--region region-1 ...] [--role <arn> ... | --accounts-file <file>] <file>
+
+    Write every running instance's ID, region, account, launch time and tags
+    to a JSON Lines snapshot, gzipped if <file> ends in .gz, for `simulate`.
+    """
+    logging.getLogger('botocore').setLevel(logging.WARNING)
+    logging.getLogger('boto3').setLevel(logging.WARNING)
+    from botocore.exceptions import NoCredentialsError
+    from ec2_reaper import inventory
+
+    roles = _roles(roles, accounts_file)
+    try:
+        regions = _regions(regions) if regions else \
+            None if roles else ec2_reaper.regions.get_regions()
+        stats = ReapStats()
+        inventory.export(output, regions=regions, workers=workers, engine=engine,
+                         page_size=page_size, stats=stats, roles=roles,
+                         account_workers=account_workers)
+    except NoCredentialsError:
+        log.error('boto3 was unable to find any AWS credentials. Please run `aws configure`')
+        sys.exit(1)
+    for account, error in stats.account_errors.items():
+        log.error('Account {} was skipped: {}'.format(account, error))
+
+
+@main.command(short_help='Show what a policy would reap from a snapshot.')
+@click.argument('snapshot', type=click.Path(exists=True, dir_okay=False))
+@click.argument('tagfilterstr', type=click.STRING, default=json.dumps(ec2_reaper.DEFAULT_TAG_MATCHER))
+@click.option('--min-age', '-m', 'min_age', default=ec2_reaper.DEFAULT_MIN_AGE, type=click.INT,
+    help='Instance must be (int)N seconds old before it would be considered for termination. Default: 300')
+@click.option('--as-of', 'as_of', type=click.FLOAT, default=None,
+    help='Epoch seconds to judge instance ages at. Default: when the snapshot was taken')
+@click.option('--verbose', '-v', is_flag=True, help='Log every instance which would be reaped.')
+@click.option('--policies', type=click.STRING, default=None,
+    help='JSON list of named policies, or a file holding one, each with its own "tags" and "min_age". '
+         'Replaces the tag matcher and --min-age.')
+def simulate(snapshot, tagfilterstr, min_age, as_of, verbose, policies):
+    """ec2-reaper simulate [--min-age <seconds> | --policies <json or file>] [--as-of <epoch>] <snapshot> <JSON filter expression>
+
+    Evaluate a tag matcher and minimum age against a snapshot from `export`,
+    without touching AWS, and print what would be reaped as JSON.
+    """
+    from ec2_reaper import inventory
+
+    start = time.time()
+    summary = ReapSummary()
+    regions = {}
+    with inventory.Snapshot(snapshot) as s:
+        as_of = as_of if as_of is not None else s.exported_at
+        for entry in inventory.simulate(s, json.loads(tagfilterstr), min_age=min_age,
+                                        now=as_of, policies=policies or None):
+            summary.add(entry)
+            if entry['reaped']:
+                regions[entry['region']] = regions.get(entry['region'], 0) + 1
+                if verbose:
+                    log.info('Would reap {} in {} with tags: {}{}'.format(
+                        entry['id'], entry['region'], entry['tags'],
+                        ' (policy {})'.format(entry['policy']) if entry['policy'] else ''))
+        total = s.instances
+    log.info('{} instances would be reaped out of {} in the snapshot ({:.2f}s).'.format(
+        summary.reaped_count, total, time.time() - start))
+    click.echo(json.dumps({'snapshot_instances': total, 'as_of': as_of,
+                           'summary': summary.as_dict(), 'reaped_by_region': regions},
+                          sort_keys=True))
+
+
+def _consume(entries, stop=None, output=None):
+    """Tally reaperlog entries, giving up early if `stop` gets set.
+
+    output: An `ec2_reaper.output` writer to stream each entry to. Default: None
+    """
+    summary = ReapSummary()
+    for entry in entries:
+        summary.add(entry)
+        if output is not None:
+            output.write(entry)
+        if stop is not None and stop.is_set():
+            log.warning('Stopping part way through a sweep')
+            break
+    return summary
+
+
 if __name__ == "__main__":
     main()
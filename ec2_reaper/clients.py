@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+"""Shared AWS sessions, clients and HTTP connections for EC2 Reaper.
+
+Everything here lives at module level so it survives between warm Lambda
+invocations. botocore's client config can be tuned through env vars:
+
+    BOTO_MAX_POOL_CONNECTIONS   connections kept open per client
+    BOTO_MAX_ATTEMPTS           total attempts per API call, including retries
+    BOTO_RETRY_MODE             'legacy', 'standard' or 'adaptive' (botocore 1.15+)
+    BOTO_CONNECT_TIMEOUT        seconds
+    BOTO_READ_TIMEOUT           seconds
+    BOTO_TCP_KEEPALIVE          'true' to turn on TCP keepalive (botocore 1.21+)
+    <SERVICE>_ENDPOINT_URL      eg: EC2_ENDPOINT_URL, to point a service somewhere else
+
+Unset values keep botocore's defaults. Settings the installed botocore
+doesn't know about are logged and ignored, rather than breaking every client.
+"""
+
+import logging
+import os
+import threading
+
+log = logging.getLogger()
+
+_sessions = {}
+_clients = {}
+_http_session = None
+_lock = threading.Lock()
+
+
+def client_config():
+    """Build a botocore `Config` from the BOTO_* env vars."""
+    from botocore.config import Config
+
+    kwargs = {}
+    if os.environ.get('BOTO_MAX_POOL_CONNECTIONS'):
+        kwargs['max_pool_connections'] = int(os.environ['BOTO_MAX_POOL_CONNECTIONS'])
+    if os.environ.get('BOTO_CONNECT_TIMEOUT'):
+        kwargs['connect_timeout'] = float(os.environ['BOTO_CONNECT_TIMEOUT'])
+    if os.environ.get('BOTO_READ_TIMEOUT'):
+        kwargs['read_timeout'] = float(os.environ['BOTO_READ_TIMEOUT'])
+    if os.environ.get('BOTO_TCP_KEEPALIVE'):
+        if 'tcp_keepalive' in Config.OPTION_DEFAULTS:
+            kwargs['tcp_keepalive'] = os.environ['BOTO_TCP_KEEPALIVE'].lower() == 'true'
+        else:
+            log.warning('Ignoring BOTO_TCP_KEEPALIVE: this botocore is too old for it')
+
+    retries = {}
+    if os.environ.get('BOTO_MAX_ATTEMPTS'):
+        # every botocore takes max_attempts, which doesn't count the first try
+        retries['max_attempts'] = max(int(os.environ['BOTO_MAX_ATTEMPTS']) - 1, 0)
+    if os.environ.get('BOTO_RETRY_MODE'):
+        if _has_retry_modes():
+            retries['mode'] = os.environ['BOTO_RETRY_MODE']
+        else:
+            log.warning('Ignoring BOTO_RETRY_MODE: this botocore is too old for it')
+    if retries:
+        kwargs['retries'] = retries
+    return Config(**kwargs)
+
+
+def _has_retry_modes():
+    # retry modes came with the botocore.retries package
+    try:
+        import botocore.retries  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def endpoint_url(service):
+    return os.environ.get('{}_ENDPOINT_URL'.format(service.upper())) or None
+
+
+def _credentials_key(credentials):
+    if not credentials:
+        return None
+    return (credentials.get('aws_access_key_id'), credentials.get('aws_session_token'))
+
+
+def _get_session(credentials):
+    # callers hold _lock
+    key = _credentials_key(credentials)
+    if key not in _sessions:
+        import boto3.session
+        _sessions[key] = boto3.session.Session(**(credentials or {}))
+    return _sessions[key]
+
+
+def get_session(credentials=None):
+    """Return the shared boto3 session for `credentials`.
+
+    Sessions aren't thread-safe; use it for setup such as registering event
+    handlers, and `get_client` for API calls.
+    """
+    with _lock:
+        return _get_session(credentials)
+
+
+def get_client(service, region, credentials=None):
+    """Return a cached client for `service` in `region`.
+
+    credentials: Dict of `aws_access_key_id`, `aws_secret_access_key` and
+        `aws_session_token`. Default: None (boto3's usual credential chain)
+
+    Clients are thread-safe, so one per service, region and set of
+    credentials is shared by everything in the process.
+    """
+    key = (service, region, _credentials_key(credentials))
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                log.debug('Creating {} client for {}'.format(service, region))
+                client = _get_session(credentials).client(
+                    service, region_name=region, config=client_config(),
+                    endpoint_url=endpoint_url(service))
+                _clients[key] = client
+    return client
+
+
+def get_resource(service, region, credentials=None):
+    """Return a new boto3 resource built from the shared session.
+
+    Resources aren't thread-safe, so unlike clients they aren't shared.
+    """
+    with _lock:
+        return _get_session(credentials).resource(
+            service, region_name=region, config=client_config(),
+            endpoint_url=endpoint_url(service))
+
+
+def get_http_session():
+    """Return a shared `requests.Session`, so HTTP connections get reused."""
+    global _http_session
+    if _http_session is None:
+        with _lock:
+            if _http_session is None:
+                import requests
+                _http_session = requests.Session()
+    return _http_session
+
+
+def forget(credentials):
+    """Drop the session and clients made for `credentials`, eg: once they've expired."""
+    key = _credentials_key(credentials)
+    with _lock:
+        _sessions.pop(key, None)
+        for k in [k for k in _clients if k[2] == key]:
+            del _clients[k]
+
+
+def reset():
+    """Drop every cached session, client and HTTP connection."""
+    global _http_session
+    with _lock:
+        _sessions.clear()
+        _clients.clear()
+        if _http_session is not None:
+            _http_session.close()
+            _http_session = None
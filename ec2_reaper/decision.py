@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+"""Compact reaperlog records.
+
+A sweep makes a record for every instance matching on tags or age, so they
+are kept small: `__slots__` rather than a dict, tags as a `{k: v}` dict
+rather than boto's list of `{'Key': k, 'Value': v}` dicts, and the launch
+time as epoch seconds rather than a tz-aware datetime.
+
+Records still read like the reaperlog dicts `reap` has always returned:
+`record['tags']` and `record['launch_time']` build the boto-style tag list
+and UTC datetime when they're asked for, and `to_dict()` makes a plain dict.
+"""
+
+import datetime
+
+import pytz
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+# reaperlog keys, in the order they have always been listed; 'error' is only present when set
+KEYS = ('id', 'tag_match', 'age_match', 'tags', 'launch_time', 'reaped', 'region', 'account',
+        'policy')
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=pytz.utc)
+
+
+def boto_tags(tags):
+    """Turn a `{k: v}` tag dict back into boto's tag list, or None when there are no tags."""
+    return [{'Key': k, 'Value': v} for k, v in tags.items()] if tags else None
+
+
+def utc_datetime(seconds):
+    """A tz-aware UTC datetime for epoch `seconds`."""
+    return _EPOCH + datetime.timedelta(seconds=seconds)
+
+
+class Decision(Mapping):
+    """The reaper's decision about one instance.
+
+    Attributes hold the compact forms: `tags` is a `{k: v}` dict and
+    `launched` is epoch seconds. Item access gives the reaperlog forms, so
+    `decision['tags']` is a boto tag list and `decision['launch_time']` a
+    datetime. `reaped` and `error` can be set either way once the instance
+    has been terminated, or failed to be.
+    """
+
+    __slots__ = ('id', 'tag_match', 'age_match', 'tags', 'launched', 'reaped', 'region',
+                 'account', 'policy', 'error')
+
+    def __init__(self, id, tag_match, age_match, tags, launched, region, account=None,
+                 policy=None, reaped=False, error=None):
+        self.id = id
+        self.tag_match = tag_match
+        self.age_match = age_match
+        self.tags = tags
+        self.launched = launched
+        self.reaped = reaped
+        self.region = region
+        self.account = account
+        self.policy = policy
+        self.error = error
+
+    @property
+    def launch_time(self):
+        return utc_datetime(self.launched)
+
+    def __getitem__(self, key):
+        if key == 'tags':
+            return boto_tags(self.tags)
+        if key == 'launch_time':
+            return self.launch_time
+        if key in KEYS or key == 'error' and self.error is not None:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in ('reaped', 'error'):
+            raise KeyError('Only reaped and error can be set on a decision, not {}'.format(key))
+        setattr(self, key, value)
+
+    def __iter__(self):
+        for key in KEYS:
+            yield key
+        if self.error is not None:
+            yield 'error'
+
+    def __len__(self):
+        return len(KEYS) + (self.error is not None)
+
+    def to_dict(self):
+        """The reaperlog dict for this decision, as `reap` used to return it."""
+        return dict((key, self[key]) for key in self)
+
+    def __repr__(self):
+        return 'Decision({!r}, tag_match={!r}, age_match={!r}, reaped={!r}, region={!r})'.format(
+            self.id, self.tag_match, self.age_match, self.reaped, self.region)
@@ -1,16 +1,48 @@
 # -*- coding: utf-8 -*-
-import boto3
 import logging
 import pytz
 import os
 import datetime
+import functools
+import threading
 import time
 
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from ec2_reaper import clients
+from ec2_reaper.accounts import DEFAULT_ACCOUNT_WORKERS, account_id, assume_role
+from ec2_reaper import scan
+from ec2_reaper import throttle
+from ec2_reaper.decision import Decision
+from ec2_reaper.matcher import TagMatcher, tag_dict
+from ec2_reaper.policy import PolicySet, load_policies
+from ec2_reaper.regions import get_regions
+from ec2_reaper.state import epoch
+from ec2_reaper.stats import ReapStats, RegionStats, clock, is_throttle
+
 """EC2 Reaper"""
 
 DEFAULT_TAG_MATCHER = [{"tag": "Name", "includes": [], "excludes": ["*"]}]
 DEFAULT_MIN_AGE = 300
 DEFAULT_REGIONS = None
+DEFAULT_WORKERS = 1
+DEFAULT_PUSHDOWN = False
+DEFAULT_ENGINE = scan.CLIENT_ENGINE
+DEFAULT_PAGE_SIZE = scan.MAX_PAGE_SIZE
+
+# TerminateInstances accepts at most this many instance IDs per call
+TERMINATE_BATCH_SIZE = 1000
+
+# tries per batch while TerminateInstances is being throttled
+TERMINATE_ATTEMPTS = 3
+
+# most values DescribeInstances accepts in a single filter
+FILTER_VALUES_LIMIT = 200
+
+RUNNING_FILTER = {'Name': 'instance-state-name', 'Values': ['running']}
 
 # set up localtime for logging
 LOCAL_TZ = pytz.timezone(time.tzname[time.localtime().tm_isdst])
@@ -18,16 +50,41 @@ LOCAL_TZ_NAME = LOCAL_TZ.tzname(datetime.datetime.now())
 
 log = logging.getLogger()
 
-def reap(tags=None, min_age=DEFAULT_MIN_AGE, regions=DEFAULT_REGIONS, debug=True):
+def reap(tags=None, min_age=DEFAULT_MIN_AGE, regions=DEFAULT_REGIONS, debug=True,
+         workers=DEFAULT_WORKERS, pushdown=DEFAULT_PUSHDOWN, engine=DEFAULT_ENGINE,
+         page_size=DEFAULT_PAGE_SIZE, stats=None, state=None, instance_ids=None, roles=None,
+         account_workers=DEFAULT_ACCOUNT_WORKERS, policies=None):
     """reap - Terminate running instances matching tag requirements and a minimum age
 
     tags: List of dicts like `{'tag': 'sometag', include=['val1', ...], exclude=['val2', ...]}`
     min_age: Instance must be (int)N seconds old before it will be considered for termination. Default: 300
-    regions: Stringy AWS region name or list of names to search. Searches all available regions by default.
+    regions: Stringy AWS region name or list of names to search. Searches all opted-in regions by default.
     debug: If True, perform dry-run by skipping terminate API calls. Default: True
+    workers: Number of regions to scan concurrently. Default: 1 (scan regions one after another)
+    pushdown: If True, send tag matchers to DescribeInstances as server-side filters where possible.
+        Only tag-matching instances are returned then; age-only matches are left out of the log. Default: False
+    engine: 'client' pages through DescribeInstances with a low-level client. 'resource' uses boto3
+        resource objects, which is slower and heavier. Default: 'client'
+    page_size: DescribeInstances MaxResults, 5 to 1000. Default: 1000
+    stats: A `ec2_reaper.stats.ReapStats` to fill in with per-region timings and API call counts. Default: None
+    state: A `ec2_reaper.state.StateStore`. Instances it has seen before with unchanged launch times and
+        tags reuse their last tag decision, and decisions are recorded in it. Default: None
+    instance_ids: Only check these instances, eg: ones named by an EC2 event. Default: None (every instance)
+    roles: IAM role ARNs to assume, one per account to reap. Default: None (boto3's usual credentials)
+    account_workers: Number of accounts to scan concurrently when `roles` are given. Default: 4
+    policies: Named policies, each with its own tag matchers and min_age, evaluated together in one
+        scan in place of `tags` and `min_age`. A list of dicts like
+        `{'name': 'ci', 'tags': [...], 'min_age': 7200}`, or an `ec2_reaper.policy.PolicySet`. Default: None
 
     Returns a list of dicts with instance that partially matches and their reap status.
-    [{'id': i.id, 'tag_match': True, 'age_match': False, 'tags': i.tags, 'launch_time': i.launch_time, 'reaped': False, 'region': i.region}]
+    [{'id': i.id, 'tag_match': True, 'age_match': False, 'tags': i.tags, 'launch_time': i.launch_time, 'reaped': False, 'region': i.region, 'account': None, 'policy': None}]
+
+    Entries are `ec2_reaper.decision.Decision` records, which read like these
+    dicts; `to_dict()` turns one into a plain dict.
+
+    `account` is the ID of the account assumed into, or None for boto3's usual credentials.
+    `policy` is the name of the policy which reaped the instance, or which will once it's old
+    enough, or None without `policies`.
 
     Behaviour:
     - An instance is reaped if tag value is in the include list
@@ -39,87 +96,439 @@ def reap(tags=None, min_age=DEFAULT_MIN_AGE, regions=DEFAULT_REGIONS, debug=True
     - Instances must match *all* tag conditions if multiple are specified.
     - Stopped instances are always ignored.
     """
-    tags = tags if tags else DEFAULT_TAG_MATCHER
-    regions = regions if regions else tuple(r['RegionName'] for r in boto3.client('ec2', region_name='us-east-1').describe_regions().get('Regions'))
+    return list(reap_iter(tags, min_age=min_age, regions=regions, debug=debug,
+                          workers=workers, pushdown=pushdown, engine=engine,
+                          page_size=page_size, stats=stats, state=state,
+                          instance_ids=instance_ids, roles=roles,
+                          account_workers=account_workers, policies=policies))
+
+def reap_iter(tags=None, min_age=DEFAULT_MIN_AGE, regions=DEFAULT_REGIONS, debug=True,
+              workers=DEFAULT_WORKERS, pushdown=DEFAULT_PUSHDOWN, engine=DEFAULT_ENGINE,
+              page_size=DEFAULT_PAGE_SIZE, stats=None, state=None, instance_ids=None, roles=None,
+              account_workers=DEFAULT_ACCOUNT_WORKERS, policies=None):
+    """reap_iter - Generator version of `reap`
+
+    Takes the same arguments as `reap`, though `tags` may also be a compiled
+    `ec2_reaper.matcher.TagMatcher`, and yields the same reaperlog dicts, one
+    page of DescribeInstances results at a time, terminating each page's matches
+    before yielding them. With `workers` or `account_workers` > 1, regions and
+    accounts are interleaved in the order their pages come back.
+    """
+    if engine not in scan.ENGINES:
+        raise ValueError('engine must be one of {}, got {}'.format(scan.ENGINES, engine))
+
+    stats = stats if stats is not None else ReapStats()
+    # a compiled matcher can be reused across runs, keeping its decision cache warm
+    if policies is not None:
+        matcher = load_policies(policies)
+        tags = [mt for p in matcher.policies for mt in p.tags]
+    else:
+        matcher = tags if isinstance(tags, TagMatcher) else TagMatcher(tags if tags else DEFAULT_TAG_MATCHER)
+        tags = matcher.matching_tags
     if isinstance(regions, str):
-        regions = tuple(regions)
+        regions = (regions,)
 
     old_log_level = None
     if debug and logging.getLevelName(log.level) != 'DEBUG':
         old_log_level = log.level
         log.setLevel(logging.DEBUG)
 
-    reaperlog = []
-    for region in regions:
-        ec2 = boto3.resource('ec2', region_name=region)
-        instances = [i for i in ec2.instances.filter(Filters=[{'Name': 'instance-state-name', 'Values': ['running']}])]
-        log.debug('Found {} instances in {}'.format(len(instances), region))
-        for i in instances:
-            reaperlog_add = None
+    if state is not None:
+        state.bind(matcher.matching_tags)
+    filters = _build_filters(tags) if pushdown else None
+    if filters is None:
+        filters = [[RUNNING_FILTER]]
+    if instance_ids is not None:
+        filters = _instance_id_filters(filters, instance_ids)
+    log.debug('DescribeInstances filter sets: {}'.format(filters))
 
-            local_time = i.launch_time.astimezone(LOCAL_TZ)
-            log.debug('Checking {}, launched at {} with tags: {}'.format(
-                i.id, local_time, i.tags))
+    pages = None
+    try:
+        scan_region = functools.partial(_scan_region, matcher=matcher, min_age=min_age, debug=debug,
+                                        filters=filters, engine=engine, page_size=page_size,
+                                        stats=stats, state=state)
+        pages = _scan_accounts(scan_region, regions, workers, roles, account_workers, stats)
+        for page in pages:
+            for entry in page:
+                yield entry
+
+        log.debug('Tag matcher cache: {} hits, {} misses'.format(matcher.hits, matcher.misses))
+    finally:
+        if pages is not None:
+            pages.close()
+        stats.finish()
+        if old_log_level:
+            log.setLevel(old_log_level)
+
+def _scan_accounts(scan_region, regions, workers, roles, account_workers, stats):
+    """Run `scan_region` over every region of every account, yielding its pages.
+
+    roles: Role ARNs to assume, one per account. Default: boto3's usual credentials
+    """
+    # (account id, role) pairs; the default credentials have neither
+    accounts = [(account_id(r), r) for r in roles] if roles else [(None, None)]
+    scan_account = functools.partial(_scan_account, regions=regions, workers=workers,
+                                     scan_region=scan_region, stats=stats)
+    account_workers = min(account_workers or 1, len(accounts))
+    if account_workers > 1:
+        log.debug('Scanning {} accounts with {} workers'.format(len(accounts), account_workers))
+        pages = _scan_concurrently(scan_account, accounts, account_workers)
+    else:
+        pages = (page for account in accounts for page in scan_account(account))
+    try:
+        for page in pages:
+            yield page
+    finally:
+        pages.close()
+
+def _scan_account(account, regions, workers, scan_region, stats):
+    """Scan the regions of one account, yielding a list of reaperlog entries per page.
+
+    account: `(account id, role ARN)`, or `(None, None)` for the default credentials
+    regions: Regions to scan. Default: every region the account can use
+
+    An account whose role can't be assumed is logged and skipped.
+    """
+    from botocore.exceptions import ClientError
+
+    account, role = account
+    credentials = None
+    if role:
+        try:
+            credentials = assume_role(role)
+        except ClientError as e:
+            log.error('Unable to assume {}, skipping account {}: {}'.format(role, account, e))
+            stats.account_error(account, e)
+            return
+
+    regions = regions if regions else get_regions(credentials=credentials, account=account)
+    scan = functools.partial(scan_region, credentials=credentials, account=account)
+    workers = min(workers or 1, len(regions))
+    if workers > 1:
+        log.debug('Scanning {} regions with {} workers'.format(len(regions), workers))
+        pages = _scan_concurrently(scan, regions, workers)
+    else:
+        pages = (page for region in regions for page in scan(region))
+    try:
+        for page in pages:
+            yield page
+    finally:
+        pages.close()
+
+def _scan_concurrently(scan, units, workers):
+    """Run `scan(unit)` generators on a thread pool, yielding pages as they arrive.
+
+    Units are regions or accounts. The queue is bounded, so workers wait for
+    the consumer rather than buffering whole regions in memory.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    pages = queue.Queue(maxsize=workers * 2)
+    stop = threading.Event()
+    done = object()
+
+    def _run(unit):
+        try:
+            # scanning a page reaps it, so don't start a unit or advance one
+            # once the consumer has gone.
+            if stop.is_set():
+                return
+            unit_pages = scan(unit)
+            try:
+                for page in unit_pages:
+                    pages.put(page)
+                    if stop.is_set():
+                        break
+            finally:
+                unit_pages.close()
+        finally:
+            pages.put(done)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_run, unit) for unit in units]
+        remaining = len(futures)
+        try:
+            while remaining:
+                page = pages.get()
+                if page is done:
+                    remaining -= 1
+                else:
+                    yield page
+        finally:
+            # the consumer may have bailed early; drop queued units and let
+            # blocked workers finish up.
+            stop.set()
+            remaining -= sum(1 for f in futures if f.cancel())
+            while remaining:
+                if pages.get() is done:
+                    remaining -= 1
+
+        # surface any errors from the workers
+        for f in futures:
+            if not f.cancelled():
+                f.result()
+
+def _scan_region(region, matcher, min_age, debug, filters=None,
+                 engine=DEFAULT_ENGINE, page_size=DEFAULT_PAGE_SIZE, stats=None, state=None,
+                 credentials=None, account=None):
+    """Scan a single region, yielding a list of reaperlog entries per page.
+
+    matcher: A compiled `TagMatcher`
+    stats: The run's `ReapStats`
+    state: The run's `StateStore`, if any
+    credentials, account: Assumed-role credentials and the ID of their account, if any
+    """
+    rstats = (stats if stats is not None else ReapStats()).region(region, account)
+    for client, instances in _region_pages(region, filters, engine, page_size, rstats,
+                                           credentials, account):
+        yield _reap_page(client, region, instances, matcher, min_age, debug, rstats, state,
+                         account)
+
+def _region_pages(region, filters=None, engine=DEFAULT_ENGINE, page_size=DEFAULT_PAGE_SIZE,
+                  rstats=None, credentials=None, account=None):
+    """Page through a region's instances, yielding `(client, [InstanceRecord, ...])` per page.
 
-            ct, ca = (_check_tags(i.tags, tags), _check_age(i.launch_time, min_age))
+    The region's scan_seconds runs from the first page to the last, so
+    it includes time the consumer spends between pages.
+    """
+    rstats = rstats if rstats is not None else RegionStats(region, account)
+    start = clock()
+    filters = filters if filters is not None else [[RUNNING_FILTER]]
+    client = clients.get_client('ec2', region, credentials)
+    limiter = throttle.get_limiter(region, throttle.DESCRIBE, account)
+    if engine == scan.RESOURCE_ENGINE:
+        ec2 = clients.get_resource('ec2', region, credentials)
+        scan_pages = functools.partial(scan.scan_resource, ec2, page_size=page_size, stats=rstats,
+                                       limiter=limiter)
+    else:
+        scan_pages = functools.partial(scan.scan_client, client, page_size=page_size, stats=rstats,
+                                       limiter=limiter)
+
+    # one query per filter set; matchers are OR'd so candidates can overlap.
+    seen = set()
+    try:
+        for f in filters:
+            for instances in scan_pages(f):
+                if len(filters) > 1:
+                    instances = [i for i in instances if i.id not in seen]
+                    seen.update(i.id for i in instances)
+                rstats.instances += len(instances)
+                yield client, instances
+    finally:
+        rstats.scan_seconds += clock() - start
+        rstats.limits = _limits(region, account)
+    log.debug('Found {} instances in {}{}'.format(
+        rstats.instances, region, ' ({})'.format(account) if account else ''))
+
+def _reap_page(client, region, instances, matcher, min_age, debug, rstats, state=None,
+               account=None):
+    """Check a page of instances, terminating matches, and return its reaperlog entries.
+
+    matcher: A `TagMatcher`, or a `PolicySet`, whose policies' own min_ages replace `min_age`
 
-            if ct or ca:
-                reaperlog_add = {'id': i.id, 'tag_match': ct, 'age_match': ca,
-                                 'tags': i.tags, 'launch_time': i.launch_time,
-                                 'reaped': False, 'region': region}
+    Entries are `Decision` records. Launch times are only converted to local
+    time, and log messages only formatted, when the log level shows them.
+    """
+    start = clock()
+    reaperlog, reapable = [], []
+    debug_logging = log.isEnabledFor(logging.DEBUG)
+    warn_logging = log.isEnabledFor(logging.WARNING)
+    known = state.lookup(i.id for i in instances) if state is not None else None
+    observed = []
+    policies = matcher if isinstance(matcher, PolicySet) else None
+    now = time.time()
+    for i in instances:
+        tags = tag_dict(i.tags)
+        launched = epoch(i.launch_time)
+        if known is None:
+            if debug_logging:
+                log.debug('Checking {}, launched at {} with tags: {}'.format(
+                    i.id, _local_time(i.launch_time), i.tags))
+            ct = matcher.match(tags)
+        else:
+            ct, fingerprint = _check_tags_incremental(i, tags, launched, matcher, state, known,
+                                                      rstats, debug_logging)
+
+        policy = None
+        if policies is None:
+            ca = now - launched > min_age
+        else:
+            # ct is a mask of the policies matching on tags
+            ca, policy = policies.decide(ct, now - launched)
+        if known is not None:
+            observed.append((i.id, launched, fingerprint, ct, ca))
+        if not (ct or ca):
+            continue
+        ct = bool(ct)
+
+        decision = Decision(i.id, ct, ca, tags, int(launched), region, account, policy)
+        reaperlog.append(decision)
 
-            if ct and not ca:
-                log.warning('The following instance is a match, but isn\'t old enough yet: {} (launched at {} with tags: {})'.format(i.id, local_time, i.tags))
+        if ct and not ca and warn_logging:
+            log.warning('The following instance is a match{}, but isn\'t old enough yet: {} (launched at {} with tags: {})'.format(
+                ' for policy {}'.format(policy) if policy else '', i.id, _local_time(i.launch_time), i.tags))
 
-            if ct and ca:
+        if ct and ca:
+            if warn_logging:
                 msg = '(NO-OP) ' if debug else ''
-                msg += 'Reaping instance {} launched at {} {}'.format(i.id, local_time, LOCAL_TZ_NAME)
+                msg += 'Reaping instance {} launched at {} {}'.format(
+                    i.id, _local_time(i.launch_time), LOCAL_TZ_NAME)
+                if policy:
+                    msg += ' (policy {})'.format(policy)
                 log.warning(msg)
-                if not debug:
-                    i.terminate()
-                reaperlog_add['reaped'] = True
+            if debug:
+                decision.reaped = True
+            else:
+                reapable.append(decision)
 
-            if reaperlog_add:
-                reaperlog.append(reaperlog_add)
+    rstats.evaluate_seconds += clock() - start
 
-    if old_log_level:
-        log.setLevel(old_log_level)
+    if reapable:
+        _terminate(client, reapable, rstats)
+
+    if state is not None:
+        state.record(region, observed, known, {e.id: e for e in reaperlog}, dry_run=debug)
 
     return reaperlog
 
-def _check_tags(instance_tags, matching_tags):
-    log.debug('Comparing instance tags {} to filters {}'.format(
-    instance_tags, matching_tags))
-    instance_tags = instance_tags if instance_tags else []
-    for mt in matching_tags:
+def _local_time(launch_time):
+    return launch_time.astimezone(LOCAL_TZ)
+
+def _check_tags_incremental(instance, tags, launched, matcher, state, known, rstats, debug_logging):
+    """Reuse the stored tag decision for `instance` if it hasn't changed, else evaluate it.
+
+    tags: The instance's `{k: v}` tag dict
+    launched: Its launch time in epoch seconds
+
+    Returns `(tag_match, fingerprint)`.
+    """
+    fingerprint = state.fingerprint(matcher, tags)
+    prev = known.get(instance.id)
+    if prev is not None and prev.fingerprint == fingerprint and prev.launch_time == launched:
+        # a policy mask with a PolicySet, otherwise 0 or 1
+        ct = prev.tag_match if isinstance(matcher, PolicySet) else bool(prev.tag_match)
+        rstats.unchanged += 1
+    else:
+        if debug_logging:
+            log.debug('Checking {}, launched at {} with tags: {}'.format(
+                instance.id, _local_time(instance.launch_time), instance.tags))
+        ct = matcher.match(tags)
+    return ct, fingerprint
+
+def _limits(region, account=None):
+    """Snapshot the state of `region`'s limiters, for its stats."""
+    limits = dict((kind, throttle.get_limiter(region, kind, account).state())
+                  for kind in (throttle.DESCRIBE, throttle.TERMINATE))
+    return dict((k, v) for k, v in limits.items() if v is not None)
+
+def _terminate(client, reapable, rstats=None):
+    """Terminate reaperlog entries in batches, setting `reaped` on each.
 
-        # reap if `tag` is not present and excludes == ['*']
-        # eg: {tag: Name, excludes: ['*']}. If it has a Name, don't reap it.
-        instance_tag_keys = [i['Key'] for i in instance_tags]
-
-        log.debug('excludes: {} (matches? {})'.format(
-            mt.get('excludes'), (mt.get('excludes') == [u'*'])))
-        log.debug('tag: {} (in instance tags? {})'.format(
-            mt.get('tag'), mt.get('tag') in instance_tag_keys))
-        if mt.get('excludes') == [u'*'] and mt.get('tag') not in instance_tag_keys:
-            log.debug('Tag "{}" not present; instance is reapable.'.format(mt.get('tag')))
-            return True
-
-        # check instance tags
-        for it in instance_tags:
-            if it.get('Key') != mt.get('tag'):
+    Entries which couldn't be terminated keep `reaped: False` and gain an
+    `error` describing why. Calls are paced by the region's terminate limiter,
+    and throttled batches are retried whole, up to `TERMINATE_ATTEMPTS` times.
+    """
+    rstats = rstats if rstats is not None else RegionStats(None)
+    limiter = throttle.get_limiter(rstats.region, throttle.TERMINATE, rstats.account)
+    for n in range(0, len(reapable), TERMINATE_BATCH_SIZE):
+        _terminate_batch(client, reapable[n:n + TERMINATE_BATCH_SIZE], rstats, limiter)
+
+def _terminate_batch(client, batch, rstats, limiter=throttle.NO_LIMIT):
+    from botocore.exceptions import ClientError
+
+    for attempt in range(1, TERMINATE_ATTEMPTS + 1):
+        rstats.wait_seconds += limiter.acquire()
+        start = clock()
+        rstats.terminate_calls += 1
+        try:
+            r = client.terminate_instances(InstanceIds=[e['id'] for e in batch])
+            rstats.terminate_seconds += rstats.api_call(clock() - start, r)
+            limiter.observe(r)
+            break
+        except ClientError as e:
+            rstats.terminate_seconds += clock() - start
+            rstats.api_error(e)
+            limiter.observe(error=e)
+            # the limiter has cut its rate, so the next acquire() backs off
+            if is_throttle(e) and attempt < TERMINATE_ATTEMPTS:
+                log.warning('Throttled terminating {} instances, retrying ({}/{})'.format(
+                    len(batch), attempt, TERMINATE_ATTEMPTS))
                 continue
+            if len(batch) > 1 and not is_throttle(e):
+                # a single bad or termination-protected ID fails the whole call,
+                # so retry one by one to find out which instances are affected.
+                log.warning('Batch termination of {} instances failed, retrying individually: {}'.format(
+                    len(batch), e))
+                for entry in batch:
+                    _terminate_batch(client, [entry], rstats, limiter)
+                return
+            log.error('Unable to terminate {}: {}'.format(
+                batch[0]['id'] if len(batch) == 1 else '{} instances'.format(len(batch)), e))
+            for entry in batch:
+                entry['error'] = str(e)
+            return
+
+    terminated = set(i['InstanceId'] for i in r.get('TerminatingInstances', []))
+    for entry in batch:
+        entry['reaped'] = entry['id'] in terminated
+        if not entry['reaped']:
+            log.error('Instance {} missing from TerminateInstances response'.format(entry['id']))
+            entry['error'] = 'missing from TerminateInstances response'
+
+def _build_filters(matching_tags):
+    """Translate tag matchers into server-side DescribeInstances filter sets.
+
+    Returns a list of `Filters` lists, one query per matcher that can still match
+    something, or None when a matcher can't be expressed server-side and every
+    running instance has to be fetched. The results are a superset of what
+    `_check_tags` accepts, so candidates are still checked locally.
+    """
+    filter_sets = []
+    for mt in matching_tags:
+        includes = mt.get('includes') or []
+        excludes = mt.get('excludes') or []
+
+        # "tag is missing" has no server-side equivalent.
+        if excludes == [u'*']:
+            return None
 
-            # matching reapme tag exists and is not empty
-            if mt.get('includes') == [u'*'] and it.get('Value'):
-                log.debug('Tag "{}" is present and `include` is wildcarded; instance is reapable.'.format(mt.get('tag')))
-                return True
+        if includes == [u'*']:
+            # the local check weeds out tags with empty values
+            filter_sets.append([RUNNING_FILTER, {'Name': 'tag-key', 'Values': [mt.get('tag')]}])
+            continue
 
-            # tag exists, matches a value in includes, doesn't match any excludes
-            if it.get('Value') in mt.get('includes') and it.get('Value') not in mt.get('excludes'):
-                log.debug('Tag "{}" present, its value is in `includes` and not in `excludes`; instance is reapable.'.format(mt.get('tag')))
-                return True
-    return False
+        values = [v for v in includes if v not in excludes]
+        if not values:
+            # nothing left that could match, so this matcher needs no query at all
+            continue
+
+        # AWS treats `*` and `?` as wildcards and empty values are ambiguous,
+        # so anything but plain literals falls back to a full scan.
+        if any(not v or '*' in v or '?' in v for v in values):
+            return None
+
+        filter_sets.append([RUNNING_FILTER, {'Name': 'tag:{}'.format(mt.get('tag')), 'Values': values}])
+    return filter_sets
+
+def _instance_id_filters(filters, instance_ids):
+    """Narrow each filter set to `instance_ids`.
+
+    An instance-id filter is used rather than InstanceIds, which fails the
+    whole call if any instance has already gone away.
+    """
+    ids = sorted(set(instance_ids))
+    return [f + [{'Name': 'instance-id', 'Values': ids[n:n + FILTER_VALUES_LIMIT]}]
+            for f in filters for n in range(0, len(ids), FILTER_VALUES_LIMIT)]
+
+def _check_tags(instance_tags, matching_tags):
+    """Returns True if any of `matching_tags` accepts `instance_tags`.
+
+    Compiles the matchers on every call; use a `TagMatcher` to check many instances.
+    """
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug('Comparing instance tags {} to filters {}'.format(
+            instance_tags, matching_tags))
+    return TagMatcher(matching_tags, cache_size=0)(instance_tags)
 
 def _check_age(launch_time, min_age):
     # get local timezone info to compare against utc
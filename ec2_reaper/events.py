@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+"""Pick out the instances an EventBridge event is about.
+
+The Lambda handler uses this to check just those instances, rather than
+sweeping every region, when it's triggered by:
+
+- EC2 Instance State-change Notifications for instances entering 'running'
+- CloudTrail RunInstances, CreateTags and DeleteTags calls
+
+Anything else, eg: a scheduled event, gets a full sweep, except for
+`RECHECK_EVENT`, which only re-checks instances whose expiry times have
+passed (see `ec2_reaper.scheduler`).
+"""
+
+import logging
+
+STATE_CHANGE = 'EC2 Instance State-change Notification'
+CLOUDTRAIL_CALL = 'AWS API Call via CloudTrail'
+CLOUDTRAIL_EVENTS = ('RunInstances', 'CreateTags', 'DeleteTags')
+
+# constant input for a frequent schedule that only handles expiring instances
+RECHECK_EVENT = {'action': 'recheck'}
+
+log = logging.getLogger()
+
+
+def instance_targets(event):
+    """instance_targets - Map an event to the instances it names
+
+    event: The Lambda event
+
+    Returns `{region: [instance ids]}`, which is empty if the event is about
+    instances but none of them need checking (eg: one shutting down), or None
+    if it isn't an instance event at all.
+    """
+    if not isinstance(event, dict) or event.get('source') != 'aws.ec2':
+        return None
+
+    detail = event.get('detail') or {}
+    detail_type = event.get('detail-type')
+    if detail_type == STATE_CHANGE:
+        region = event.get('region')
+        ids = [detail['instance-id']] if detail.get('state') == 'running' and \
+            detail.get('instance-id') else []
+    elif detail_type == CLOUDTRAIL_CALL and detail.get('eventName') in CLOUDTRAIL_EVENTS:
+        region = detail.get('awsRegion') or event.get('region')
+        ids = _cloudtrail_ids(detail)
+    else:
+        return None
+
+    ids = sorted(set(ids))
+    log.debug('{} event for {} in {}'.format(detail_type, ids, region))
+    return {region: ids} if ids and region else {}
+
+
+def is_recheck(event):
+    return isinstance(event, dict) and event.get('action') == RECHECK_EVENT['action']
+
+
+def _cloudtrail_ids(detail):
+    if detail.get('errorCode'):
+        # the call failed, so nothing changed
+        return []
+    if detail['eventName'] == 'RunInstances':
+        items = _items((detail.get('responseElements') or {}).get('instancesSet'))
+        return [i['instanceId'] for i in items if i.get('instanceId')]
+    items = _items((detail.get('requestParameters') or {}).get('resourcesSet'))
+    # tags can be put on any kind of resource
+    return [i['resourceId'] for i in items if i.get('resourceId', '').startswith('i-')]
+
+
+def _items(item_set):
+    return (item_set or {}).get('items') or []
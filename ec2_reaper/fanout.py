@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+
+"""Fan a sweep out over several worker invocations.
+
+In orchestrator mode the Lambda handler splits a sweep into shards, by
+region or by account and region, and sends each one to a worker as an event:
+
+    {"action": "worker", "shard": {"regions": ["us-east-1"], "roles": null}}
+
+Workers sweep just their shard and return their counts, stats and matches
+rather than reporting them. The orchestrator merges those into one summary
+and sends one Slack report, so a sweep is spread across as many Lambda
+invocations as there are shards rather than squeezed into one. Workers never
+return their full reaperlog, which would run into Lambda's 6MB payload limit;
+with LOG_SINK set each writes its own and returns where it went.
+
+How workers get invoked is pluggable: `LambdaInvoker` calls a function
+(usually the orchestrator's own) through the Lambda API, and `LocalInvoker`
+calls a handler in-process, for tests and local runs. Others can be added
+with `register_invoker`.
+"""
+
+import json
+import logging
+
+from ec2_reaper.decision import Decision
+from ec2_reaper.output import record
+from ec2_reaper.summary import ReapSummary
+
+# shard sweeps by region, or by account and region
+BY_REGION = 'region'
+BY_ACCOUNT = 'account'
+SHARD_BY = (BY_REGION, BY_ACCOUNT)
+
+FANOUT_EVENT = {'action': 'fanout'}
+WORKER_ACTION = 'worker'
+
+# worker invocations in flight at once. None sends every shard at once: invocations are
+# synchronous, so a limit makes shards run in waves, all within the orchestrator's timeout.
+DEFAULT_FANOUT_WORKERS = None
+
+# seconds to wait for a worker; Lambda functions run for at most 15 minutes
+WORKER_TIMEOUT = 900
+
+log = logging.getLogger()
+
+_invokers = {}
+
+
+class InvokeError(Exception):
+    """A worker failed, or its response couldn't be read."""
+
+
+def is_fanout(event):
+    return isinstance(event, dict) and event.get('action') == FANOUT_EVENT['action']
+
+
+def is_worker(event):
+    return isinstance(event, dict) and event.get('action') == WORKER_ACTION
+
+
+def worker_event(shard):
+    return {'action': WORKER_ACTION, 'shard': shard}
+
+
+def shards(regions, roles=None, by=BY_REGION):
+    """shards - Split a sweep into `{'regions': [...], 'roles': [...]}` shards
+
+    regions: Region names. May be None when sharding by account, for each
+        account to find its own regions
+    roles: Role ARNs to assume, one per account. Default: None (boto3's usual credentials)
+    by: 'region' for a shard per region, covering every account, or 'account'
+        for a shard per account and region. Default: 'region'
+    """
+    if by not in SHARD_BY:
+        raise ValueError('by must be one of {}, got {}'.format(SHARD_BY, by))
+    roles = list(roles) if roles else None
+    if by == BY_ACCOUNT and roles:
+        if not regions:
+            return [{'regions': None, 'roles': [role]} for role in roles]
+        return [{'regions': [region], 'roles': [role]} for role in roles for region in regions]
+    if not regions:
+        raise ValueError('Sharding by region needs a list of regions')
+    return [{'regions': [region], 'roles': roles} for region in regions]
+
+
+def pack(entry):
+    """A reaperlog entry as a JSON-ready record for a worker's response, launch time in epoch seconds."""
+    return record(entry, iso=False)
+
+
+def unpack(r):
+    """Turn a `pack`ed record back into a `Decision`."""
+    return Decision(r['id'], r['tag_match'], r['age_match'], r['tags'], r['launch_time'],
+                    r['region'], r['account'], r['policy'], r['reaped'], r['error'])
+
+
+def worker_body(summary):
+    """The parts of a worker's summary the orchestrator needs to merge, as a response body."""
+    body = summary.as_dict()
+    body['errors'] = summary.errors
+    body['reaped_entries'] = [pack(e) for e in summary.reaped]
+    body['too_young_entries'] = [pack(e) for e in summary.too_young]
+    return body
+
+
+def worker_summary(body):
+    """Rebuild a worker's `ReapSummary` from its `worker_body`."""
+    summary = ReapSummary(keep_matches=True)
+    summary.instances = body['instances']
+    summary.tag_matches = body['tag_matches']
+    summary.reaped_count = body['reaped']
+    summary.too_young_count = body['matches_under_min_age']
+    summary.errors = body.get('errors', 0)
+    summary.reaped_by_policy = dict(body.get('reaped_by_policy', {}))
+    summary.reaped = [unpack(r) for r in body.get('reaped_entries', [])]
+    summary.too_young = [unpack(r) for r in body.get('too_young_entries', [])]
+    return summary
+
+
+def dispatch(invoker, shards, workers=DEFAULT_FANOUT_WORKERS):
+    """dispatch - Send each shard to a worker and collect what they return
+
+    invoker: Anything with an `invoke(event)` returning the worker's response dict
+    shards: From `shards()`
+    workers: Invocations in flight at once. Default: None (every shard at once)
+
+    Returns a list of `(shard, response body, error)` in shard order, with
+    either the body or the error set. One failed shard doesn't stop the others.
+    """
+    def _run(shard):
+        try:
+            response = invoker.invoke(worker_event(shard))
+            if not isinstance(response, dict) or response.get('statusCode') != 200:
+                raise InvokeError('Worker responded with {!r}'.format(response)[:500])
+            return shard, response['body'], None
+        except Exception as e:
+            log.error('Worker for shard {} failed: {}'.format(shard, e))
+            return shard, None, e
+
+    workers = min(workers or len(shards), len(shards))
+    if workers <= 1:
+        return [_run(s) for s in shards]
+
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_run, shards))
+
+
+class LocalInvoker(object):
+    """Calls `handler(event, None)` in this process.
+
+    handler: Default: `ec2_reaper.aws_lambda.handler`
+    """
+
+    def __init__(self, handler=None):
+        if handler is None:
+            from ec2_reaper.aws_lambda import handler
+        self.handler = handler
+
+    def invoke(self, event):
+        # a round trip through JSON, as a real invocation would make
+        return json.loads(json.dumps(self.handler(event, None)))
+
+
+class LambdaInvoker(object):
+    """Invokes a Lambda function synchronously for each worker.
+
+    function: Function name or ARN. Default: AWS_LAMBDA_FUNCTION_NAME, ie: this function
+    region: Default: the function's own region
+    """
+
+    def __init__(self, function=None, region=None, client=None):
+        import os
+        self.function = function or os.environ.get('AWS_LAMBDA_FUNCTION_NAME')
+        if not self.function:
+            raise ValueError('No function to invoke workers with; set FANOUT_FUNCTION')
+        self._client = client if client is not None else \
+            _lambda_client(region or os.environ.get('AWS_REGION'))
+
+    def invoke(self, event):
+        r = self._client.invoke(FunctionName=self.function, InvocationType='RequestResponse',
+                                Payload=json.dumps(event).encode('utf-8'))
+        payload = r['Payload'].read()
+        if r.get('FunctionError'):
+            raise InvokeError('{} error: {}'.format(r['FunctionError'], payload[:500]))
+        return json.loads(payload.decode('utf-8'))
+
+
+def _lambda_client(region):
+    """A Lambda client which waits as long as a worker can run for."""
+    from botocore.config import Config
+    from ec2_reaper import clients
+
+    config = clients.client_config().merge(Config(read_timeout=WORKER_TIMEOUT))
+    return clients.get_session().client('lambda', region_name=region, config=config,
+                                        endpoint_url=clients.endpoint_url('lambda'))
+
+
+def register_invoker(name, cls):
+    """Use `cls(**kwargs)` for FANOUT_INVOKER `name`."""
+    _invokers[name] = cls
+
+
+def get_invoker(name, **kwargs):
+    try:
+        cls = _invokers[name]
+    except KeyError:
+        raise ValueError('No fan-out invoker called {}'.format(name))
+    return cls(**kwargs)
+
+
+register_invoker('lambda', LambdaInvoker)
+register_invoker('local', LocalInvoker)
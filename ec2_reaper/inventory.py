@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+
+"""Inventory snapshots, and offline policy simulation over them.
+
+`export` writes every running instance's ID, region, account, launch time
+and tags to a snapshot file (gzipped if its name ends in .gz). `simulate`
+then evaluates any tag matcher and `min_age` against the snapshot without
+touching AWS, so policy changes can be reviewed against production-sized
+data.
+
+Snapshots are JSON Lines, stored by column. The first line is a header:
+
+    {"format": "ec2-reaper-inventory", "version": 1, "exported_at": 1500000000.0}
+
+and each line after it a block of up to `DEFAULT_BLOCK_SIZE` instances, with
+launch times in epoch seconds. Fleets share a handful of tag sets between
+many instances, so each distinct tag set is written once, in the block it
+first appears in, and instances refer to it by its position among all the
+tag sets so far:
+
+    {"id": ["i-0123", "i-4567"], "region": ["us-east-1", "us-east-1"], "account": [null, null],
+     "launch_time": [1499990000.0, 1499995000.0], "tagset": [0, 0], "new_tagsets": [{"Name": "web"}]}
+"""
+
+import gzip
+import io
+import json
+import logging
+import time
+
+from ec2_reaper.matcher import TagMatcher, tag_dict
+from ec2_reaper.policy import load_policies
+from ec2_reaper.state import epoch
+
+FORMAT = 'ec2-reaper-inventory'
+VERSION = 1
+
+# instances per block, both in snapshot files and when simulating over plain records
+DEFAULT_BLOCK_SIZE = 10000
+
+COLUMNS = ('id', 'region', 'account', 'launch_time')
+
+log = logging.getLogger()
+
+
+def _open(path, mode):
+    # binary either way, so lines are bytes on Python 2 and 3 alike
+    return gzip.open(path, mode + 'b') if path.endswith('.gz') else io.open(path, mode + 'b')
+
+
+def _line(o):
+    return (json.dumps(o, separators=(',', ':'), sort_keys=True) + '\n').encode('utf-8')
+
+
+def scan_inventory(regions=None, workers=1, engine=None, page_size=None, stats=None, roles=None,
+                   account_workers=None):
+    """scan_inventory - Yield a snapshot record for every running instance
+
+    Takes the same scanning arguments as `ec2_reaper.reap_iter`, and scans
+    the same way, but evaluates nothing and terminates nothing. Records are
+    dicts of id, region, account, launch_time (epoch seconds) and tags (a
+    `{k: v}` dict).
+    """
+    from ec2_reaper import ec2_reaper
+    from ec2_reaper.stats import ReapStats
+
+    stats = stats if stats is not None else ReapStats()
+    engine = engine or ec2_reaper.DEFAULT_ENGINE
+    page_size = page_size or ec2_reaper.DEFAULT_PAGE_SIZE
+    if isinstance(regions, str):
+        regions = (regions,)
+
+    def _scan_region(region, credentials=None, account=None):
+        rstats = stats.region(region, account)
+        for _, instances in ec2_reaper._region_pages(region, engine=engine, page_size=page_size,
+                                                     rstats=rstats, credentials=credentials,
+                                                     account=account):
+            yield [{'id': i.id, 'region': region, 'account': account,
+                    'launch_time': epoch(i.launch_time), 'tags': tag_dict(i.tags)}
+                   for i in instances]
+
+    try:
+        for page in ec2_reaper._scan_accounts(_scan_region, regions, workers, roles,
+                                              account_workers, stats):
+            for record in page:
+                yield record
+    finally:
+        stats.finish()
+
+
+def _blocks(records, tagsets, block_size=DEFAULT_BLOCK_SIZE):
+    """Group records into column blocks, interning their tag sets.
+
+    tagsets: `{tag set key: index}` of the tag sets seen so far, added to as new ones turn up
+    """
+    block = None
+    for record in records:
+        if block is None:
+            block = dict((c, []) for c in COLUMNS)
+            block['tagset'], block['new_tagsets'] = [], []
+        for c in COLUMNS:
+            block[c].append(record.get(c))
+        tags = record['tags']
+        key = tuple(sorted(tags.items()))
+        index = tagsets.get(key)
+        if index is None:
+            index = tagsets[key] = len(tagsets)
+            block['new_tagsets'].append(tags)
+        block['tagset'].append(index)
+        if len(block['id']) >= block_size:
+            yield block
+            block = None
+    if block is not None:
+        yield block
+
+
+def export(path, records=None, now=None, block_size=DEFAULT_BLOCK_SIZE, **kwargs):
+    """export - Write an inventory snapshot to `path`
+
+    records: Snapshot records to write. Default: `scan_inventory(**kwargs)`
+    now: Epoch seconds to stamp the snapshot with. Default: time.time()
+    block_size: Instances per block. Default: 10000
+
+    Returns the number of instances written.
+    """
+    records = records if records is not None else scan_inventory(**kwargs)
+    header = {'format': FORMAT, 'version': VERSION,
+              'exported_at': now if now is not None else time.time()}
+    count = 0
+    with _open(path, 'w') as f:
+        f.write(_line(header))
+        for block in _blocks(records, {}, block_size):
+            f.write(_line(block))
+            count += len(block['id'])
+    log.info('Exported {} instances to {}'.format(count, path))
+    return count
+
+
+class Snapshot(object):
+    """A snapshot file, open for reading.
+
+    Iterate it for records like `scan_inventory`'s, or read `blocks()` for
+    its columns. `tagsets` fills up with every tag set read so far, and
+    `instances` counts the instances.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.tagsets = []
+        self.instances = 0
+        self._f = _open(path, 'r')
+        try:
+            self.header = json.loads(self._f.readline().decode('utf-8') or '{}')
+        except ValueError:
+            self.header = {}
+        if self.header.get('format') != FORMAT:
+            self.close()
+            raise ValueError('{} is not an ec2-reaper inventory snapshot'.format(path))
+        if self.header.get('version', VERSION) > VERSION:
+            self.close()
+            raise ValueError('{} is a version {} snapshot; this reaper reads up to version {}'.format(
+                path, self.header['version'], VERSION))
+
+    @property
+    def exported_at(self):
+        return self.header.get('exported_at')
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def blocks(self):
+        """Yield the snapshot's column blocks, in order. Can only be read once."""
+        for line in self._f:
+            if not line.strip():
+                continue
+            block = json.loads(line.decode('utf-8'))
+            self.tagsets.extend(block.pop('new_tagsets', ()))
+            self.instances += len(block['id'])
+            yield block
+
+    def __iter__(self):
+        tagsets = self.tagsets
+        for block in self.blocks():
+            for row in zip(*[block[c] for c in COLUMNS + ('tagset',)]):
+                record = dict(zip(COLUMNS, row[:-1]))
+                record['tags'] = tagsets[row[-1]]
+                yield record
+
+
+def load(path):
+    """Open a snapshot, returning its header dict and an iterator of its records."""
+    snapshot = Snapshot(path)
+
+    def _records():
+        with snapshot:
+            for record in snapshot:
+                yield record
+
+    return snapshot.header, _records()
+
+
+def simulate(source, tags=None, min_age=None, now=None, block_size=DEFAULT_BLOCK_SIZE,
+             policies=None):
+    """simulate - Evaluate a policy against a snapshot, as `reap_iter` would in dry-run mode
+
+    source: A `Snapshot`, or an iterable of snapshot records
+    tags: Tag matchers, or a compiled `TagMatcher`. Default: `DEFAULT_TAG_MATCHER`
+    min_age: As for `reap`. Default: 300
+    now: Epoch seconds to judge ages at, eg: the snapshot's `exported_at`. Default: time.time()
+    block_size: Records per block, when `source` is records. Default: 10000
+    policies: Named policies to evaluate in place of `tags` and `min_age`, as for `reap`. Default: None
+
+    Yields reaperlog-style entries for instances matching on tags or age,
+    with `reaped` set on those which would be reaped and `launch_time` left
+    in epoch seconds.
+
+    Evaluation runs a block of instances at a time, column by column: the
+    matchers run once per distinct tag set, and ages are a single comparison
+    per instance, so a big fleet costs little more than its distinct tag sets.
+    """
+    from ec2_reaper.ec2_reaper import DEFAULT_MIN_AGE, DEFAULT_TAG_MATCHER
+
+    now = now if now is not None else time.time()
+    if policies is not None:
+        matcher = load_policies(policies)
+        # old enough for some policy; tag matches are judged by their own policies below
+        min_age = matcher.min_age
+    else:
+        matcher = tags if isinstance(tags, TagMatcher) else \
+            TagMatcher(tags if tags else DEFAULT_TAG_MATCHER, cache_size=0)
+        min_age = min_age if min_age is not None else DEFAULT_MIN_AGE
+    cutoff = now - min_age
+
+    if isinstance(source, Snapshot):
+        blocks, tagsets = source.blocks(), source.tagsets
+    else:
+        tagsets, keys = [], {}
+        blocks = _tracked(_blocks(source, keys, block_size), tagsets)
+
+    # decisions[n] is the tag decision for tagsets[n]
+    decisions = []
+    for block in blocks:
+        decisions.extend(matcher.match(t) for t in tagsets[len(decisions):])
+        tag_match = [decisions[t] for t in block['tagset']]
+        age_match = [t < cutoff for t in block['launch_time']]
+        for n in [n for n, (ct, ca) in enumerate(zip(tag_match, age_match)) if ct or ca]:
+            ct, ca, policy = tag_match[n], age_match[n], None
+            if policies is not None and ct:
+                ca, policy = matcher.decide(ct, now - block['launch_time'][n])
+            ct = bool(ct)
+            yield {'id': block['id'][n], 'tag_match': ct, 'age_match': ca,
+                   'tags': tagsets[block['tagset'][n]], 'launch_time': block['launch_time'][n],
+                   'reaped': ct and ca, 'region': block['region'][n],
+                   'account': block['account'][n], 'policy': policy}
+    log.debug('Simulated with {} distinct tag sets'.format(len(decisions)))
+
+
+def _tracked(blocks, tagsets):
+    """Pass blocks through, collecting their new tag sets into `tagsets` as a `Snapshot` does."""
+    for block in blocks:
+        tagsets.extend(block.pop('new_tagsets'))
+        yield block
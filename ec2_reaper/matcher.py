@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+"""Compiled tag matchers for EC2 Reaper."""
+
+import logging
+import threading
+from collections import OrderedDict
+
+DEFAULT_CACHE_SIZE = 4096
+
+# with fewer matchers than this, evaluating them is cheaper than a cache lookup
+CACHE_MIN_MATCHERS = 32
+
+log = logging.getLogger()
+
+
+def tag_dict(instance_tags):
+    """Turn boto's `[{'Key': k, 'Value': v}, ...]` tag list into a `{k: v}` dict."""
+    return {t['Key']: t.get('Value') for t in instance_tags} if instance_tags else {}
+
+
+if hasattr(OrderedDict, 'move_to_end'):
+    def _move_to_end(d, key):
+        d.move_to_end(key)
+else:
+    def _move_to_end(d, key):
+        d[key] = d.pop(key)
+
+
+class TagMatcher(object):
+    """A list of tag matchers compiled into a single predicate.
+
+    Call it with an instance's boto-style tag list; it returns True if any
+    matcher accepts the instance, exactly like `ec2_reaper._check_tags`.
+
+    Decisions are cached in an LRU keyed on the instance's values for the tags
+    the matchers look at, as autoscaled fleets tend to share identical tags.
+    Short matcher lists skip the cache, since it wouldn't pay for itself;
+    `cache_size=0` disables it outright.
+    """
+
+    def __init__(self, matching_tags, cache_size=DEFAULT_CACHE_SIZE):
+        self.matching_tags = matching_tags
+        self.hits = 0
+        self.misses = 0
+        self._matchers = tuple(self._compile(mt) for mt in matching_tags)
+        self._keys = tuple(sorted(set(m[0] for m in self._matchers), key=str))
+        self.cache_size = cache_size if len(self._matchers) >= CACHE_MIN_MATCHERS else 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _compile(mt):
+        includes = mt.get('includes') or []
+        excludes = mt.get('excludes') or []
+        return (mt.get('tag'), frozenset(includes), frozenset(excludes),
+                includes == [u'*'], excludes == [u'*'])
+
+    def __call__(self, instance_tags):
+        return self.match(tag_dict(instance_tags))
+
+    def match(self, tags):
+        """Evaluate a `{k: v}` tag dict, going through the decision cache."""
+        if not self.cache_size:
+            return self._evaluate(tags)
+
+        key = self.fingerprint(tags)
+        with self._lock:
+            decision = self._cache.get(key)
+            if decision is not None:
+                self.hits += 1
+                _move_to_end(self._cache, key)
+                return decision
+
+        decision = self._evaluate(tags)
+        with self._lock:
+            self.misses += 1
+            self._cache[key] = decision
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return decision
+
+    def fingerprint(self, tags):
+        """Hashable key of the tag values that can affect a decision.
+
+        Missing tags are None, which no tag value can be.
+        """
+        return tuple([tags.get(k) for k in self._keys])
+
+    def _evaluate(self, tags):
+        debug = log.isEnabledFor(logging.DEBUG)
+        for tag, includes, excludes, include_any, exclude_missing in self._matchers:
+            if tag not in tags:
+                # reap if `tag` is not present and excludes == ['*']
+                # eg: {tag: Name, excludes: ['*']}. If it has a Name, don't reap it.
+                if exclude_missing:
+                    if debug:
+                        log.debug('Tag "{}" not present; instance is reapable.'.format(tag))
+                    return True
+                continue
+
+            value = tags[tag]
+
+            # matching reapme tag exists and is not empty
+            if include_any and value:
+                if debug:
+                    log.debug('Tag "{}" is present and `include` is wildcarded; instance is reapable.'.format(tag))
+                return True
+
+            # tag exists, matches a value in includes, doesn't match any excludes
+            if value in includes and value not in excludes:
+                if debug:
+                    log.debug('Tag "{}" present, its value is in `includes` and not in `excludes`; instance is reapable.'.format(tag))
+                return True
+        return False
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+"""Machine-readable reaperlog output, streamed as entries come out of a sweep.
+
+Each entry becomes a flat record:
+
+    {"id": "i-0123", "region": "us-east-1", "account": null, "tag_match": true, "age_match": true,
+     "reaped": true, "launch_time": "2017-01-01T12:00:00+00:00", "policy": null, "error": null,
+     "tags": {"Name": "web"}}
+
+with the launch time in ISO 8601 and tags as a `{k: v}` dict. Formats are:
+
+    jsonl   one JSON object per line
+    json    a JSON array, one object per line
+    csv     a header row, then one row per entry with tags as a JSON object
+
+Nothing is buffered beyond the stream's own buffer, however many entries a
+sweep turns up.
+"""
+
+import csv
+import json
+from datetime import datetime
+
+from ec2_reaper.decision import Decision, utc_datetime
+from ec2_reaper.matcher import tag_dict
+from ec2_reaper.state import epoch
+
+JSONL = 'jsonl'
+JSON = 'json'
+CSV = 'csv'
+
+COLUMNS = ('id', 'region', 'account', 'tag_match', 'age_match', 'reaped', 'launch_time', 'policy',
+           'error', 'tags')
+
+# records are already JSON-ready, so no `default` hook is needed
+_encode = json.JSONEncoder(separators=(',', ':')).encode
+
+_writers = {}
+
+
+def record(entry, iso=True):
+    """Flatten a reaperlog entry into a JSON-ready dict of `COLUMNS`.
+
+    iso: Give the launch time in ISO 8601, rather than epoch seconds. Default: True
+
+    Reads a `Decision`'s compact fields directly. Plain dicts, eg: from
+    `inventory.simulate`, may have boto tag lists or `{k: v}` tags, and
+    datetimes or epoch seconds for launch times.
+    """
+    if isinstance(entry, Decision):
+        tags, launched = entry.tags, entry.launched
+    else:
+        tags, launched = entry.get('tags'), entry.get('launch_time')
+        tags = tag_dict(tags) if isinstance(tags, list) else tags or {}
+        if isinstance(launched, datetime):
+            launched = epoch(launched)
+    if iso and launched is not None:
+        launched = utc_datetime(launched).isoformat()
+    return {'id': entry['id'], 'region': entry.get('region'), 'account': entry.get('account'),
+            'tag_match': entry['tag_match'], 'age_match': entry['age_match'],
+            'reaped': entry['reaped'], 'policy': entry.get('policy'), 'error': entry.get('error'),
+            'launch_time': launched, 'tags': tags}
+
+
+class JsonLinesWriter(object):
+    """Writes one JSON object per line to a text stream."""
+
+    def __init__(self, stream):
+        self.entries = 0
+        self._stream = stream
+
+    def write(self, entry):
+        self._stream.write(_encode(record(entry)) + '\n')
+        self.entries += 1
+        return entry
+
+    def close(self):
+        self._stream.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class JsonWriter(JsonLinesWriter):
+    """Writes a JSON array, opened on the first entry and closed by `close()`."""
+
+    def write(self, entry):
+        self._stream.write((',\n' if self.entries else '[\n') + _encode(record(entry)))
+        self.entries += 1
+        return entry
+
+    def close(self):
+        self._stream.write('\n]\n' if self.entries else '[]\n')
+        self._stream.flush()
+
+
+class CsvWriter(JsonLinesWriter):
+    """Writes a header row, then a row per entry. Empty cells are None."""
+
+    def __init__(self, stream):
+        super(CsvWriter, self).__init__(stream)
+        self._csv = csv.writer(stream, lineterminator='\n')
+        self._csv.writerow(COLUMNS)
+
+    def write(self, entry):
+        r = record(entry)
+        r['tags'] = _encode(r['tags'])
+        self._csv.writerow([r[c] for c in COLUMNS])
+        self.entries += 1
+        return entry
+
+
+def register_writer(name, cls):
+    """Use `cls(stream)` for `--output name`."""
+    _writers[name] = cls
+
+
+def get_writer(name, stream):
+    """Build the writer for output format `name`, writing to text `stream`."""
+    try:
+        return _writers[name](stream)
+    except KeyError:
+        raise ValueError('No output format called {}'.format(name))
+
+
+def formats():
+    return sorted(_writers)
+
+
+register_writer(JSONL, JsonLinesWriter)
+register_writer(JSON, JsonWriter)
+register_writer(CSV, CsvWriter)
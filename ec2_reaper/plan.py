@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+"""Reap plans: record what a dry run would reap, then reap exactly that.
+
+`reap --plan-out plan.json` writes every instance the dry run would have
+reaped, with the inputs its decision was made on, and the tag matchers,
+min_age or policies and roles used:
+
+    {"format": "ec2-reaper-plan", "version": 1, "created_at": 1500000000.0,
+     "tags": [...], "min_age": 300, "policies": null, "roles": [],
+     "instances": [{"id": "i-0123", "region": "us-east-1", "account": null,
+                    "launch_time": 1499990000.0, "tags": {"Name": ""}, "policy": null}]}
+
+`apply` then re-checks only those instances, with batched DescribeInstances
+calls per account and region, and terminates the ones which still match.
+Instances which have gone, stopped or been retagged out of the policy since
+are left alone. Applying costs a few calls per region however big the fleet
+is, and nothing is reaped which wasn't in the plan.
+"""
+
+import json
+import logging
+import time
+from collections import OrderedDict
+
+from ec2_reaper.accounts import account_id
+from ec2_reaper.output import record
+
+FORMAT = 'ec2-reaper-plan'
+VERSION = 1
+
+log = logging.getLogger()
+
+
+class Plan(object):
+    """The instances a dry run would reap, and how it decided.
+
+    tags: Tag matchers. Default: None (`DEFAULT_TAG_MATCHER`)
+    min_age: As for `reap`. Default: None (300)
+    policies: Named policies as a list of dicts, in place of `tags` and `min_age`. Default: None
+    roles: Role ARNs the instances were found with. Default: None
+    """
+
+    def __init__(self, tags=None, min_age=None, policies=None, roles=None, instances=None,
+                 created_at=None):
+        self.tags = tags
+        self.min_age = min_age
+        self.policies = policies
+        self.roles = list(roles) if roles else []
+        self.instances = instances if instances is not None else []
+        self.created_at = created_at if created_at is not None else time.time()
+
+    def add(self, entry):
+        """Record `entry` if it would be reaped. Returns `entry`, to pass along a stream."""
+        if entry['reaped']:
+            r = record(entry, iso=False)
+            self.instances.append(dict((k, r[k]) for k in
+                                       ('id', 'region', 'account', 'launch_time', 'tags', 'policy')))
+        return entry
+
+    def groups(self):
+        """Planned instance IDs as `{(account, region): [ids]}`."""
+        groups = OrderedDict()
+        for i in self.instances:
+            groups.setdefault((i['account'], i['region']), []).append(i['id'])
+        return groups
+
+    def as_dict(self):
+        return {'format': FORMAT, 'version': VERSION, 'created_at': self.created_at,
+                'tags': self.tags, 'min_age': self.min_age, 'policies': self.policies,
+                'roles': self.roles, 'instances': self.instances}
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.as_dict(), f, indent=1, sort_keys=True)
+        log.info('Wrote a plan to reap {} instances to {}'.format(len(self.instances), path))
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            try:
+                d = json.load(f)
+            except ValueError:
+                d = {}
+        if not isinstance(d, dict) or d.get('format') != FORMAT:
+            raise ValueError('{} is not an ec2-reaper plan'.format(path))
+        if d.get('version', VERSION) > VERSION:
+            raise ValueError('{} is a version {} plan; this reaper reads up to version {}'.format(
+                path, d['version'], VERSION))
+        return cls(d.get('tags'), d.get('min_age'), d.get('policies'), d.get('roles'),
+                   d.get('instances', []), d.get('created_at'))
+
+
+def apply(plan, debug=False, engine=None, page_size=None, stats=None, state=None):
+    """apply - Reap the instances in a plan which still qualify
+
+    plan: A `Plan`, or the path to one
+    debug: If True, only report what would be reaped now. Default: False
+    engine, page_size, stats, state: As for `reap`
+
+    Re-checks each account and region's planned instances with instance-id
+    filtered DescribeInstances calls, at most `FILTER_VALUES_LIMIT` IDs a
+    call, evaluating them against the plan's own tag matchers and min_age or
+    policies. Yields reaperlog entries for the instances still found; planned
+    instances which are gone or no longer match are logged and skipped.
+    """
+    from ec2_reaper import ec2_reaper
+    from ec2_reaper.stats import ReapStats
+
+    plan = plan if isinstance(plan, Plan) else Plan.load(plan)
+    stats = stats if stats is not None else ReapStats()
+    roles = dict((account_id(r), r) for r in plan.roles)
+    kwargs = {'min_age': plan.min_age if plan.min_age is not None else ec2_reaper.DEFAULT_MIN_AGE,
+              'policies': plan.policies, 'debug': debug, 'stats': stats, 'state': state,
+              'engine': engine or ec2_reaper.DEFAULT_ENGINE,
+              'page_size': page_size or ec2_reaper.DEFAULT_PAGE_SIZE}
+
+    for (account, region), ids in plan.groups().items():
+        if account is not None and account not in roles:
+            log.error('Skipping {} planned instances in account {}: no role for it in the plan'.format(
+                len(ids), account))
+            continue
+        reaped = set()
+        for entry in ec2_reaper.reap_iter(plan.tags, regions=region, instance_ids=ids,
+                                          roles=[roles[account]] if account is not None else None,
+                                          **kwargs):
+            if entry['reaped']:
+                reaped.add(entry['id'])
+            yield entry
+        skipped = [i for i in ids if i not in reaped]
+        if skipped:
+            log.warning('{} planned instances in {}{} were not reaped; they have gone, or no longer '
+                        'match: {}'.format(len(skipped), region,
+                                           ' ({})'.format(account) if account else '', skipped))
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+"""Named reaper policies, evaluated together in a single scan.
+
+A policy is a name, a list of tag matchers and a `min_age`, eg:
+
+    [{"name": "untagged", "tags": [{"tag": "Name", "includes": [], "excludes": ["*"]}], "min_age": 300},
+     {"name": "ci", "tags": [{"tag": "Name", "includes": ["cirunner"], "excludes": []}], "min_age": 7200},
+     {"name": "sandbox", "tags": [{"tag": "env", "includes": ["sandbox"], "excludes": []}], "min_age": 86400}]
+
+An instance is reaped if any policy matches its tags and it's older than
+that policy's `min_age`. Its reaperlog entry names the first policy which
+would reap it, or else, for too-young matches, whichever matching policy
+would reap it soonest.
+"""
+
+import json
+import os
+
+from ec2_reaper.matcher import DEFAULT_CACHE_SIZE, TagMatcher, tag_dict
+
+
+class Policy(object):
+    """One named set of tag matchers and its minimum age."""
+
+    def __init__(self, name, tags, min_age=None):
+        from ec2_reaper.ec2_reaper import DEFAULT_MIN_AGE
+
+        if not name:
+            raise ValueError('Policies need a name')
+        if not tags:
+            raise ValueError('Policy {} has no tag matchers'.format(name))
+        self.name = name
+        self.tags = tags
+        self.min_age = int(min_age) if min_age is not None else DEFAULT_MIN_AGE
+
+    def as_dict(self):
+        return {'name': self.name, 'tags': self.tags, 'min_age': self.min_age}
+
+    def __repr__(self):
+        return 'Policy({!r}, min_age={})'.format(self.name, self.min_age)
+
+
+class PolicySet(object):
+    """Several policies compiled to work like one `TagMatcher`.
+
+    `match()` returns a bitmask of the policies whose tags match (bit n for
+    the nth policy), which is truthy exactly when some policy matches; the
+    state store keeps it as the instance's tag decision. `decide()` then
+    turns a mask and an age into the age decision and the policy responsible.
+    """
+
+    def __init__(self, policies, cache_size=DEFAULT_CACHE_SIZE):
+        self.policies = [p if isinstance(p, Policy) else Policy(**p) for p in policies]
+        if not self.policies:
+            raise ValueError('No policies given')
+        names = [p.name for p in self.policies]
+        if len(set(names)) != len(names):
+            raise ValueError('Policy names must be unique, got {}'.format(names))
+        self._by_name = dict((p.name, p) for p in self.policies)
+        self._matchers = [TagMatcher(p.tags, cache_size) for p in self.policies]
+        self._keys = tuple(sorted(set(k for m in self._matchers for k in m._keys), key=str))
+        # what the state store ties its decisions to
+        self.matching_tags = [p.as_dict() for p in self.policies]
+        # old enough for at least one policy
+        self.min_age = min(p.min_age for p in self.policies)
+
+    def __len__(self):
+        return len(self.policies)
+
+    def __getitem__(self, name):
+        return self._by_name[name]
+
+    @property
+    def hits(self):
+        return sum(m.hits for m in self._matchers)
+
+    @property
+    def misses(self):
+        return sum(m.misses for m in self._matchers)
+
+    def __call__(self, instance_tags):
+        return self.match(tag_dict(instance_tags))
+
+    def match(self, tags):
+        """Bitmask of the policies whose matchers accept a `{k: v}` tag dict."""
+        mask = 0
+        for n, matcher in enumerate(self._matchers):
+            if matcher.match(tags):
+                mask |= 1 << n
+        return mask
+
+    def fingerprint(self, tags):
+        """Hashable key of the tag values that can affect any policy's decision."""
+        return tuple([tags.get(k) for k in self._keys])
+
+    def decide(self, mask, age):
+        """Return `(age_match, policy name)` for an instance `age` seconds old.
+
+        With no policy matching on tags, age_match says whether the instance is
+        older than the smallest `min_age` and the policy is None.
+        """
+        if not mask:
+            return age > self.min_age, None
+        soonest = None
+        for n, policy in enumerate(self.policies):
+            if mask & (1 << n):
+                if age > policy.min_age:
+                    return True, policy.name
+                if soonest is None or policy.min_age < soonest.min_age:
+                    soonest = policy
+        return False, soonest.name
+
+    def min_age_of(self, name):
+        """`min_age` of the named policy, or the smallest of them for None."""
+        return self._by_name[name].min_age if name is not None else self.min_age
+
+
+def load_policies(spec):
+    """Build a `PolicySet` from a JSON list of policies, or a file holding one.
+
+    spec: A JSON string, a path to a JSON file, or an already parsed list
+    """
+    if isinstance(spec, PolicySet):
+        return spec
+    if not isinstance(spec, list):
+        if os.path.isfile(spec):
+            with open(spec) as f:
+                spec = f.read()
+        spec = json.loads(spec)
+    return PolicySet(spec)
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+"""Region discovery for EC2 Reaper.
+
+Results are cached in-process, per account, which keeps warm Lambda
+containers from looking regions up on every invocation, and optionally on
+disk for CLI and cron use.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+from ec2_reaper import clients
+
+DEFAULT_REGION_CACHE_TTL = 86400
+DISCOVERY_REGION = 'us-east-1'
+
+# regions in any other state (eg: 'not-opted-in') can't be scanned
+OPTED_IN = ('opt-in-not-required', 'opted-in')
+
+log = logging.getLogger()
+
+_cache = {}
+# one lock per account, so accounts are looked up in parallel but each only once;
+# _lock only guards the two dicts
+_account_locks = {}
+_lock = threading.Lock()
+
+
+def get_regions(refresh=False, ttl=DEFAULT_REGION_CACHE_TTL, cache_file=None, session=None,
+                credentials=None, account=None):
+    """get_regions - List the regions this account can scan
+
+    refresh: If True, skip the caches and ask AWS. Default: False
+    ttl: Seconds cached results stay fresh for. Default: 86400
+    cache_file: Path to a JSON file to cache results in across processes. Default: None (in-process only)
+    session: boto3 session to query with. Default: the shared client pool
+    credentials: Credentials for another account, as for `clients.get_client`. Default: None
+    account: ID of the account `credentials` belong to, which results are cached under. Default: None
+
+    Returns a tuple of region names.
+    """
+    with _lock:
+        account_lock = _account_locks.setdefault(account, threading.Lock())
+    with account_lock:
+        now = time.time()
+        cached = _cache.get(account)
+        if not refresh:
+            if cached and now - cached['fetched_at'] < ttl:
+                return cached['regions']
+            cached = _read_cache_file(cache_file, ttl, now) if cache_file else None
+            if cached:
+                _cache[account] = cached
+                return cached['regions']
+
+        log.debug('Looking up regions in {}'.format(DISCOVERY_REGION))
+        client = session.client('ec2', region_name=DISCOVERY_REGION) if session else \
+            clients.get_client('ec2', DISCOVERY_REGION, credentials)
+        r = client.describe_regions()
+        regions = tuple(sorted(i['RegionName'] for i in r.get('Regions', [])
+                               if i.get('OptInStatus', OPTED_IN[0]) in OPTED_IN))
+        _cache[account] = {'regions': regions, 'fetched_at': now}
+        if cache_file:
+            _write_cache_file(cache_file, _cache[account])
+        return regions
+
+
+def clear_cache():
+    """Forget in-process results. Doesn't touch cache files."""
+    with _lock:
+        _cache.clear()
+        _account_locks.clear()
+
+
+def _read_cache_file(path, ttl, now):
+    try:
+        with open(path) as f:
+            cached = json.load(f)
+        if now - cached['fetched_at'] < ttl:
+            cached['regions'] = tuple(cached['regions'])
+            return cached
+    except (IOError, OSError, ValueError, KeyError, TypeError) as e:
+        log.debug('Ignoring region cache {}: {}'.format(path, e))
+    return None
+
+
+def _write_cache_file(path, cached):
+    try:
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        # write then rename so concurrent runs never see half a file
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump({'regions': list(cached['regions']), 'fetched_at': cached['fetched_at']}, f)
+        os.rename(tmp, path)
+    except (IOError, OSError) as e:
+        log.warning('Unable to write region cache {}: {}'.format(path, e))
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+"""DescribeInstances scan engines for EC2 Reaper.
+
+Both engines yield one list of `InstanceRecord` per page of results. Given a
+`RegionStats`, they record each page's call time and retries in it. Given a
+`throttle.Limiter`, they take a token from it before fetching each page.
+"""
+
+from collections import namedtuple
+
+from ec2_reaper import throttle
+from ec2_reaper.stats import clock
+
+CLIENT_ENGINE = 'client'
+RESOURCE_ENGINE = 'resource'
+ENGINES = (CLIENT_ENGINE, RESOURCE_ENGINE)
+
+# DescribeInstances accepts MaxResults between 5 and 1000
+MIN_PAGE_SIZE = 5
+MAX_PAGE_SIZE = 1000
+
+# only the fields the reaper needs; tags are boto's `[{'Key': k, 'Value': v}, ...]` list or None
+InstanceRecord = namedtuple('InstanceRecord', ['id', 'launch_time', 'tags', 'state'])
+
+
+def _timed_pages(pages, stats, limiter=None):
+    """Iterate `pages`, recording how long each one took to come back."""
+    from botocore.exceptions import ClientError
+
+    limiter = limiter if limiter is not None else throttle.NO_LIMIT
+    pages = iter(pages)
+    while True:
+        wait = limiter.acquire()
+        start = clock()
+        try:
+            page = next(pages)
+        except StopIteration:
+            # paginators find out they're done without making a call
+            limiter.refund()
+            return
+        except ClientError as e:
+            limiter.observe(error=e)
+            if stats is not None:
+                stats.api_error(e)
+            raise
+        response = page if isinstance(page, dict) else None
+        limiter.observe(response)
+        if stats is not None:
+            stats.describe_seconds += stats.api_call(clock() - start, response)
+            stats.wait_seconds += wait
+            stats.pages += 1
+        yield page
+
+
+def scan_client(client, filters, page_size=MAX_PAGE_SIZE, stats=None, limiter=None):
+    """Page through DescribeInstances with a low-level client."""
+    page_size = max(MIN_PAGE_SIZE, min(page_size, MAX_PAGE_SIZE))
+    paginator = client.get_paginator('describe_instances')
+    pages = paginator.paginate(Filters=filters, PaginationConfig={'PageSize': page_size})
+    for page in _timed_pages(pages, stats, limiter):
+        yield [InstanceRecord(i['InstanceId'], i['LaunchTime'], i.get('Tags'), i['State']['Name'])
+               for r in page.get('Reservations', []) for i in r.get('Instances', [])]
+
+
+def scan_resource(resource, filters, page_size=None, stats=None, limiter=None):
+    """Page through DescribeInstances with boto3 resource objects.
+
+    Slower and heavier than `scan_client`, and can't report retries (so the
+    limiter only learns of throttles which exhaust them); kept for compatibility.
+    """
+    collection = resource.instances.filter(Filters=filters)
+    if page_size:
+        collection = collection.page_size(max(MIN_PAGE_SIZE, min(page_size, MAX_PAGE_SIZE)))
+    for instances in _timed_pages(collection.pages(), stats, limiter):
+        yield [InstanceRecord(i.id, i.launch_time, i.tags, i.state['Name']) for i in instances]
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+"""Expiry scheduling for instances which match but are too young to reap.
+
+Each too-young match is queued with the time it crosses `min_age`. Once
+that time comes, `recheck` looks at just the instances which are due,
+rather than waiting for the next full sweep to notice them.
+
+`ExpiryQueue` keeps the queue in memory, for long-running processes.
+`SQLiteExpiryQueue` keeps it in a file, so it survives between Lambda
+invocations.
+"""
+
+import heapq
+import logging
+import threading
+import time
+
+from ec2_reaper import ec2_reaper
+from ec2_reaper.accounts import account_id
+from ec2_reaper.policy import PolicySet, load_policies
+from ec2_reaper.state import epoch
+
+# re-check this long after an instance's deadline, so it's definitely past min_age
+GRACE_SECONDS = 1.0
+
+log = logging.getLogger()
+
+
+def expires_at(launch_time, min_age):
+    """Epoch seconds at which an instance launched at `launch_time` becomes old enough to reap."""
+    return epoch(launch_time) + min_age
+
+
+class ExpiryQueue(object):
+    """In-memory priority queue of instance expiry times."""
+
+    def __init__(self):
+        self._heap = []
+        self._due = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._due)
+
+    def push(self, id, region, due, account=None):
+        """Queue `id` for `due`, replacing any earlier deadline for it."""
+        with self._lock:
+            self._due[id] = due
+            heapq.heappush(self._heap, (due, id, region, account))
+
+    def discard(self, id):
+        with self._lock:
+            # its heap entry is skipped when it comes up
+            self._due.pop(id, None)
+
+    def next_due(self):
+        """Earliest deadline in the queue, or None if it's empty."""
+        with self._lock:
+            self._drop_stale()
+            return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now=None):
+        """Remove and return `{(account, region): [ids]}` for everything due by `now`."""
+        now = now if now is not None else time.time()
+        due = {}
+        with self._lock:
+            self._drop_stale()
+            while self._heap and self._heap[0][0] <= now:
+                _, id, region, account = heapq.heappop(self._heap)
+                del self._due[id]
+                due.setdefault((account, region), []).append(id)
+                self._drop_stale()
+        return due
+
+    def _drop_stale(self):
+        # callers hold _lock
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+
+class SQLiteExpiryQueue(object):
+    """`ExpiryQueue` kept in a SQLite file. Can share a file with a `StateStore`."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        # as in StateStore, sqlite3 waits until a queue is actually opened
+        import sqlite3
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS expiries '
+                               '(id TEXT PRIMARY KEY, region TEXT, due REAL, account TEXT)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS expiries_due ON expiries (due)')
+            columns = [c[1] for c in self._conn.execute('PRAGMA table_info(expiries)')]
+            if 'account' not in columns:
+                self._conn.execute('ALTER TABLE expiries ADD COLUMN account TEXT')
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM expiries').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def push(self, id, region, due, account=None):
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO expiries (id, region, due, account) '
+                               'VALUES (?, ?, ?, ?)', (id, region, due, account))
+
+    def discard(self, id):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM expiries WHERE id = ?', (id,))
+
+    def next_due(self):
+        with self._lock:
+            return self._conn.execute('SELECT MIN(due) FROM expiries').fetchone()[0]
+
+    def pop_due(self, now=None):
+        now = now if now is not None else time.time()
+        due = {}
+        with self._lock, self._conn:
+            rows = self._conn.execute('SELECT id, region, account FROM expiries WHERE due <= ? '
+                                      'ORDER BY due', (now,)).fetchall()
+            self._conn.execute('DELETE FROM expiries WHERE due <= ?', (now,))
+        for id, region, account in rows:
+            due.setdefault((account, region), []).append(id)
+        return due
+
+
+def schedule(queue, entries, min_age):
+    """Queue the too-young matches in `entries` and drop everything else from `queue`.
+
+    min_age: As for `reap`, or a `PolicySet` to use each entry's policy's min_age
+
+    Yields `entries` back, so it can sit in the middle of a pipeline.
+    """
+    for entry in entries:
+        if entry['tag_match'] and not entry['age_match']:
+            age = min_age.min_age_of(entry.get('policy')) if isinstance(min_age, PolicySet) else min_age
+            due = expires_at(entry['launch_time'], age) + GRACE_SECONDS
+            queue.push(entry['id'], entry['region'], due, entry.get('account'))
+        else:
+            queue.discard(entry['id'])
+        yield entry
+
+
+def recheck(queue, tags=None, min_age=None, now=None, **kwargs):
+    """recheck - Check only the instances whose deadlines have passed
+
+    queue: An `ExpiryQueue` or `SQLiteExpiryQueue`
+    tags, min_age: As for `reap`
+    now: Epoch seconds to treat as the current time. Default: time.time()
+
+    Other keyword arguments (debug, stats, state, roles, policies, etc) are
+    passed on to `reap_iter`. Yields reaperlog entries for the instances which
+    were due and are still running; any which are still too young are queued
+    again. Instances in other accounts are checked by assuming their account's
+    role from `roles`.
+    """
+    min_age = min_age if min_age is not None else ec2_reaper.DEFAULT_MIN_AGE
+    if kwargs.get('policies') is not None:
+        kwargs['policies'] = load_policies(kwargs['policies'])
+    roles = dict((account_id(r), r) for r in kwargs.pop('roles', None) or [])
+    due = queue.pop_due(now)
+    for (account, region), ids in sorted(due.items(), key=lambda d: (d[0][0] or '', d[0][1])):
+        if account and account not in roles:
+            log.warning('No role for account {}, dropping {}'.format(account, ids))
+            continue
+        log.info('Re-checking {} expired matches in {}'.format(len(ids), region))
+        entries = ec2_reaper.reap_iter(tags, min_age=min_age, regions=region, instance_ids=ids,
+                                       roles=[roles[account]] if account else None, **kwargs)
+        for entry in schedule(queue, entries, kwargs.get('policies') or min_age):
+            yield entry
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+"""Destinations for full reaperlogs, written as gzipped JSON Lines.
+
+A sink is picked by URL:
+
+    /var/log/reaper or file:///var/log/reaper   a local directory
+    s3://bucket/some/prefix                      an S3 bucket and key prefix
+
+Other schemes can be added with `register_sink`.
+"""
+
+import gzip
+import json
+import logging
+import os
+import tempfile
+from datetime import datetime
+
+from ec2_reaper import clients
+from ec2_reaper.decision import Decision
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+# S3 logs are buffered in memory up to this size before spilling to disk
+SPOOL_BYTES = 8 * 1024 * 1024
+
+log = logging.getLogger()
+
+_sinks = {}
+
+
+def jsonable(o):
+    """Return `o` with datetimes turned into ISO 8601 strings, ready for `json.dumps`.
+
+    Walks nested dicts, lists and tuples once, rather than encoding and
+    decoding the whole thing. `Decision` records become plain dicts.
+    """
+    if isinstance(o, Decision):
+        # tags are plain strings, so only the launch time needs converting
+        d = o.to_dict()
+        d['launch_time'] = d['launch_time'].isoformat()
+        return d
+    if isinstance(o, dict):
+        return {k: jsonable(v) for k, v in o.items()}
+    if isinstance(o, (list, tuple)):
+        return [jsonable(v) for v in o]
+    if isinstance(o, datetime):
+        return o.isoformat()
+    return o
+
+
+def _default(o):
+    if isinstance(o, Decision):
+        return o.to_dict()
+    if isinstance(o, datetime):
+        return o.isoformat()
+    raise TypeError('{!r} is not JSON serializable'.format(o))
+
+
+class LogWriter(object):
+    """Writes reaperlog entries to a gzipped JSON Lines file object.
+
+    location: Where the log ends up, eg: a path or an s3:// URL
+    on_close: Called with the underlying file object once the gzip stream is finished
+    """
+
+    def __init__(self, fileobj, location, on_close=None):
+        self.location = location
+        self.entries = 0
+        self._fileobj = fileobj
+        self._gz = gzip.GzipFile(fileobj=fileobj, mode='wb')
+        self._on_close = on_close
+
+    def write(self, entry):
+        self._gz.write((json.dumps(entry, default=_default) + '\n').encode('utf-8'))
+        self.entries += 1
+        return entry
+
+    def close(self):
+        if self._gz is None:
+            return
+        self._gz.close()
+        self._gz = None
+        try:
+            if self._on_close:
+                self._on_close(self._fileobj)
+        finally:
+            self._fileobj.close()
+        log.info('Wrote {} reaperlog entries to {}'.format(self.entries, self.location))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FileSink(object):
+    """Writes logs into a local directory."""
+
+    def __init__(self, url):
+        parsed = urlparse(url)
+        self.directory = parsed.path if parsed.scheme == 'file' else url
+
+    def open(self, name):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        path = os.path.join(self.directory, name)
+        return LogWriter(open(path, 'wb'), path)
+
+
+class S3Sink(object):
+    """Uploads logs to S3 under a key prefix once they're complete."""
+
+    def __init__(self, url, client=None):
+        parsed = urlparse(url)
+        self.bucket = parsed.netloc
+        self.prefix = parsed.path.strip('/')
+        self._client = client
+
+    def open(self, name):
+        key = '/'.join(p for p in (self.prefix, name) if p)
+        client = self._client if self._client is not None else clients.get_client('s3', None)
+
+        def _upload(fileobj):
+            fileobj.seek(0)
+            client.upload_fileobj(fileobj, self.bucket, key)
+
+        return LogWriter(tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES),
+                         's3://{}/{}'.format(self.bucket, key), on_close=_upload)
+
+
+def register_sink(scheme, cls):
+    """Use `cls(url)` for sink URLs starting with `scheme://`."""
+    _sinks[scheme] = cls
+
+
+def get_sink(url):
+    """Build the sink for `url`. Plain paths are local directories."""
+    scheme = urlparse(url).scheme or 'file'
+    try:
+        return _sinks[scheme](url)
+    except KeyError:
+        raise ValueError('No reaperlog sink for {}:// URLs'.format(scheme))
+
+
+register_sink('file', FileSink)
+register_sink('s3', S3Sink)
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+"""Slack incoming-webhook delivery for EC2 Reaper.
+
+Large attachment lists are split over several messages, connections come
+from the shared `requests.Session` and throttled or failed posts are
+retried, honouring Slack's `Retry-After` header.
+"""
+
+import json
+import logging
+import time
+from datetime import datetime
+
+from ec2_reaper.clients import get_http_session
+from ec2_reaper.stats import clock
+
+# Slack rejects messages with more than 100 attachments and truncates long
+# ones; stay well clear of both
+MAX_ATTACHMENTS = 20
+MAX_MESSAGE_BYTES = 30000
+
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 1.0
+MAX_BACKOFF = 30.0
+DEFAULT_TIMEOUT = 10.0
+
+log = logging.getLogger()
+
+# patched out by the tests
+_sleep = time.sleep
+
+
+# so that we can send tz-aware datetimes through json
+class DateTimeJSONEncoder(json.JSONEncoder):
+    def default(self, o):
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return json.JSONEncoder.default(self, o)
+
+
+def chunk(attachments, max_attachments=MAX_ATTACHMENTS, max_bytes=MAX_MESSAGE_BYTES):
+    """Split `attachments` into lists small enough to send in one message.
+
+    An attachment bigger than `max_bytes` by itself still gets a chunk of its own.
+    """
+    chunks, current, size = [], [], 0
+    for a in attachments:
+        a_size = len(json.dumps(a, cls=DateTimeJSONEncoder))
+        if current and (len(current) >= max_attachments or size + a_size > max_bytes):
+            chunks.append(current)
+            current, size = [], 0
+        current.append(a)
+        size += a_size
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def post(endpoint, msg, attachments=None, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF,
+         timeout=DEFAULT_TIMEOUT, stats=None):
+    """post - Send a message to a Slack webhook, splitting up long attachment lists
+
+    endpoint: Slack incoming webhook URL
+    msg: Message text. When attachments span several messages, each gets a "(n/total)" suffix
+    attachments: List of Slack attachment dicts. Default: None
+    retries: Retries per message after a 429, a 5xx or a connection error. Default: 3
+    backoff: Seconds to wait before the first retry, doubling each time, unless
+        Slack sends `Retry-After`. Default: 1.0
+    timeout: Seconds to wait for Slack to respond. Default: 10.0
+    stats: A `ec2_reaper.stats.ReapStats` to record posts in. Default: None
+
+    Returns the HTTP status code of the first message which failed, or 200.
+    """
+    chunks = chunk(attachments) if attachments else [[]]
+    status = 200
+    for n, c in enumerate(chunks, 1):
+        text = msg if len(chunks) == 1 else '{} ({}/{})'.format(msg, n, len(chunks))
+        data = json.dumps({'text': text, 'attachments': c}, cls=DateTimeJSONEncoder)
+        code = _post(endpoint, data, retries, backoff, timeout, stats)
+        if code != 200:
+            log.error('Slack notification failed: message {} of {} (HTTP {})'.format(n, len(chunks), code))
+            status = code if status == 200 else status
+    return status
+
+
+def _post(endpoint, data, retries, backoff, timeout, stats):
+    import requests
+
+    session = get_http_session()
+    headers = {'Content-Type': 'application/json'}
+    for attempt in range(retries + 1):
+        start = clock()
+        try:
+            r = session.post(endpoint, headers=headers, data=data, timeout=timeout)
+            code, wait = r.status_code, _retry_after(r)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            log.warning('Slack post failed: {}'.format(e))
+            r, code, wait = None, -1, None
+        if stats is not None:
+            stats.slack_post(clock() - start)
+
+        if code == 200 or not _retryable(code) or attempt == retries:
+            if r is not None and code != 200:
+                log.error('Slack said: (HTTP {}) {}'.format(code, r.text))
+            return code
+
+        wait = wait if wait is not None else min(backoff * 2 ** attempt, MAX_BACKOFF)
+        log.warning('Slack post got HTTP {}, retrying in {}s'.format(code, wait))
+        _sleep(wait)
+
+
+def _retryable(code):
+    return code == -1 or code == 429 or code >= 500
+
+
+def _retry_after(response):
+    try:
+        return min(float(response.headers['Retry-After']), MAX_BACKOFF)
+    except (KeyError, TypeError, ValueError):
+        return None
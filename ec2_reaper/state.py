@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+"""Persistent instance state for incremental sweeps.
+
+`StateStore` remembers, for every instance the reaper has seen, its launch
+time, a fingerprint of the tags the matchers look at and the last decision
+made about it. Instances whose launch time and fingerprint haven't changed
+reuse their last tag decision instead of being evaluated again. Decisions
+which change, and every termination, are written to a history table.
+"""
+
+import calendar
+import json
+import logging
+import threading
+import time
+from collections import namedtuple
+
+# SQLite's default limit on host parameters per statement is 999
+LOOKUP_BATCH_SIZE = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS instances (
+    id TEXT PRIMARY KEY,
+    region TEXT,
+    launch_time REAL,
+    fingerprint TEXT,
+    tag_match INTEGER,
+    age_match INTEGER,
+    reaped INTEGER,
+    first_seen REAL,
+    last_seen REAL,
+    last_changed REAL
+);
+CREATE TABLE IF NOT EXISTS history (
+    id TEXT,
+    region TEXT,
+    at REAL,
+    tag_match INTEGER,
+    age_match INTEGER,
+    reaped INTEGER,
+    dry_run INTEGER,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS history_id ON history (id, at);
+CREATE INDEX IF NOT EXISTS history_at ON history (at);
+"""
+
+InstanceState = namedtuple('InstanceState', ['id', 'region', 'launch_time', 'fingerprint',
+                                             'tag_match', 'age_match', 'reaped',
+                                             'first_seen', 'last_seen', 'last_changed'])
+
+log = logging.getLogger()
+
+
+def epoch(dt):
+    """Seconds since the epoch for a tz-aware datetime."""
+    return calendar.timegm(dt.utctimetuple()) + dt.microsecond / 1e6
+
+
+class StateStore(object):
+    """SQLite-backed instance state.
+
+    path: Database file. Default: ':memory:' (state lasts as long as the object)
+
+    One store can be shared by every worker thread of a run.
+    """
+
+    def __init__(self, path=':memory:'):
+        self.path = path
+        self._lock = threading.Lock()
+        # imported here, so that the entry points only load sqlite3 once a store is opened
+        import sqlite3
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def bind(self, matching_tags):
+        """Tie stored decisions to a tag matcher, forgetting them if it has changed."""
+        policy = json.dumps(matching_tags, sort_keys=True)
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'policy'").fetchone()
+            if row is None or row[0] != policy:
+                if row is not None:
+                    log.info('Tag matcher changed; re-evaluating every instance')
+                self._conn.execute('UPDATE instances SET fingerprint = NULL')
+                self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('policy', ?)", (policy,))
+
+    @staticmethod
+    def fingerprint(matcher, tags):
+        """Fingerprint the values of the tags `matcher` looks at in a `{k: v}` dict."""
+        return json.dumps(matcher.fingerprint(tags))
+
+    def lookup(self, ids):
+        """Return `{id: InstanceState}` for the `ids` the store knows about."""
+        ids = list(ids)
+        found = {}
+        with self._lock:
+            for n in range(0, len(ids), LOOKUP_BATCH_SIZE):
+                batch = ids[n:n + LOOKUP_BATCH_SIZE]
+                rows = self._conn.execute(
+                    'SELECT * FROM instances WHERE id IN ({})'.format(','.join('?' * len(batch))),
+                    batch)
+                found.update((r[0], InstanceState(*r)) for r in rows)
+        return found
+
+    def record(self, region, observed, known, entries, dry_run=False, now=None):
+        """Save a page of decisions.
+
+        observed: List of `(id, launch_time, fingerprint, tag_match, age_match)`,
+            launch_time in epoch seconds
+        known: What `lookup` returned for the page
+        entries: `{id: reaperlog entry}` for the page, for reap status and errors
+        """
+        now = now if now is not None else time.time()
+        upserts, seen, history = [], [], []
+        for id, launch_time, fingerprint, tag_match, age_match in observed:
+            entry = entries.get(id, {})
+            reaped = bool(entry.get('reaped'))
+            prev = known.get(id)
+            # tag_match is kept as an int, so a `PolicySet`'s mask survives
+            decision = (int(tag_match), bool(age_match), reaped)
+            changed = prev is None or \
+                (int(prev.tag_match), bool(prev.age_match), bool(prev.reaped)) != decision
+            if changed or prev.fingerprint != fingerprint or prev.launch_time != launch_time:
+                upserts.append((id, region, launch_time, fingerprint) + decision +
+                               (prev.first_seen if prev else now, now,
+                                now if changed else prev.last_changed))
+            else:
+                seen.append(id)
+            if changed or reaped or 'error' in entry:
+                history.append((id, region, now) + decision + (dry_run, entry.get('error')))
+
+        with self._lock, self._conn:
+            self._conn.executemany('INSERT OR REPLACE INTO instances VALUES (?,?,?,?,?,?,?,?,?,?)',
+                                   upserts)
+            for n in range(0, len(seen), LOOKUP_BATCH_SIZE):
+                batch = seen[n:n + LOOKUP_BATCH_SIZE]
+                self._conn.execute(
+                    'UPDATE instances SET last_seen = ? WHERE id IN ({})'.format(
+                        ','.join('?' * len(batch))), [now] + batch)
+            self._conn.executemany('INSERT INTO history VALUES (?,?,?,?,?,?,?,?)', history)
+
+    def instance(self, id):
+        """The stored `InstanceState` for `id`, or None."""
+        return self.lookup([id]).get(id)
+
+    def history(self, id=None, since=None, reaped=None):
+        """history - Query what the reaper decided and did, oldest first
+
+        id: Only this instance. Default: None (all instances)
+        since: Only events at or after this many epoch seconds. Default: None
+        reaped: If True, only terminations; if False, only everything else. Default: None
+
+        Returns a list of dicts.
+        """
+        where, params = [], []
+        if id is not None:
+            where.append('id = ?')
+            params.append(id)
+        if since is not None:
+            where.append('at >= ?')
+            params.append(since)
+        if reaped is not None:
+            where.append('reaped = ?')
+            params.append(int(bool(reaped)))
+        sql = 'SELECT * FROM history'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY at, rowid'
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            names = [d[0] for d in cursor.description]
+            rows = cursor.fetchall()
+        return [dict(zip(names, r)) for r in rows]
+
+    def prune(self, older_than):
+        """Forget instances not seen in the last `older_than` seconds. Keeps their history."""
+        with self._lock, self._conn:
+            return self._conn.execute('DELETE FROM instances WHERE last_seen < ?',
+                                      (time.time() - older_than,)).rowcount
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+"""Timing and API call metrics for EC2 Reaper runs."""
+
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_NAMESPACE = 'EC2Reaper'
+
+# error codes AWS uses when it's throttling us
+THROTTLE_CODES = ('Throttling', 'ThrottlingException', 'RequestLimitExceeded',
+                  'TooManyRequestsException', 'RequestThrottled')
+
+clock = time.perf_counter if hasattr(time, 'perf_counter') else time.time
+
+
+def is_throttle(error):
+    """True if `error` is a botocore ClientError caused by throttling."""
+    response = getattr(error, 'response', None) or {}
+    return response.get('Error', {}).get('Code') in THROTTLE_CODES
+
+
+class RegionStats(object):
+    """Counters for one region. Only ever updated by the thread scanning it."""
+
+    def __init__(self, region, account=None):
+        self.region = region
+        self.account = account
+        self.scan_seconds = 0.0
+        self.describe_seconds = 0.0
+        self.evaluate_seconds = 0.0
+        self.terminate_seconds = 0.0
+        self.pages = 0
+        self.instances = 0
+        self.unchanged = 0
+        self.terminate_calls = 0
+        self.api_calls = 0
+        self.retries = 0
+        self.throttles = 0
+        # seconds spent waiting on the client-side limiters, and their state after the scan
+        self.wait_seconds = 0.0
+        self.limits = {}
+
+    def api_call(self, seconds, response=None):
+        """Record a call which took `seconds`, returning `seconds`.
+
+        response: The call's response, to pick up botocore's retry count
+        """
+        self.api_calls += 1
+        if response:
+            self.retries += response.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+        return seconds
+
+    def api_error(self, error):
+        self.api_calls += 1
+        if is_throttle(error):
+            self.throttles += 1
+
+    def as_dict(self):
+        d = dict(vars(self))
+        d['limits'] = dict((k, dict(v)) for k, v in self.limits.items())
+        return d
+
+
+class ReapStats(object):
+    """Metrics for a whole run, broken down by region.
+
+    Pass one to `reap()`/`reap_iter()` as `stats` and read it afterwards.
+    """
+
+    def __init__(self):
+        self.regions = OrderedDict()
+        self.account_errors = OrderedDict()
+        self.slack_posts = 0
+        self.slack_seconds = 0.0
+        self.started = time.time()
+        self.total_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def region(self, region, account=None):
+        """Stats for `region`, keyed 'account/region' when there's an account."""
+        key = '{}/{}'.format(account, region) if account else region
+        with self._lock:
+            if key not in self.regions:
+                self.regions[key] = RegionStats(region, account)
+            return self.regions[key]
+
+    def account_error(self, account, error):
+        with self._lock:
+            self.account_errors[account] = str(error)
+
+    def slack_post(self, seconds):
+        with self._lock:
+            self.slack_posts += 1
+            self.slack_seconds += seconds
+
+    def finish(self):
+        self.total_seconds = time.time() - self.started
+
+    def merge(self, d):
+        """Fold in another run's `as_dict()`, eg: a fan-out worker's."""
+        for r in d.get('regions', []):
+            rstats = self.region(r['region'], r.get('account'))
+            with self._lock:
+                for k, v in r.items():
+                    if k == 'limits':
+                        rstats.limits = dict(v)
+                    elif k not in ('region', 'account'):
+                        setattr(rstats, k, getattr(rstats, k) + v)
+        with self._lock:
+            self.account_errors.update(d.get('account_errors', {}))
+            slack = d.get('slack', {})
+            self.slack_posts += slack.get('posts', 0)
+            self.slack_seconds += slack.get('seconds', 0.0)
+
+    def totals(self):
+        """Sum the per-region counters."""
+        totals = RegionStats(None).as_dict()
+        del totals['region'], totals['account'], totals['limits']
+        for r in self.regions.values():
+            for k, v in r.as_dict().items():
+                if k in totals:
+                    totals[k] += v
+        return totals
+
+    def as_dict(self):
+        return {'total_seconds': self.total_seconds,
+                'slack': {'posts': self.slack_posts, 'seconds': self.slack_seconds},
+                'totals': self.totals(),
+                'account_errors': dict(self.account_errors),
+                'regions': [r.as_dict() for r in self.regions.values()]}
+
+    def to_emf(self, namespace=DEFAULT_NAMESPACE, timestamp=None):
+        """Render as CloudWatch Embedded Metric Format documents.
+
+        Returns one document for the run as a whole and one per region. Each
+        should be logged as a single JSON line; CloudWatch extracts the
+        metrics without any extra API calls.
+        """
+        timestamp = int((timestamp if timestamp else time.time()) * 1000)
+
+        def _doc(dimensions, metrics, **values):
+            doc = {'_aws': {'Timestamp': timestamp, 'CloudWatchMetrics': [{
+                'Namespace': namespace,
+                'Dimensions': [dimensions],
+                'Metrics': [{'Name': name, 'Unit': unit} for name, unit, _ in metrics],
+            }]}}
+            doc.update(values)
+            doc.update((name, value) for name, _, value in metrics)
+            return doc
+
+        totals = self.totals()
+        docs = [_doc([], [
+            ('TotalSeconds', 'Seconds', self.total_seconds),
+            ('Instances', 'Count', totals['instances']),
+            ('ApiCalls', 'Count', totals['api_calls']),
+            ('Retries', 'Count', totals['retries']),
+            ('Throttles', 'Count', totals['throttles']),
+            ('WaitSeconds', 'Seconds', totals['wait_seconds']),
+            ('SlackPosts', 'Count', self.slack_posts),
+            ('SlackSeconds', 'Seconds', self.slack_seconds),
+        ])]
+        for r in self.regions.values():
+            dims, values = (['Account', 'Region'], {'Account': r.account}) if r.account else (['Region'], {})
+            docs.append(_doc(dims, [
+                ('ScanSeconds', 'Seconds', r.scan_seconds),
+                ('DescribeSeconds', 'Seconds', r.describe_seconds),
+                ('EvaluateSeconds', 'Seconds', r.evaluate_seconds),
+                ('TerminateSeconds', 'Seconds', r.terminate_seconds),
+                ('Pages', 'Count', r.pages),
+                ('Instances', 'Count', r.instances),
+                ('ApiCalls', 'Count', r.api_calls),
+                ('Retries', 'Count', r.retries),
+                ('Throttles', 'Count', r.throttles),
+                ('WaitSeconds', 'Seconds', r.wait_seconds),
+            ], Region=r.region, **values))
+        return docs
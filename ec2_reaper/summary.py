@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+"""Single-pass summaries of reaperlog entries."""
+
+
+class ReapSummary(object):
+    """Tallies reaperlog entries as they stream out of `reap_iter`.
+
+    keep_matches: Hold on to reaped and too-young entries (eg: for notifications)
+    keep_log: Hold on to every entry
+
+    Counts are always kept, so with both flags off memory use stays flat no
+    matter how many entries are added.
+    """
+
+    def __init__(self, keep_matches=False, keep_log=False):
+        self.instances = 0
+        self.tag_matches = 0
+        self.reaped_count = 0
+        self.too_young_count = 0
+        self.errors = 0
+        # reaped counts by policy name, when `reap` is given policies
+        self.reaped_by_policy = {}
+        self.reaped = [] if keep_matches else None
+        self.too_young = [] if keep_matches else None
+        self.log = [] if keep_log else None
+
+    def add(self, entry):
+        self.instances += 1
+        if entry['tag_match']:
+            self.tag_matches += 1
+        if entry['reaped']:
+            self.reaped_count += 1
+            policy = entry.get('policy')
+            if policy is not None:
+                self.reaped_by_policy[policy] = self.reaped_by_policy.get(policy, 0) + 1
+            if self.reaped is not None:
+                self.reaped.append(entry)
+        elif entry['tag_match'] and not entry['age_match']:
+            self.too_young_count += 1
+            if self.too_young is not None:
+                self.too_young.append(entry)
+        if entry.get('error'):
+            self.errors += 1
+        if self.log is not None:
+            self.log.append(entry)
+        return entry
+
+    def update(self, entries):
+        for entry in entries:
+            self.add(entry)
+        return self
+
+    def merge(self, other):
+        """Fold in another summary, eg: one from a fan-out worker."""
+        self.instances += other.instances
+        self.tag_matches += other.tag_matches
+        self.reaped_count += other.reaped_count
+        self.too_young_count += other.too_young_count
+        self.errors += other.errors
+        for policy, count in other.reaped_by_policy.items():
+            self.reaped_by_policy[policy] = self.reaped_by_policy.get(policy, 0) + count
+        for mine, theirs in ((self.reaped, other.reaped), (self.too_young, other.too_young),
+                             (self.log, other.log)):
+            if mine is not None and theirs is not None:
+                mine.extend(theirs)
+        return self
+
+    def as_dict(self):
+        d = {'reaped': self.reaped_count, 'matches_under_min_age': self.too_young_count,
+             'tag_matches': self.tag_matches, 'instances': self.instances}
+        if self.reaped_by_policy:
+            d['reaped_by_policy'] = dict(self.reaped_by_policy)
+        return d
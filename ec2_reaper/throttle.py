@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+
+"""Client-side rate limiting for EC2 API calls.
+
+EC2 throttles each account per region, with separate token buckets for
+describe calls and for mutating calls like TerminateInstances. The reaper
+mirrors that with an AIMD token bucket per account, region and kind of call:
+the rate creeps up while calls succeed and halves whenever AWS throttles
+one (or botocore had to retry it), so concurrent scans slow down together
+instead of piling into retry storms.
+
+Limiters live at module level, so daemons and warm Lambda containers keep
+what they've learnt between runs. Defaults can be tuned through env vars:
+
+    THROTTLE                      'off' to disable limiting
+    THROTTLE_<KIND>_RATE          starting calls per second, eg: THROTTLE_DESCRIBE_RATE
+    THROTTLE_<KIND>_BURST         calls allowed back to back
+    THROTTLE_<KIND>_MAX_RATE      ceiling for the rate
+"""
+
+import logging
+import os
+import threading
+import time
+
+from ec2_reaper.stats import clock, is_throttle
+
+DESCRIBE = 'describe'
+TERMINATE = 'terminate'
+
+# roughly EC2's own refill rates and bucket sizes
+DEFAULTS = {
+    DESCRIBE: {'rate': 20.0, 'burst': 100.0, 'max_rate': 100.0},
+    TERMINATE: {'rate': 5.0, 'burst': 50.0, 'max_rate': 20.0},
+}
+MIN_RATE = 0.5
+# added to the rate per successful call, and multiplied in on throttling
+INCREASE = 0.5
+DECREASE = 0.5
+
+log = logging.getLogger()
+
+_limiters = {}
+_lock = threading.Lock()
+
+
+def enabled():
+    return os.environ.get('THROTTLE', '').lower() not in ('off', 'false', '0')
+
+
+class Limiter(object):
+    """A token bucket whose refill rate follows AIMD.
+
+    `acquire()` before each call, then report how it went with `success()` or
+    `throttled()`. Thread-safe.
+    """
+
+    def __init__(self, rate, burst, max_rate, min_rate=MIN_RATE):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.max_rate = float(max_rate)
+        self.min_rate = float(min_rate)
+        self.tokens = self.burst
+        self.calls = 0
+        self.throttles = 0
+        self.wait_seconds = 0.0
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, sleeping until one is available. Returns seconds waited."""
+        with self._lock:
+            self._refill()
+            # reserve a token now and sleep off any debt outside the lock
+            self.tokens -= 1
+            self.calls += 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            self.wait_seconds += wait
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def refund(self):
+        """Give back a token taken for a call which wasn't made after all."""
+        with self._lock:
+            self.tokens = min(self.burst, self.tokens + 1)
+            self.calls -= 1
+
+    def success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + INCREASE)
+
+    def throttled(self):
+        with self._lock:
+            self._refill()
+            self.throttles += 1
+            self.rate = max(self.min_rate, self.rate * DECREASE)
+            # back off straight away, not just once the bucket runs dry
+            self.tokens = min(self.tokens, 0.0)
+        log.debug('Throttled; rate cut to {:.1f} calls/sec'.format(self.rate))
+
+    def observe(self, response=None, error=None):
+        """Report a call's outcome from its response or ClientError.
+
+        Calls botocore had to retry count as throttled.
+        """
+        if error is not None:
+            if is_throttle(error):
+                self.throttled()
+        elif response and response.get('ResponseMetadata', {}).get('RetryAttempts'):
+            self.throttled()
+        else:
+            self.success()
+
+    def state(self):
+        with self._lock:
+            self._refill()
+            return {'rate': self.rate, 'tokens': self.tokens, 'calls': self.calls,
+                    'throttles': self.throttles, 'wait_seconds': self.wait_seconds}
+
+    def _refill(self):
+        # callers hold _lock
+        now = clock()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+class _NoLimit(object):
+    """Stands in for a `Limiter` when limiting is off."""
+
+    def acquire(self):
+        return 0.0
+
+    def refund(self):
+        pass
+
+    def success(self):
+        pass
+
+    def throttled(self):
+        pass
+
+    def observe(self, response=None, error=None):
+        pass
+
+    def state(self):
+        return None
+
+
+NO_LIMIT = _NoLimit()
+
+
+def get_limiter(region, kind, account=None):
+    """Return the shared limiter for `kind` calls in `region` of `account`."""
+    if not enabled():
+        return NO_LIMIT
+    key = (account, region, kind)
+    limiter = _limiters.get(key)
+    if limiter is None:
+        with _lock:
+            limiter = _limiters.get(key)
+            if limiter is None:
+                limiter = _limiters[key] = Limiter(**_settings(kind))
+    return limiter
+
+
+def _settings(kind):
+    settings = dict(DEFAULTS.get(kind, DEFAULTS[DESCRIBE]))
+    for name in settings:
+        value = os.environ.get('THROTTLE_{}_{}'.format(kind.upper(), name.upper()))
+        if value:
+            settings[name] = float(value)
+    return settings
+
+
+def reset():
+    """Forget every limiter and what it has learnt."""
+    with _lock:
+        _limiters.clear()
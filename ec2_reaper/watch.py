@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+"""Run sweeps on a loop, for `ec2-reaper --watch`.
+
+One process keeps its AWS clients, region list and compiled tag matcher
+between sweeps. The interval adapts: it halves while matches are waiting to
+get old enough and doubles while sweeps find nothing to reap, within
+bounds. Too-young matches are queued by expiry time and re-checked as soon
+as they're due, without waiting for the next sweep.
+"""
+
+import logging
+import random
+import signal
+import threading
+import time
+
+DEFAULT_INTERVAL = 300
+DEFAULT_MIN_INTERVAL = 30
+DEFAULT_MAX_INTERVAL = 3600
+DEFAULT_JITTER = 0.1
+
+# seconds to wait before re-checking again after a re-check fails
+RECHECK_RETRY = 30
+
+log = logging.getLogger()
+
+
+def next_interval(current, summary, interval=DEFAULT_INTERVAL, min_interval=DEFAULT_MIN_INTERVAL,
+                  max_interval=DEFAULT_MAX_INTERVAL):
+    """Pick the wait before the next sweep from the last sweep's `ReapSummary`."""
+    # the bounds never push the interval the wrong way
+    min_interval, max_interval = min(min_interval, interval), max(max_interval, interval)
+    if summary.too_young_count:
+        return max(min_interval, current / 2.0)
+    if not summary.tag_matches:
+        return min(max_interval, current * 2)
+    return interval
+
+
+def jittered(interval, jitter=DEFAULT_JITTER):
+    """Spread `interval` by +/- `jitter` (a fraction), so that many reapers don't sync up."""
+    return interval * (1 + random.uniform(-jitter, jitter))
+
+
+def handle_signals(stop, signals=(signal.SIGTERM, signal.SIGINT)):
+    """Set the `stop` event on SIGTERM/SIGINT. Only works from the main thread."""
+    def _handler(signum, frame):
+        log.warning('Got signal {}, stopping. A sweep in progress stops part way through'.format(signum))
+        stop.set()
+
+    for s in signals:
+        signal.signal(s, _handler)
+
+
+def watch(sweep, recheck=None, expiries=None, interval=DEFAULT_INTERVAL,
+          min_interval=DEFAULT_MIN_INTERVAL, max_interval=DEFAULT_MAX_INTERVAL,
+          jitter=DEFAULT_JITTER, stop=None, max_sweeps=None):
+    """watch - Sweep until told to stop
+
+    sweep: Called with `stop` to run a sweep. Returns its `ReapSummary`, and
+        should return early once `stop` is set
+    recheck: Called with `stop` whenever something in `expiries` is due. Default: None
+    expiries: An `ec2_reaper.scheduler.ExpiryQueue` which `sweep` fills. Default: None
+    interval: Seconds between sweeps to start with, and after sweeps that reap something. Default: 300
+    min_interval, max_interval: Bounds for the adaptive interval. Default: 30, 3600
+    jitter: Fraction to randomly vary each wait by. Default: 0.1
+    stop: A `threading.Event` which ends the loop when set. Default: a new one
+    max_sweeps: Stop after this many sweeps. Default: None (run forever)
+
+    Returns the number of sweeps run. A sweep which raises is logged and
+    the loop carries on.
+    """
+    stop = stop if stop is not None else threading.Event()
+    current, sweeps = interval, 0
+    while not stop.is_set():
+        try:
+            summary = sweep(stop)
+            current = next_interval(current, summary, interval, min_interval, max_interval)
+        except Exception:
+            log.exception('Sweep failed, trying again in {} seconds'.format(current))
+        sweeps += 1
+        if max_sweeps is not None and sweeps >= max_sweeps:
+            break
+
+        wait = jittered(current, jitter)
+        log.info('Next sweep in {:.0f} seconds'.format(wait))
+        _wait(stop, time.time() + wait, recheck, expiries)
+    return sweeps
+
+
+def _wait(stop, deadline, recheck, expiries):
+    """Sleep until `deadline`, running `recheck` whenever an expiry comes due."""
+    while not stop.is_set():
+        now = time.time()
+        if now >= deadline:
+            return
+        due = expiries.next_due() if recheck is not None and expiries is not None else None
+        if due is not None and due <= now:
+            try:
+                recheck(stop)
+            except Exception:
+                # whatever was due is still queued, so don't spin on it
+                log.exception('Re-check failed, trying again in {} seconds'.format(RECHECK_RETRY))
+                stop.wait(max(0, min(RECHECK_RETRY, deadline - time.time())))
+            continue
+        stop.wait(min(deadline, due) - now if due is not None else deadline - now)
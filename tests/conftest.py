@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+
+"""Shared test fixtures."""
+
+import boto3
+import pytest
+
+
+def launch_instances(count=1, tags=None, region='us-west-2', credentials=None):
+    """Launch `count` instances in one moto reservation, returning their IDs.
+
+    tags: Boto tags as `[{'Key': k, 'Value': v}, ...]`, or a `{k: v}` dict. Default: None
+    credentials: Assumed-role credentials, to launch in another account. Default: None
+    """
+    client = boto3.client('ec2', region_name=region, **(credentials or {}))
+    params = {'ImageId': 'ami-1234abcd', 'MinCount': count, 'MaxCount': count}
+    if isinstance(tags, dict):
+        tags = [{'Key': k, 'Value': v} for k, v in tags.items()]
+    if tags:
+        params['TagSpecifications'] = [{'ResourceType': 'instance', 'Tags': tags}]
+    return [i['InstanceId'] for i in client.run_instances(**params)['Instances']]
+
+
+@pytest.fixture
+def launch():
+    """`launch_instances`, for tests running under moto."""
+    return launch_instances
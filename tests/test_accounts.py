@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `ec2_reaper.accounts`."""
+
+import sys
+
+import pytest
+from moto import mock_ec2, mock_sts
+
+from ec2_reaper import accounts
+from ec2_reaper import ec2_reaper
+from ec2_reaper.stats import ReapStats
+
+if sys.version_info < (3, 0) or (sys.version_info >= (3, 5) and
+                                 sys.version_info < (3, 6)):
+    from mock import patch
+else:
+    from unittest.mock import patch
+
+ROLE_A = 'arn:aws:iam::111111111111:role/reaper'
+ROLE_B = 'arn:aws:iam::222222222222:role/reaper'
+
+
+def test_account_id():
+    assert accounts.account_id(ROLE_A) == '111111111111'
+    with pytest.raises(ValueError):
+        accounts.account_id('reaper')
+
+
+def test_load_accounts(tmpdir):
+    path = tmpdir.join('accounts')
+    path.write('# prod\n{}\n\n{}  # staging\n'.format(ROLE_A, ROLE_B))
+    assert accounts.load_accounts(str(path)) == [ROLE_A, ROLE_B]
+
+
+@mock_sts
+def test_assume_role_caches():
+    accounts.clear_cache()
+    first = accounts.assume_role(ROLE_A)
+    assert accounts.assume_role(ROLE_A) is first
+    assert accounts.assume_role(ROLE_B) is not first
+
+    # refreshed once it's close to expiring
+    accounts._cache[ROLE_A]['expires'] = 0
+    assert accounts.assume_role(ROLE_A) != first
+
+
+@mock_sts
+@mock_ec2
+def test_reap_accounts(launch):
+    accounts.clear_cache()
+    a = launch(2, credentials=accounts.assume_role(ROLE_A))
+    b = launch(credentials=accounts.assume_role(ROLE_B))
+    launch()  # the default account isn't touched
+
+    stats = ReapStats()
+    reaperlog = ec2_reaper.reap(min_age=0, regions=['us-west-2'], roles=[ROLE_A, ROLE_B],
+                                account_workers=2, stats=stats)
+    assert sorted((e['account'], e['id']) for e in reaperlog) == \
+        sorted([('111111111111', i) for i in a] + [('222222222222', i) for i in b])
+    assert sorted(stats.regions) == ['111111111111/us-west-2', '222222222222/us-west-2']
+
+    # the default credentials have no account
+    assert all(e['account'] is None for e in ec2_reaper.reap(min_age=0, regions=['us-west-2']))
+
+
+@mock_ec2
+def test_reap_skips_unassumable_accounts():
+    from botocore.exceptions import ClientError
+
+    def _deny(role):
+        raise ClientError({'Error': {'Code': 'AccessDenied', 'Message': 'nope'}}, 'AssumeRole')
+
+    stats = ReapStats()
+    with patch.object(ec2_reaper, 'assume_role', _deny):
+        assert ec2_reaper.reap(min_age=0, regions=['us-west-2'], roles=[ROLE_A], stats=stats) == []
+    assert list(stats.account_errors) == ['111111111111']
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+"""Smoke tests so the benchmarks in `benchmarks/` don't rot."""
+
+import logging
+
+from benchmarks import bench_matcher, bench_reap, bench_records, bench_simulate
+from ec2_reaper import aws_lambda
+
+
+def test_bench_matcher():
+    results = bench_matcher.run(200)
+    assert [r['policy'] for r in results] == ['short', 'long']
+
+
+def test_bench_reap_stub():
+    tag_matcher, regions = aws_lambda.TAG_MATCHER, aws_lambda.REGIONS
+    logging.disable(logging.CRITICAL)
+    try:
+        results = bench_reap.run(50, 2, repeat=1, page_size=10)
+    finally:
+        logging.disable(logging.NOTSET)
+    assert [r['phase'] for r in results] == ['reap', 'handler', 'matcher']
+    assert results[0]['api_calls']['DescribeInstances'] == 6
+    assert results[0]['matched'] == results[1]['matched']
+    # the handler's settings are put back afterwards
+    assert aws_lambda.TAG_MATCHER == tag_matcher and aws_lambda.REGIONS == regions
+
+
+def test_bench_simulate():
+    results = bench_simulate.run(500)
+    assert results[0]['instances'] == 500
+    assert results[0]['snapshot_bytes'] < results[0]['rows_bytes']
+
+
+def test_bench_records():
+    dicts, decisions = bench_records.run(500)
+    assert (dicts['kind'], decisions['kind']) == ('dict', 'decision')
+    assert decisions['peak_bytes'] < dicts['peak_bytes']
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `ec2_reaper.clients`."""
+
+import os
+import sys
+
+from moto import mock_ec2
+
+from ec2_reaper import clients
+
+if sys.version_info >= (3, 3):
+    from unittest.mock import patch
+else:
+    from mock import patch
+
+
+def _clear_env():
+    for k in ('BOTO_MAX_POOL_CONNECTIONS', 'BOTO_MAX_ATTEMPTS', 'BOTO_RETRY_MODE',
+              'BOTO_CONNECT_TIMEOUT', 'BOTO_READ_TIMEOUT', 'BOTO_TCP_KEEPALIVE',
+              'EC2_ENDPOINT_URL'):
+        os.environ.pop(k, None)
+
+
+@mock_ec2
+def test_client_reuse():
+    clients.reset()
+    client = clients.get_client('ec2', 'us-west-2')
+    assert clients.get_client('ec2', 'us-west-2') is client
+    assert clients.get_client('ec2', 'us-east-1') is not client
+
+    creds = {'aws_access_key_id': 'AKIDEXAMPLE', 'aws_secret_access_key': 'secret',
+             'aws_session_token': 'token'}
+    assumed = clients.get_client('ec2', 'us-west-2', credentials=creds)
+    assert assumed is not client
+    assert clients.get_client('ec2', 'us-west-2', credentials=dict(creds)) is assumed
+
+    clients.reset()
+    assert clients.get_client('ec2', 'us-west-2') is not client
+
+
+def test_client_config_old_botocore():
+    # botocore 1.8, as pinned, has no retry modes or tcp_keepalive
+    from botocore.config import Config
+    _clear_env()
+    os.environ['BOTO_MAX_ATTEMPTS'] = '3'
+    os.environ['BOTO_RETRY_MODE'] = 'standard'
+    os.environ['BOTO_TCP_KEEPALIVE'] = 'true'
+    defaults = dict((k, v) for k, v in Config.OPTION_DEFAULTS.items() if k != 'tcp_keepalive')
+    try:
+        with patch.object(clients, '_has_retry_modes', return_value=False), \
+                patch.object(Config, 'OPTION_DEFAULTS', defaults):
+            config = clients.client_config()
+        assert config.retries == {'max_attempts': 2}
+    finally:
+        _clear_env()
+
+
+def test_client_config():
+    _clear_env()
+    os.environ['BOTO_MAX_POOL_CONNECTIONS'] = '50'
+    os.environ['BOTO_MAX_ATTEMPTS'] = '8'
+    os.environ['BOTO_RETRY_MODE'] = 'adaptive'
+    os.environ['BOTO_READ_TIMEOUT'] = '5'
+    os.environ['BOTO_TCP_KEEPALIVE'] = 'true'
+    os.environ['EC2_ENDPOINT_URL'] = 'http://localhost:5000'
+    try:
+        config = clients.client_config()
+        assert config.max_pool_connections == 50
+        assert config.read_timeout == 5
+        assert config.tcp_keepalive
+        assert config.retries == {'max_attempts': 7, 'mode': 'adaptive'}
+
+        clients.reset()
+        client = clients.get_client('ec2', 'us-west-2')
+        assert client.meta.endpoint_url == 'http://localhost:5000'
+    finally:
+        _clear_env()
+        clients.reset()
+
+
+def test_http_session():
+    session = clients.get_http_session()
+    assert clients.get_http_session() is session
+    clients.reset()
+    assert clients.get_http_session() is not session
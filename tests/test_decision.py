@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `ec2_reaper.decision`."""
+
+import json
+from datetime import datetime
+
+import pytest
+import pytz
+
+from ec2_reaper import sinks
+from ec2_reaper.decision import Decision
+
+LAUNCHED = datetime(2017, 1, 1, 12, tzinfo=pytz.utc)
+
+
+def _decision(**kwargs):
+    return Decision('i-1', True, False, {'Name': 'web'}, 1483272000, 'us-east-1', **kwargs)
+
+
+def test_reads_like_a_reaperlog_dict():
+    d = _decision(policy='ci')
+    assert d['tags'] == [{'Key': 'Name', 'Value': 'web'}]
+    assert d['launch_time'] == LAUNCHED
+    assert (d['id'], d['tag_match'], d['age_match'], d['reaped']) == ('i-1', True, False, False)
+    assert d.get('policy') == 'ci' and d.get('account') is None
+    assert 'error' not in d and d.get('error') is None
+    assert d == {'id': 'i-1', 'tag_match': True, 'age_match': False,
+                 'tags': [{'Key': 'Name', 'Value': 'web'}], 'launch_time': LAUNCHED,
+                 'reaped': False, 'region': 'us-east-1', 'account': None, 'policy': 'ci'}
+    assert Decision('i-2', False, True, {}, 0, 'r')['tags'] is None
+
+
+def test_set_reap_status():
+    d = _decision()
+    d['reaped'] = True
+    d['error'] = 'boom'
+    assert d.reaped and d['error'] == 'boom' and len(d) == 10
+    with pytest.raises(KeyError):
+        d['tags'] = []
+    with pytest.raises(KeyError):
+        d['nope']
+
+
+def test_to_dict_and_json():
+    d = _decision()
+    plain = d.to_dict()
+    assert type(plain) is dict and plain == d
+    assert sinks.jsonable(d)['launch_time'] == '2017-01-01T12:00:00+00:00'
+    assert json.loads(json.dumps(d, default=sinks._default)) == sinks.jsonable(d)
+
+
+def test_slots():
+    with pytest.raises(AttributeError):
+        _decision().extra = 1
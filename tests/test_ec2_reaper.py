@@ -116,6 +116,14 @@ def test_cli_tworegions():
     result = runner.invoke(cli.main, ['-d', '--min-age', '5', '-r', 'us-east-1', '-r', 'us-west-2'])
     assert result.exit_code == 0
 
+@mock_ec2
+def test_cli_workers():
+    runner = CliRunner()
+    _launch_instances()
+    result = runner.invoke(cli.main, ['-d', '--min-age', '0', '-w', '4',
+                                      '-r', 'us-east-1', '-r', 'us-west-2'])
+    assert result.exit_code == 0
+
 @mock_ec2
 def test_nomatch_tag_nomatch_age():
     ### test with mock instances and defaults
@@ -177,3 +185,130 @@ def test_match_tag_match_age():
     assert reaperlog[0]['tag_match']
     assert reaperlog[0]['age_match']
     assert reaperlog[0]['reaped']
+
+@mock_ec2
+def test_concurrent_regions():
+    _launch_instances()
+    regions = ['us-east-1', 'us-west-2', 'eu-west-1']
+    serial = ec2_reaper.reap(regions=regions, min_age=0)
+    concurrent = ec2_reaper.reap(regions=regions, min_age=0, workers=3)
+    assert len(concurrent) == 1
+    assert [i['id'] for i in concurrent] == [i['id'] for i in serial]
+    assert all(i['region'] == 'us-west-2' for i in concurrent)
+
+def test_closing_stops_queued_units():
+    started = []
+
+    def scan(unit):
+        # pages are reaped as they're scanned
+        started.append(unit)
+        yield [unit]
+        started.append(unit)
+        yield [unit]
+
+    pages = ec2_reaper._scan_concurrently(scan, list(range(20)), 2)
+    assert next(pages)
+    pages.close()
+    # at most what fits in the queue, plus a page blocked in each worker
+    assert len(started) <= 2 * 2 + 2 + 1
+
+@mock_ec2
+def test_single_region_string():
+    _launch_instances()
+    reaperlog = ec2_reaper.reap(regions='us-west-2')
+    assert len(reaperlog) == 1
+
+def test_build_filters():
+    running = ec2_reaper.RUNNING_FILTER
+    # missing-tag matchers need every running instance
+    assert ec2_reaper._build_filters(ec2_reaper.DEFAULT_TAG_MATCHER) is None
+    assert ec2_reaper._build_filters([{'tag': 'Name', 'includes': ['a*'], 'excludes': []}]) is None
+
+    assert ec2_reaper._build_filters([{'tag': 'Name', 'includes': ['*'], 'excludes': []}]) == \
+        [[running, {'Name': 'tag-key', 'Values': ['Name']}]]
+    assert ec2_reaper._build_filters([
+        {'tag': 'Name', 'includes': ['a', 'b'], 'excludes': ['b']},
+        {'tag': 'env', 'includes': ['x'], 'excludes': ['x']},
+    ]) == [[running, {'Name': 'tag:Name', 'Values': ['a']}]]
+
+@mock_ec2
+def test_pushdown():
+    _launch_instances(tags=[{'Key':'Name', 'Value': 'somename'}])
+    matcher = [{'tag': 'Name', 'includes': ['somename'], 'excludes': []}]
+    reaperlog = ec2_reaper.reap(tags=matcher, min_age=0, regions=['us-west-2'], pushdown=True)
+    assert len(reaperlog) == 1
+    assert reaperlog[0]['tag_match']
+
+    matcher = [{'tag': 'Name', 'includes': ['othername'], 'excludes': []}]
+    reaperlog = ec2_reaper.reap(tags=matcher, min_age=0, regions=['us-west-2'], pushdown=True)
+    assert len(reaperlog) == 0
+
+@mock_ec2
+def test_terminate():
+    _launch_instances()
+    reaperlog = ec2_reaper.reap(min_age=0, regions=['us-west-2'], debug=False)
+    assert len(reaperlog) == 1
+    assert reaperlog[0]['reaped']
+    assert 'error' not in reaperlog[0]
+
+    instance = boto3.resource('ec2', region_name='us-west-2').Instance(reaperlog[0]['id'])
+    assert instance.state['Name'] in ('shutting-down', 'terminated')
+
+@mock_ec2
+def test_terminate_partial_failure():
+    _launch_instances()
+    client = boto3.client('ec2', region_name='us-west-2')
+    instance_id = client.describe_instances()['Reservations'][0]['Instances'][0]['InstanceId']
+    reapable = [{'id': instance_id, 'reaped': False},
+                {'id': 'i-0123456789abcdef0', 'reaped': False}]
+    ec2_reaper._terminate(client, reapable)
+    assert reapable[0]['reaped']
+    assert not reapable[1]['reaped']
+    assert reapable[1]['error']
+
+@mock_ec2
+def test_terminate_protected_instance():
+    client = boto3.client('ec2', region_name='us-west-2')
+    ids = [i['InstanceId'] for i in client.run_instances(
+        ImageId='ami-1234abcd', MinCount=3, MaxCount=3)['Instances']]
+    client.modify_instance_attribute(InstanceId=ids[0], DisableApiTermination={'Value': True})
+    reapable = [{'id': i, 'reaped': False} for i in ids]
+    ec2_reaper._terminate(client, reapable)
+    # the protected instance fails on its own, without holding up the rest
+    assert [e['reaped'] for e in reapable] == [False, True, True]
+    assert reapable[0]['error'] and 'error' not in reapable[1]
+
+@mock_ec2
+def test_terminate_batches():
+    client = boto3.client('ec2', region_name='us-west-2')
+    reapable = [{'id': 'i-{:017x}'.format(n), 'reaped': False} for n in range(5)]
+    calls = []
+    def terminate_instances(InstanceIds):
+        calls.append(InstanceIds)
+        return {'TerminatingInstances': [{'InstanceId': i} for i in InstanceIds]}
+    client.terminate_instances = terminate_instances
+
+    old_batch_size = ec2_reaper.TERMINATE_BATCH_SIZE
+    ec2_reaper.TERMINATE_BATCH_SIZE = 2
+    try:
+        ec2_reaper._terminate(client, reapable)
+    finally:
+        ec2_reaper.TERMINATE_BATCH_SIZE = old_batch_size
+    assert [len(c) for c in calls] == [2, 2, 1]
+    assert all(e['reaped'] for e in reapable)
+
+@mock_ec2
+def test_reap_iter():
+    _launch_instances()
+    regions = ['us-east-1', 'us-west-2']
+    entries = ec2_reaper.reap_iter(regions=regions, min_age=0)
+    assert not isinstance(entries, list)
+    entries = list(entries)
+    assert len(entries) == 1
+    assert entries == ec2_reaper.reap(regions=regions, min_age=0)
+
+    # bailing out early shouldn't leave workers hanging
+    entries = ec2_reaper.reap_iter(regions=regions + ['eu-west-1', 'ap-southeast-2'],
+                                   min_age=0, workers=2)
+    assert next(entries)['region'] == 'us-west-2'
+    entries.close()
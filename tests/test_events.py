@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `ec2_reaper.events`."""
+
+from ec2_reaper import events
+
+
+def _cloudtrail(name, region='us-west-2', **detail):
+    detail.update({'eventName': name, 'awsRegion': region})
+    return {'source': 'aws.ec2', 'detail-type': events.CLOUDTRAIL_CALL, 'region': region,
+            'detail': detail}
+
+
+def test_state_change():
+    event = {'source': 'aws.ec2', 'detail-type': events.STATE_CHANGE, 'region': 'us-east-1',
+             'detail': {'instance-id': 'i-11111111', 'state': 'running'}}
+    assert events.instance_targets(event) == {'us-east-1': ['i-11111111']}
+
+    event['detail']['state'] = 'shutting-down'
+    assert events.instance_targets(event) == {}
+
+
+def test_cloudtrail():
+    run = _cloudtrail('RunInstances', responseElements={'instancesSet': {'items': [
+        {'instanceId': 'i-22222222'}, {'instanceId': 'i-11111111'}]}})
+    assert events.instance_targets(run) == {'us-west-2': ['i-11111111', 'i-22222222']}
+
+    tags = _cloudtrail('CreateTags', requestParameters={'resourcesSet': {'items': [
+        {'resourceId': 'i-11111111'}, {'resourceId': 'vol-11111111'}]}})
+    assert events.instance_targets(tags) == {'us-west-2': ['i-11111111']}
+
+    tags = _cloudtrail('DeleteTags', errorCode='UnauthorizedOperation',
+                       requestParameters={'resourcesSet': {'items': [{'resourceId': 'i-11111111'}]}})
+    assert events.instance_targets(tags) == {}
+
+
+def test_other_events():
+    assert events.instance_targets({}) is None
+    assert events.instance_targets({'source': 'aws.events', 'detail-type': 'Scheduled Event'}) is None
+    assert events.instance_targets(_cloudtrail('StopInstances')) is None
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `ec2_reaper.fanout` and the Lambda handler's orchestrator mode."""
+
+import gzip
+import json
+import sys
+
+import pytest
+from moto import mock_ec2
+
+from ec2_reaper import aws_lambda
+from ec2_reaper import fanout
+from ec2_reaper.decision import Decision
+from ec2_reaper.summary import ReapSummary
+
+if sys.version_info >= (3, 3):
+    from unittest.mock import patch
+else:
+    from mock import patch
+
+ROLES = ['arn:aws:iam::111111111111:role/reaper', 'arn:aws:iam::222222222222:role/reaper']
+
+
+def test_shards():
+    assert fanout.shards(['r1', 'r2']) == [{'regions': ['r1'], 'roles': None},
+                                           {'regions': ['r2'], 'roles': None}]
+    assert fanout.shards(['r1'], ROLES) == [{'regions': ['r1'], 'roles': ROLES}]
+    assert len(fanout.shards(['r1', 'r2'], ROLES, by='account')) == 4
+    assert fanout.shards(None, ROLES, by='account') == [{'regions': None, 'roles': [r]} for r in ROLES]
+    with pytest.raises(ValueError):
+        fanout.shards(None)
+    with pytest.raises(ValueError):
+        fanout.shards(['r1'], by='az')
+
+
+def test_worker_body_round_trip():
+    summary = ReapSummary(keep_matches=True, keep_log=True).update([
+        Decision('i-1', True, True, {}, 1483272000, 'r1', reaped=True, policy='untagged'),
+        Decision('i-2', True, False, {'Name': ''}, 1483272000, 'r1'),
+        Decision('i-3', False, True, {'Name': 'web'}, 1483272000, 'r1'),
+    ])
+    body = fanout.worker_body(summary)
+    # the full log never goes in a response
+    assert 'log' not in body
+    merged = ReapSummary(keep_matches=True)
+    merged.merge(fanout.worker_summary(body))
+    merged.merge(fanout.worker_summary(fanout.worker_body(summary)))
+    assert merged.as_dict() == {'reaped': 2, 'matches_under_min_age': 2, 'tag_matches': 4,
+                                'instances': 6, 'reaped_by_policy': {'untagged': 2}}
+    assert [e.id for e in merged.reaped] == ['i-1', 'i-1']
+    assert merged.too_young[0] == summary.too_young[0]
+
+
+def test_dispatch_sends_every_shard_at_once():
+    import threading
+    barrier = threading.Barrier(3, timeout=5)
+
+    class _Invoker(object):
+        def invoke(self, event):
+            # only returns once all three workers are in flight
+            barrier.wait()
+            return {'statusCode': 200, 'body': event['shard']}
+
+    results = fanout.dispatch(_Invoker(), fanout.shards(['r1', 'r2', 'r3']))
+    assert [(body, error) for _, body, error in results] == \
+        [({'regions': [r], 'roles': None}, None) for r in ('r1', 'r2', 'r3')]
+
+
+@mock_ec2
+@patch.object(aws_lambda, '_notify')
+def test_orchestrator(mock_notify, tmpdir, launch):
+    ids = launch(region='us-east-1') + launch(2)
+    with patch.object(aws_lambda, 'REGIONS', ['us-east-1', 'us-west-2']), \
+            patch.object(aws_lambda, 'LOG_SINK', str(tmpdir)), \
+            patch.object(aws_lambda, 'FANOUT', 'region'), \
+            patch.object(aws_lambda, 'FANOUT_INVOKER', 'local'), \
+            patch.object(aws_lambda, 'MIN_AGE', 0), \
+            patch.object(aws_lambda, 'DEBUG', True):
+        r = aws_lambda.handler({}, {})
+
+    body = r['body']
+    assert (body['mode'], body['shards'], body['failed_shards']) == ('fanout', 2, [])
+    assert body['reaped'] == 3 and body['instances'] == 3
+    # each worker's log went to the sink, and only its location came back
+    assert 'log' not in body
+    logged = []
+    for location in body['log_locations']:
+        with gzip.open(location, 'rt') as f:
+            logged.extend(json.loads(line)['id'] for line in f)
+    assert len(body['log_locations']) == 2 and sorted(logged) == sorted(ids)
+    assert sorted(s['region'] for s in body['stats']['regions']) == ['us-east-1', 'us-west-2']
+    # one report for every shard
+    mock_notify.assert_called_once()
+    assert sorted(a['title'] for a in mock_notify.call_args[0][1]) == sorted(ids)
+
+
+@mock_ec2
+@patch.object(aws_lambda, '_notify')
+def test_failed_shard(mock_notify, launch):
+    launch()
+
+    def _handler(event, context):
+        if event['shard']['regions'] == ['us-east-1']:
+            raise RuntimeError('worker died')
+        return aws_lambda.handler(event, context)
+
+    with patch.object(aws_lambda, 'REGIONS', ['us-east-1', 'us-west-2']), \
+            patch.object(aws_lambda, 'MIN_AGE', 0), \
+            patch.object(fanout, '_invokers', {'lambda': lambda: fanout.LocalInvoker(_handler)}):
+        r = aws_lambda.handler(fanout.FANOUT_EVENT, {})
+
+    assert r['body']['reaped'] == 1
+    assert [f['shard']['regions'] for f in r['body']['failed_shards']] == [['us-east-1']]
+    assert 'worker died' in r['body']['failed_shards'][0]['error']
+
+
+def test_lambda_invoker():
+    import io
+    import json
+
+    class _Client(object):
+        def __init__(self, payload, error=None):
+            self.payload, self.error, self.calls = payload, error, []
+
+        def invoke(self, **kwargs):
+            self.calls.append(kwargs)
+            r = {'StatusCode': 200, 'Payload': io.BytesIO(json.dumps(self.payload).encode('utf-8'))}
+            if self.error:
+                r['FunctionError'] = self.error
+            return r
+
+    client = _Client({'statusCode': 200, 'body': {'instances': 0}})
+    invoker = fanout.LambdaInvoker('reaper', client=client)
+    assert invoker.invoke(fanout.worker_event({'regions': ['r1']}))['body'] == {'instances': 0}
+    assert client.calls[0]['FunctionName'] == 'reaper'
+    assert json.loads(client.calls[0]['Payload'].decode('utf-8'))['action'] == 'worker'
+
+    invoker = fanout.LambdaInvoker('reaper', client=_Client({'errorMessage': 'timed out'}, 'Unhandled'))
+    with pytest.raises(fanout.InvokeError):
+        invoker.invoke(fanout.worker_event({'regions': ['r1']}))
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+"""Import-time regression tests.
+
+See `benchmarks/bench_import.py` for the timing side of things.
+"""
+
+import subprocess
+import sys
+
+import pytest
+
+import ec2_reaper
+
+HEAVY = ('boto3', 'botocore', 'requests')
+
+
+def _imported_after(code):
+    out = subprocess.check_output([sys.executable, '-c', code + '\nimport sys\nprint(" ".join(sys.modules))'])
+    return set(out.decode('utf-8').split())
+
+
+@pytest.mark.parametrize('module', ['ec2_reaper', 'ec2_reaper.matcher', 'ec2_reaper.cli',
+                                    'ec2_reaper.aws_lambda'])
+def test_entry_points_stay_light(module):
+    modules = _imported_after('import {}'.format(module))
+    assert not [m for m in modules if m.split('.')[0] in HEAVY]
+
+
+def test_cli_help_stays_light():
+    modules = _imported_after('from click.testing import CliRunner\n'
+                              'from ec2_reaper import cli\n'
+                              'assert CliRunner().invoke(cli.main, ["--help"]).exit_code == 0')
+    assert not [m for m in modules if m.split('.')[0] in HEAVY]
+
+
+def test_lazy_attributes():
+    from ec2_reaper import ec2_reaper as engine
+    assert ec2_reaper.reap is engine.reap
+    assert ec2_reaper.DEFAULT_MIN_AGE == engine.DEFAULT_MIN_AGE
+    assert ec2_reaper.aws_lambda.handler
+    assert 'reap_iter' in dir(ec2_reaper)
+    with pytest.raises(AttributeError):
+        ec2_reaper.not_a_thing
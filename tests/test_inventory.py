@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `ec2_reaper.inventory` and the export/simulate commands."""
+
+import json
+
+import pytest
+from click.testing import CliRunner
+from moto import mock_ec2
+
+from ec2_reaper import cli
+from ec2_reaper import inventory
+from ec2_reaper.summary import ReapSummary
+
+NOW = 1500000000.0
+MATCHERS = [{'tag': 'Name', 'includes': [], 'excludes': ['*']},
+            {'tag': 'reapme', 'includes': ['*'], 'excludes': []}]
+
+
+def _record(id, age, tags, region='us-east-1'):
+    return {'id': id, 'region': region, 'account': None, 'launch_time': NOW - age, 'tags': tags}
+
+
+RECORDS = [
+    _record('i-old-unnamed', 3600, {}),
+    _record('i-young-unnamed', 60, {'env': 'dev'}),
+    _record('i-old-named', 3600, {'Name': 'web'}),
+    _record('i-young-named', 60, {'Name': 'web'}),
+    _record('i-old-reapme', 3600, {'Name': 'ci', 'reapme': 'yes'}, region='us-west-2'),
+]
+
+
+@pytest.mark.parametrize('block_size', [1, 2, 100])
+def test_simulate(block_size):
+    entries = list(inventory.simulate(RECORDS, MATCHERS, min_age=300, now=NOW,
+                                      block_size=block_size))
+    by_id = dict((e['id'], e) for e in entries)
+    # instances matching on neither tags nor age are left out, as with reap
+    assert sorted(by_id) == ['i-old-named', 'i-old-reapme', 'i-old-unnamed', 'i-young-unnamed']
+    assert [e['id'] for e in entries if e['reaped']] == ['i-old-unnamed', 'i-old-reapme']
+    assert by_id['i-young-unnamed']['tag_match'] and not by_id['i-young-unnamed']['age_match']
+    assert by_id['i-old-named']['age_match'] and not by_id['i-old-named']['tag_match']
+
+    summary = ReapSummary().update(entries)
+    assert (summary.reaped_count, summary.too_young_count) == (2, 1)
+
+
+def test_snapshot_roundtrip(tmpdir):
+    for name in ('inventory.jsonl', 'inventory.jsonl.gz'):
+        path = str(tmpdir.join(name))
+        assert inventory.export(path, records=iter(RECORDS), now=NOW, block_size=2) == len(RECORDS)
+        header, records = inventory.load(path)
+        assert header['exported_at'] == NOW
+        assert list(records) == RECORDS
+
+
+def test_snapshot_blocks(tmpdir):
+    path = str(tmpdir.join('inventory.jsonl'))
+    inventory.export(path, records=RECORDS, now=NOW, block_size=3)
+    with inventory.Snapshot(path) as snapshot:
+        blocks = list(snapshot.blocks())
+        assert [b['id'] for b in blocks] == [[r['id'] for r in RECORDS[:3]],
+                                             [r['id'] for r in RECORDS[3:]]]
+        # each distinct tag set is stored once
+        assert snapshot.tagsets == [{}, {'env': 'dev'}, {'Name': 'web'},
+                                    {'Name': 'ci', 'reapme': 'yes'}]
+        assert blocks[1]['tagset'] == [2, 3]
+        assert snapshot.instances == len(RECORDS)
+
+    with inventory.Snapshot(path) as snapshot:
+        entries = list(inventory.simulate(snapshot, MATCHERS, min_age=300, now=NOW))
+    assert entries == list(inventory.simulate(RECORDS, MATCHERS, min_age=300, now=NOW))
+
+
+def test_load_rejects_other_files(tmpdir):
+    path = tmpdir.join('log.jsonl')
+    path.write('{"id": "i-1"}\n')
+    with pytest.raises(ValueError):
+        inventory.load(str(path))
+    path.write('{"format": "ec2-reaper-inventory", "version": 99}\n')
+    with pytest.raises(ValueError):
+        inventory.load(str(path))
+
+
+@mock_ec2
+def test_export(tmpdir, launch):
+    unnamed, = launch()
+    named, = launch(tags={'Name': 'web'})
+    path = str(tmpdir.join('inventory.jsonl.gz'))
+    assert inventory.export(path, regions=['us-west-2']) == 2
+
+    _, records = inventory.load(path)
+    by_id = dict((r['id'], r) for r in records)
+    assert by_id[named]['tags'] == {'Name': 'web'}
+    assert by_id[unnamed]['tags'] == {}
+    assert by_id[named]['region'] == 'us-west-2'
+    assert isinstance(by_id[named]['launch_time'], float)
+
+
+@mock_ec2
+def test_cli_export_and_simulate(tmpdir, launch):
+    launch()
+    launch(tags={'Name': 'web'})
+    path = str(tmpdir.join('inventory.jsonl'))
+    runner = CliRunner()
+
+    result = runner.invoke(cli.main, ['export', '-r', 'us-west-2', path])
+    assert result.exit_code == 0, result.output
+
+    # judged as of an hour after the snapshot, without touching AWS
+    as_of = inventory.load(path)[0]['exported_at'] + 3600
+    result = runner.invoke(cli.main, ['simulate', '--as-of', str(as_of), path,
+                                      json.dumps(MATCHERS)])
+    assert result.exit_code == 0, result.output
+    report = json.loads(result.output.strip().splitlines()[-1])
+    assert report['snapshot_instances'] == 2
+    assert report['summary']['reaped'] == 1
+    assert report['reaped_by_region'] == {'us-west-2': 1}
+
+    # brand new instances are too young at the snapshot's own time
+    result = runner.invoke(cli.main, ['simulate', path])
+    report = json.loads(result.output.strip().splitlines()[-1])
+    assert report['summary']['reaped'] == 0
+    assert report['summary']['matches_under_min_age'] == 1
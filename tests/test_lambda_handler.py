@@ -3,9 +3,11 @@ import json
 import sys
 from datetime import datetime, timedelta
 import os
+import time
 
 from ec2_reaper import aws_lambda
 from ec2_reaper import LOCAL_TZ
+from moto import mock_ec2
 
 logging.basicConfig(level=logging.DEBUG)
 logging.getLogger('botocore').setLevel(logging.INFO)
@@ -26,7 +28,7 @@ elif sys.version_info >= (3, 4):
 
 # when no results, handler should have called reap, *not* called (slack) notify,
 # and should have returned a happy response json obj,
-@patch.object(aws_lambda, 'reap')
+@patch.object(aws_lambda, 'reap_iter')
 @patch.object(aws_lambda, '_notify')
 def test_reap_no_results(mock_notify, mock_reap):
     mock_reap.return_value = []
@@ -41,7 +43,7 @@ def test_reap_no_results(mock_notify, mock_reap):
 # with pos and neg results, handler should have called reap,
 # called (slack) notify, and should have returned a happy response json obj with
 # a body which contains all found instances and N reaped and N not reaped
-@patch.object(aws_lambda, 'reap')
+@patch.object(aws_lambda, 'reap_iter')
 @patch.object(aws_lambda, '_notify')
 def test_reap_2neg_1pos(mock_notify, mock_reap):
     match_time = datetime.now() - timedelta(seconds=500)
@@ -87,3 +89,103 @@ def test_debug_envvar():
     os.environ['DEBUG'] = 'false'
     reload(al)
     assert al.DEBUG == False
+
+# reaped and too-young reports are sent concurrently and both land
+@patch.object(aws_lambda, '_notify')
+def test_notify_all(mock_notify):
+    mock_notify.return_value = 200
+    codes = aws_lambda._notify_all([('one', []), ('two', [{'title': 'i-1'}])])
+    assert codes == [200, 200]
+    assert sorted(c[0][0] for c in mock_notify.call_args_list) == ['one', 'two']
+
+# summary mode leaves the log out of the response and spills it to the sink instead
+@patch.object(aws_lambda, 'reap_iter')
+@patch.object(aws_lambda, '_notify')
+def test_summary_response_with_sink(mock_notify, mock_reap, tmpdir):
+    import gzip
+    mock_reap.return_value = [
+        {'id': 'i-11111111', 'tag_match': True, 'age_match': True, 'tags': [],
+         'launch_time': datetime.now() - timedelta(seconds=500), 'reaped': True,
+         'region': 'us-east-1'},
+    ]
+    with patch.object(aws_lambda, 'RESPONSE_MODE', 'summary'), \
+            patch.object(aws_lambda, 'LOG_SINK', str(tmpdir)):
+        r = aws_lambda.handler({}, {})
+
+    assert r['statusCode'] == 200
+    assert 'log' not in r['body']
+    assert r['body']['reaped'] == 1
+    with gzip.open(r['body']['log_location'], 'rb') as f:
+        assert [json.loads(line.decode('utf-8'))['id'] for line in f] == ['i-11111111']
+
+# an EC2 event only checks the instances it names
+@mock_ec2
+@patch.object(aws_lambda, '_notify')
+def test_event_mode(mock_notify):
+    import boto3
+    client = boto3.client('ec2', region_name='us-west-2')
+    ids = [i['InstanceId'] for i in client.run_instances(
+        ImageId='ami-1234abcd', MinCount=2, MaxCount=2)['Instances']]
+    event = {'source': 'aws.ec2', 'detail-type': 'EC2 Instance State-change Notification',
+             'region': 'us-west-2', 'detail': {'instance-id': ids[0], 'state': 'running'}}
+
+    with patch.object(aws_lambda, 'REGIONS', []), patch.object(aws_lambda, 'DEBUG', True):
+        r = aws_lambda.handler(event, {})
+    assert r['body']['mode'] == 'event'
+    assert [e['id'] for e in r['body']['log']] == [ids[0]]
+    assert r['body']['matches_under_min_age'] == 1
+
+    # outside of REGIONS, nothing is checked
+    with patch.object(aws_lambda, 'REGIONS', ['us-east-1']):
+        r = aws_lambda.handler(event, {})
+    assert r['body']['log'] == []
+
+# expiry times longer than a day don't wrap around
+def test_get_expires():
+    launched = datetime.now(LOCAL_TZ)
+    expires = aws_lambda._get_expires(launched, min_age=2 * 86400)
+    assert 2 * 86400 - 5 < expires <= 2 * 86400
+
+# sweeps queue too-young matches; recheck events only look at what's due
+@mock_ec2
+@patch.object(aws_lambda, '_notify')
+def test_recheck_mode(mock_notify, tmpdir):
+    import boto3
+    client = boto3.client('ec2', region_name='us-west-2')
+    client.run_instances(ImageId='ami-1234abcd', MinCount=1, MaxCount=1)
+
+    with patch.object(aws_lambda, 'REGIONS', ['us-west-2']), \
+            patch.object(aws_lambda, 'MIN_AGE', 3600), \
+            patch.object(aws_lambda, 'EXPIRY_DB', str(tmpdir.join('expiries.db'))):
+        r = aws_lambda.handler({}, {})
+        assert r['body']['mode'] == 'sweep'
+        assert r['body']['matches_under_min_age'] == 1
+        next_expiry = r['body']['next_expiry']
+        assert next_expiry > time.time() + 3500
+
+        r = aws_lambda.handler({'action': 'recheck'}, {})
+        assert r['body']['mode'] == 'recheck'
+        assert r['body']['log'] == []
+        assert r['body']['next_expiry'] == next_expiry
+
+# POLICIES replaces TAG_MATCHER and MIN_AGE, and reports which policy reaped what
+@mock_ec2
+@patch.object(aws_lambda, '_notify')
+def test_policies(mock_notify):
+    import boto3
+    from ec2_reaper.policy import load_policies
+    client = boto3.client('ec2', region_name='us-west-2')
+    client.run_instances(ImageId='ami-1234abcd', MinCount=2, MaxCount=2)
+    policies = load_policies([
+        {'name': 'untagged', 'tags': [{'tag': 'Name', 'includes': [], 'excludes': ['*']}],
+         'min_age': 0}])
+
+    with patch.object(aws_lambda, 'REGIONS', ['us-west-2']), \
+            patch.object(aws_lambda, 'POLICIES', policies), \
+            patch.object(aws_lambda, 'MIN_AGE', 3600):
+        r = aws_lambda.handler({}, {})
+    assert r['body']['reaped'] == 2
+    assert r['body']['reaped_by_policy'] == {'untagged': 2}
+    assert set(e['policy'] for e in r['body']['log']) == set(['untagged'])
+    fields = mock_notify.call_args[0][1][0]['fields']
+    assert {'title': 'Policy', 'value': 'untagged', 'short': True} in fields
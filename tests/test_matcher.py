@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `ec2_reaper.matcher`."""
+
+import itertools
+import random
+
+from ec2_reaper import ec2_reaper
+from ec2_reaper.matcher import TagMatcher, CACHE_MIN_MATCHERS
+
+
+def _reference_check_tags(instance_tags, matching_tags):
+    """The original list-scanning `_check_tags`, kept to pin down semantics."""
+    instance_tags = instance_tags if instance_tags else []
+    for mt in matching_tags:
+        instance_tag_keys = [i['Key'] for i in instance_tags]
+        if mt.get('excludes') == [u'*'] and mt.get('tag') not in instance_tag_keys:
+            return True
+        for it in instance_tags:
+            if it.get('Key') != mt.get('tag'):
+                continue
+            if mt.get('includes') == [u'*'] and it.get('Value'):
+                return True
+            if it.get('Value') in mt.get('includes') and it.get('Value') not in mt.get('excludes'):
+                return True
+    return False
+
+
+def _tags(**kwargs):
+    return [{'Key': k, 'Value': v} for k, v in kwargs.items()]
+
+
+def test_documented_semantics():
+    # the default matcher reaps anything without a Name tag
+    m = TagMatcher(ec2_reaper.DEFAULT_TAG_MATCHER)
+    assert m(None)
+    assert m([])
+    assert m(_tags(env='ci'))
+    assert not m(_tags(Name='somename'))
+
+    m = TagMatcher([{'tag': 'Name', 'includes': ['cirunner'], 'excludes': []}])
+    assert m(_tags(Name='cirunner'))
+    assert not m(_tags(Name='other'))
+    assert not m([])
+
+    # ['*'] includes any non-empty value
+    m = TagMatcher([{'tag': 'reapme', 'includes': ['*'], 'excludes': []}])
+    assert m(_tags(reapme='yes'))
+    assert not m(_tags(reapme=''))
+
+    # excludes override includes
+    m = TagMatcher([{'tag': 'Name', 'includes': ['a', 'b'], 'excludes': ['b']}])
+    assert m(_tags(Name='a'))
+    assert not m(_tags(Name='b'))
+
+
+def test_parity_with_reference():
+    rnd = random.Random(1234)
+    keys = ['Name', 'env', 'owner']
+    values = ['', 'a', 'b', '*']
+    value_lists = [[], ['*'], ['a'], ['a', 'b'], ['b', '*']]
+
+    matchers = [{'tag': k, 'includes': i, 'excludes': e}
+                for k, i, e in itertools.product(keys, value_lists, value_lists)]
+    for _ in range(500):
+        matching_tags = rnd.sample(matchers, rnd.randint(1, 3))
+        m = TagMatcher(matching_tags)
+        # repeating matchers doesn't change the outcome, but does turn the cache on
+        cached = TagMatcher(matching_tags * CACHE_MIN_MATCHERS)
+        for _ in range(10):
+            instance_tags = [{'Key': k, 'Value': rnd.choice(values)}
+                             for k in keys if rnd.random() < 0.6]
+            expected = _reference_check_tags(instance_tags, matching_tags)
+            assert m(instance_tags) == expected
+            assert cached(instance_tags) == expected
+            assert ec2_reaper._check_tags(instance_tags, matching_tags) == expected
+
+
+def test_decision_cache():
+    # pad the matcher list out so the cache kicks in
+    matching_tags = ec2_reaper.DEFAULT_TAG_MATCHER + [
+        {'tag': 'env', 'includes': ['sandbox-{}'.format(n)], 'excludes': []}
+        for n in range(CACHE_MIN_MATCHERS)]
+
+    m = TagMatcher(matching_tags, cache_size=2)
+    assert m(_tags(Name='a', env='x')) is False
+    # tags the matchers don't look at don't affect the fingerprint
+    assert m(_tags(env='x', Name='a', team='y')) is False
+    assert (m.hits, m.misses) == (1, 1)
+
+    assert m(_tags(Name='b')) is False
+    assert m(_tags(env='sandbox-1'))
+    assert len(m._cache) == 2
+    assert m.fingerprint({'Name': 'a', 'env': 'x'}) not in m._cache
+
+    m = TagMatcher(matching_tags, cache_size=0)
+    assert m([])
+    assert (m.hits, m.misses) == (0, 0)
+
+    # too few matchers to be worth caching
+    m = TagMatcher(ec2_reaper.DEFAULT_TAG_MATCHER)
+    assert m.cache_size == 0
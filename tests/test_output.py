@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `ec2_reaper.output` and the CLI's --output option."""
+
+import csv
+import io
+import json
+from datetime import datetime
+
+import boto3
+import pytest
+import pytz
+from click.testing import CliRunner
+from moto import mock_ec2
+
+from ec2_reaper import cli
+from ec2_reaper import output
+from ec2_reaper.decision import Decision
+
+RECORD = {'id': 'i-1', 'region': 'us-east-1', 'account': None, 'tag_match': True,
+          'age_match': True, 'reaped': True, 'launch_time': '2017-01-01T12:00:00+00:00',
+          'policy': None, 'error': None, 'tags': {'Name': 'web'}}
+
+
+def _entries():
+    return [Decision('i-1', True, True, {'Name': 'web'}, 1483272000, 'us-east-1', reaped=True),
+            {'id': 'i-1', 'tag_match': True, 'age_match': True, 'reaped': True, 'region': 'us-east-1',
+             'tags': [{'Key': 'Name', 'Value': 'web'}],
+             'launch_time': datetime(2017, 1, 1, 12, tzinfo=pytz.utc)},
+            {'id': 'i-1', 'tag_match': True, 'age_match': True, 'reaped': True, 'region': 'us-east-1',
+             'account': None, 'tags': {'Name': 'web'}, 'launch_time': 1483272000.0, 'policy': None}]
+
+
+def test_record():
+    for entry in _entries():
+        assert output.record(entry) == RECORD
+
+
+@pytest.mark.parametrize('fmt', ['jsonl', 'json', 'csv'])
+def test_writers(fmt):
+    stream = io.StringIO()
+    with output.get_writer(fmt, stream) as writer:
+        for entry in _entries():
+            assert writer.write(entry) is entry
+    text = stream.getvalue()
+    if fmt == 'jsonl':
+        records = [json.loads(line) for line in text.splitlines()]
+    elif fmt == 'json':
+        records = json.loads(text)
+    else:
+        row = dict((k, '' if v is None else str(v)) for k, v in RECORD.items())
+        row['tags'] = '{"Name":"web"}'
+        assert list(csv.DictReader(io.StringIO(text))) == [row] * 3
+        return
+    assert records == [RECORD] * 3
+
+
+def test_empty_json_array():
+    stream = io.StringIO()
+    output.get_writer('json', stream).close()
+    assert json.loads(stream.getvalue()) == []
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        output.get_writer('xml', io.StringIO())
+
+
+@mock_ec2
+def test_cli_output():
+    client = boto3.client('ec2', region_name='us-west-2')
+    client.run_instances(ImageId='ami-1234abcd', MinCount=2, MaxCount=2)
+    result = CliRunner().invoke(cli.main, ['-d', '-r', 'us-west-2', '--min-age', '0', '-o', 'jsonl'])
+    assert result.exit_code == 0, result.output
+    records = [json.loads(line) for line in result.output.splitlines()]
+    assert len(records) == 2
+    assert all(r['reaped'] and r['tags'] == {} and r['region'] == 'us-west-2' for r in records)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `ec2_reaper.plan` and the plan/apply commands."""
+
+import json
+
+import boto3
+import pytest
+from click.testing import CliRunner
+from moto import mock_ec2
+
+from ec2_reaper import cli
+from ec2_reaper import ec2_reaper
+from ec2_reaper.plan import Plan, apply
+from ec2_reaper.stats import ReapStats
+
+
+def _running(region):
+    client = boto3.client('ec2', region_name=region)
+    return set(i['InstanceId'] for r in client.describe_instances(Filters=[
+        {'Name': 'instance-state-name', 'Values': ['running']}])['Reservations']
+        for i in r['Instances'])
+
+
+@mock_ec2
+def test_plan_and_apply(tmpdir, launch):
+    planned = launch(3)
+    launch(tags={'Name': 'web'})
+    path = str(tmpdir.join('plan.json'))
+
+    result = CliRunner().invoke(cli.main, ['-r', 'us-west-2', '--min-age', '0', '--plan-out', path])
+    assert result.exit_code == 0, result.output
+    plan = Plan.load(path)
+    assert sorted(i['id'] for i in plan.instances) == sorted(planned)
+    assert plan.instances[0]['tags'] == {} and plan.min_age == 0
+    # planning is a dry run
+    assert set(planned) <= _running('us-west-2')
+    result = CliRunner().invoke(cli.main, ['apply', '--dry-run', path])
+    assert result.exit_code == 0, result.output
+    assert set(planned) <= _running('us-west-2')
+
+    # things change between the plan and applying it
+    boto3.client('ec2', region_name='us-west-2').create_tags(
+        Resources=[planned[0]], Tags=[{'Key': 'Name', 'Value': 'claimed'}])
+    unplanned = launch()
+
+    stats = ReapStats()
+    entries = list(apply(path, stats=stats))
+    assert sorted(e['id'] for e in entries if e['reaped']) == sorted(planned[1:])
+    assert stats.totals()['pages'] == 1
+    assert _running('us-west-2') & set(planned + unplanned) == set([planned[0]] + unplanned)
+
+
+@mock_ec2
+def test_apply_groups_by_region(launch):
+    ids = launch(2, region='us-east-1') + launch()
+    plan = Plan(min_age=0)
+    for entry in ec2_reaper.reap_iter(regions=['us-east-1', 'us-west-2'], min_age=0):
+        plan.add(entry)
+    assert plan.groups() == {(None, 'us-east-1'): ids[:2], (None, 'us-west-2'): ids[2:]}
+
+    stats = ReapStats()
+    assert sorted(e['id'] for e in apply(plan, stats=stats) if e['reaped']) == sorted(ids)
+    assert sorted((r.region, r.pages) for r in stats.regions.values()) == \
+        [('us-east-1', 1), ('us-west-2', 1)]
+
+
+def test_apply_needs_roles_for_accounts():
+    plan = Plan(instances=[{'id': 'i-1', 'region': 'us-east-1', 'account': '111111111111',
+                            'launch_time': 0, 'tags': {}, 'policy': None}])
+    assert list(apply(plan)) == []
+
+
+def test_load_errors(tmpdir):
+    path = tmpdir.join('plan.json')
+    for content in ('not json', json.dumps({'format': 'something-else'}),
+                    json.dumps({'format': 'ec2-reaper-plan', 'version': 99})):
+        path.write(content)
+        with pytest.raises(ValueError):
+            Plan.load(str(path))
+
+
+def test_plan_out_refuses_watch(tmpdir):
+    result = CliRunner().invoke(cli.main, ['--watch', '--plan-out', str(tmpdir.join('plan.json'))])
+    assert result.exit_code == 2
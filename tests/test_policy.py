@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `ec2_reaper.policy` and reaping with several policies at once."""
+
+import json
+import time
+
+import pytest
+from moto import mock_ec2
+
+from ec2_reaper import ec2_reaper
+from ec2_reaper import inventory
+from ec2_reaper import scheduler
+from ec2_reaper.policy import PolicySet, load_policies
+from ec2_reaper.state import StateStore
+from ec2_reaper.stats import ReapStats
+from ec2_reaper.summary import ReapSummary
+
+POLICIES = [
+    {'name': 'untagged', 'tags': [{'tag': 'Name', 'includes': [], 'excludes': ['*']}], 'min_age': 0},
+    {'name': 'ci', 'tags': [{'tag': 'Name', 'includes': ['cirunner'], 'excludes': []}], 'min_age': 7200},
+    {'name': 'sandbox', 'tags': [{'tag': 'env', 'includes': ['sandbox'], 'excludes': []}],
+     'min_age': 86400},
+]
+
+
+def test_policy_set():
+    policies = PolicySet(POLICIES)
+    assert policies.match({}) == 0b001
+    assert policies.match({'Name': 'cirunner', 'env': 'sandbox'}) == 0b110
+    assert policies.match({'Name': 'web', 'env': 'prod'}) == 0
+    assert policies.min_age == 0
+    assert policies.min_age_of('sandbox') == 86400
+
+    # the first policy old enough wins...
+    assert policies.decide(0b110, 90000) == (True, 'ci')
+    assert policies.decide(0b100, 90000) == (True, 'sandbox')
+    # ...otherwise the one which will be soonest
+    assert policies.decide(0b110, 60) == (False, 'ci')
+    assert policies.decide(0, 60) == (True, None)
+
+
+def test_policy_errors():
+    with pytest.raises(ValueError):
+        PolicySet([])
+    with pytest.raises(ValueError):
+        PolicySet([POLICIES[0], POLICIES[0]])
+    with pytest.raises(ValueError):
+        PolicySet([{'name': 'empty', 'tags': []}])
+
+
+def test_load_policies(tmpdir):
+    path = tmpdir.join('policies.json')
+    path.write(json.dumps(POLICIES))
+    for spec in (str(path), json.dumps(POLICIES), POLICIES):
+        assert [p.name for p in load_policies(spec).policies] == ['untagged', 'ci', 'sandbox']
+
+
+@mock_ec2
+def test_reap_policies_share_one_scan(launch):
+    untagged, = launch()
+    ci, = launch(tags={'Name': 'cirunner'})
+    sandbox, = launch(tags={'Name': 'box', 'env': 'sandbox'})
+    launch(tags={'Name': 'web'})
+
+    stats = ReapStats()
+    reaperlog = ec2_reaper.reap(regions=['us-west-2'], debug=False, policies=POLICIES, stats=stats)
+    by_id = dict((e['id'], e) for e in reaperlog)
+    assert by_id[untagged]['reaped'] and by_id[untagged]['policy'] == 'untagged'
+    assert not by_id[ci]['reaped'] and by_id[ci]['policy'] == 'ci'
+    assert not by_id[sandbox]['reaped'] and by_id[sandbox]['policy'] == 'sandbox'
+    assert len(reaperlog) == 4
+    # one DescribeInstances for all three policies, plus the termination
+    assert stats.totals()['pages'] == 1
+    assert ReapSummary().update(reaperlog).reaped_by_policy == {'untagged': 1}
+
+
+@mock_ec2
+def test_policies_with_state(launch):
+    ci, = launch(tags={'Name': 'cirunner'})
+    launch(tags={'Name': 'box', 'env': 'sandbox'})
+    with StateStore() as state:
+        first = ec2_reaper.reap(regions=['us-west-2'], policies=POLICIES, state=state)
+        stats = ReapStats()
+        again = ec2_reaper.reap(regions=['us-west-2'], policies=POLICIES, state=state, stats=stats)
+        assert stats.totals()['unchanged'] == 2
+        # reused decisions still know which policy matched
+        assert sorted((e['id'], e['policy']) for e in again) == \
+            sorted((e['id'], e['policy']) for e in first)
+        assert state.instance(ci).tag_match == 0b010
+
+
+@mock_ec2
+def test_schedule_uses_policy_min_age(launch):
+    ci, = launch(tags={'Name': 'cirunner'})
+    policies = PolicySet(POLICIES)
+    queue = scheduler.ExpiryQueue()
+    entries = ec2_reaper.reap_iter(regions=['us-west-2'], policies=policies)
+    entries = list(scheduler.schedule(queue, entries, policies))
+    assert [e['id'] for e in entries] == [ci]
+    assert time.time() + 7000 < queue.next_due() <= time.time() + 7200 + scheduler.GRACE_SECONDS
+
+
+def test_simulate_policies():
+    now = 1500000000.0
+    records = [
+        {'id': 'i-1', 'region': 'r', 'account': None, 'launch_time': now - 60, 'tags': {}},
+        {'id': 'i-2', 'region': 'r', 'account': None, 'launch_time': now - 3600,
+         'tags': {'Name': 'cirunner'}},
+        {'id': 'i-3', 'region': 'r', 'account': None, 'launch_time': now - 90000,
+         'tags': {'Name': 'box', 'env': 'sandbox'}},
+        {'id': 'i-4', 'region': 'r', 'account': None, 'launch_time': now - 90000,
+         'tags': {'Name': 'web'}},
+    ]
+    entries = dict((e['id'], e) for e in inventory.simulate(records, policies=POLICIES, now=now))
+    assert (entries['i-1']['reaped'], entries['i-1']['policy']) == (True, 'untagged')
+    assert (entries['i-2']['reaped'], entries['i-2']['policy']) == (False, 'ci')
+    assert (entries['i-3']['reaped'], entries['i-3']['policy']) == (True, 'sandbox')
+    assert (entries['i-4']['tag_match'], entries['i-4']['policy']) == (False, None)
+
+
+@mock_ec2
+def test_cli_policies(tmpdir, caplog, launch):
+    from click.testing import CliRunner
+    from ec2_reaper import cli
+
+    launch()
+    path = tmpdir.join('policies.json')
+    path.write(json.dumps(POLICIES))
+    result = CliRunner().invoke(cli.main, ['-d', '-r', 'us-west-2', '--policies', str(path)])
+    assert result.exit_code == 0, result.output
+    assert '1 reaped by policy untagged' in caplog.text
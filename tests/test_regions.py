@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `ec2_reaper.regions`."""
+
+import json
+import os
+import threading
+import time
+
+import boto3
+from moto import mock_ec2
+
+from ec2_reaper import regions
+
+
+class _CountingSession(object):
+    """Wraps boto3 so tests can count DescribeRegions calls."""
+    def __init__(self):
+        self.calls = 0
+
+    def client(self, *args, **kwargs):
+        self.calls += 1
+        return boto3.client(*args, **kwargs)
+
+
+@mock_ec2
+def test_opted_in_only():
+    regions.clear_cache()
+    found = regions.get_regions()
+    assert 'us-east-1' in found
+    assert 'us-west-2' in found
+    # moto reports ap-east-1 as not-opted-in
+    assert 'ap-east-1' not in found
+
+
+@mock_ec2
+def test_in_process_cache():
+    regions.clear_cache()
+    session = _CountingSession()
+    first = regions.get_regions(session=session)
+    assert regions.get_regions(session=session) == first
+    assert session.calls == 1
+
+    regions.get_regions(session=session, refresh=True)
+    assert session.calls == 2
+
+    regions.get_regions(session=session, ttl=0)
+    assert session.calls == 3
+
+
+@mock_ec2
+def test_file_cache(tmpdir):
+    path = os.path.join(str(tmpdir), 'cache', 'regions.json')
+    regions.clear_cache()
+    session = _CountingSession()
+    first = regions.get_regions(session=session, cache_file=path)
+    assert json.load(open(path))['regions'] == list(first)
+
+    # a fresh process picks up the file
+    regions.clear_cache()
+    assert regions.get_regions(session=session, cache_file=path) == first
+    assert session.calls == 1
+
+    # stale files are ignored
+    with open(path, 'w') as f:
+        json.dump({'regions': ['xx-fake-1'], 'fetched_at': time.time() - 100}, f)
+    regions.clear_cache()
+    assert regions.get_regions(session=session, cache_file=path, ttl=10) == first
+    assert session.calls == 2
+
+
+def test_accounts_looked_up_in_parallel():
+    regions.clear_cache()
+    started = {'111': threading.Event(), '222': threading.Event()}
+    overlapped = []
+
+    class _Client(object):
+        def __init__(self, account):
+            self.account = account
+
+        def describe_regions(self):
+            # only passes if the other account's lookup is in flight too
+            started[self.account].set()
+            other = [e for a, e in started.items() if a != self.account][0]
+            overlapped.append(other.wait(5))
+            return {'Regions': [{'RegionName': 'us-east-1'}]}
+
+    class _Session(object):
+        def __init__(self, account):
+            self.account = account
+
+        def client(self, *args, **kwargs):
+            return _Client(self.account)
+
+    results = {}
+    threads = [threading.Thread(target=lambda a=a: results.update(
+        {a: regions.get_regions(session=_Session(a), account=a)})) for a in started]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert overlapped == [True, True]
+    assert results == {'111': ('us-east-1',), '222': ('us-east-1',)}
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `ec2_reaper.scan`."""
+
+import boto3
+from moto import mock_ec2
+
+from ec2_reaper import ec2_reaper
+from ec2_reaper import scan
+
+
+@mock_ec2
+def test_engines_agree(launch):
+    # moto pages by reservation, so launch them one at a time
+    ids = [i for n in range(7) for i in launch(tags=[{'Key': 'Name', 'Value': 'somename'}])]
+    ids += launch(3)
+    filters = [ec2_reaper.RUNNING_FILTER]
+
+    client_pages = list(scan.scan_client(boto3.client('ec2', region_name='us-west-2'), filters, page_size=5))
+    resource_pages = list(scan.scan_resource(boto3.resource('ec2', region_name='us-west-2'), filters, page_size=5))
+    assert len(client_pages) > 1
+
+    client_records = sorted(r for page in client_pages for r in page)
+    resource_records = sorted(r for page in resource_pages for r in page)
+    assert sorted(r.id for r in client_records) == sorted(ids)
+    assert client_records == resource_records
+    assert all(r.state == 'running' for r in client_records)
+
+
+@mock_ec2
+def test_reap_engines(launch):
+    launch(2)
+    for engine in scan.ENGINES:
+        reaperlog = ec2_reaper.reap(min_age=0, regions=['us-west-2'], engine=engine, page_size=5)
+        assert len(reaperlog) == 2
+        assert all(e['tag_match'] and e['reaped'] for e in reaperlog)
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `ec2_reaper.scheduler`."""
+
+import datetime
+
+import boto3
+import pytest
+import pytz
+from moto import mock_ec2
+
+from ec2_reaper import scheduler
+from ec2_reaper.state import epoch
+
+TAGS = [{'tag': 'Name', 'includes': [], 'excludes': ['*']}]
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def queue(request, tmpdir):
+    if request.param == 'memory':
+        return scheduler.ExpiryQueue()
+    return scheduler.SQLiteExpiryQueue(str(tmpdir.join('expiries.db')))
+
+
+def test_queue(queue):
+    assert queue.next_due() is None
+    queue.push('i-1', 'us-east-1', 30)
+    queue.push('i-2', 'us-west-2', 10)
+    queue.push('i-3', 'us-east-1', 20)
+    queue.push('i-2', 'us-west-2', 40)  # re-queued later
+    queue.discard('i-3')
+    assert len(queue) == 2
+    assert queue.next_due() == 30
+
+    assert queue.pop_due(now=35) == {(None, 'us-east-1'): ['i-1']}
+    assert queue.pop_due(now=35) == {}
+    assert queue.pop_due(now=40) == {(None, 'us-west-2'): ['i-2']}
+    assert len(queue) == 0
+
+    # instances in other accounts are grouped by account
+    queue.push('i-4', 'us-east-1', 50, account='111111111111')
+    queue.push('i-5', 'us-east-1', 50)
+    assert queue.pop_due(now=50) == {('111111111111', 'us-east-1'): ['i-4'],
+                                     (None, 'us-east-1'): ['i-5']}
+
+
+def test_schedule(queue):
+    launched = datetime.datetime(2017, 1, 1, tzinfo=pytz.utc)
+    entries = [
+        {'id': 'i-1', 'tag_match': True, 'age_match': False, 'launch_time': launched, 'region': 'r'},
+        {'id': 'i-2', 'tag_match': True, 'age_match': True, 'launch_time': launched, 'region': 'r'},
+        {'id': 'i-3', 'tag_match': False, 'age_match': False, 'launch_time': launched, 'region': 'r'},
+    ]
+    assert list(scheduler.schedule(queue, entries, 300)) == entries
+    assert len(queue) == 1
+    assert queue.next_due() == epoch(launched) + 300 + scheduler.GRACE_SECONDS
+
+
+@mock_ec2
+def test_recheck():
+    client = boto3.client('ec2', region_name='us-west-2')
+    ids = [i['InstanceId'] for i in client.run_instances(
+        ImageId='ami-1234abcd', MinCount=2, MaxCount=2)['Instances']]
+    queue = scheduler.ExpiryQueue()
+    queue.push(ids[0], 'us-west-2', 100)
+
+    # nothing's due yet
+    assert list(scheduler.recheck(queue, TAGS, min_age=0, now=50)) == []
+
+    reaperlog = list(scheduler.recheck(queue, TAGS, min_age=0, now=100))
+    assert [(e['id'], e['reaped']) for e in reaperlog] == [(ids[0], True)]
+    assert len(queue) == 0
+
+    # still too young: goes back in the queue
+    queue.push(ids[1], 'us-west-2', 100)
+    reaperlog = list(scheduler.recheck(queue, TAGS, min_age=3600, now=100))
+    assert [(e['id'], e['age_match']) for e in reaperlog] == [(ids[1], False)]
+    assert len(queue) == 1
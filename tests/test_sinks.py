@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `ec2_reaper.sinks`."""
+
+import gzip
+import io
+import json
+from datetime import datetime
+
+import boto3
+import pytest
+from moto import mock_s3
+
+from ec2_reaper import sinks
+
+ENTRIES = [
+    {'id': 'i-11111111', 'tag_match': True, 'age_match': True, 'tags': [],
+     'launch_time': datetime(2017, 1, 1, 12), 'reaped': True, 'region': 'us-east-1'},
+    {'id': 'i-22222222', 'tag_match': False, 'age_match': True,
+     'tags': [{'Key': 'Name', 'Value': 'somename'}],
+     'launch_time': datetime(2017, 1, 2, 12), 'reaped': False, 'region': 'us-east-1'},
+]
+
+
+def _read_jsonl(data):
+    with gzip.GzipFile(fileobj=io.BytesIO(data)) as f:
+        return [json.loads(line.decode('utf-8')) for line in f]
+
+
+def test_jsonable():
+    o = {'a': [datetime(2017, 1, 1), ('b', 1)], 'c': None}
+    assert sinks.jsonable(o) == {'a': ['2017-01-01T00:00:00', ['b', 1]], 'c': None}
+    assert sinks.jsonable(ENTRIES) == json.loads(json.dumps(sinks.jsonable(ENTRIES)))
+
+
+def test_file_sink(tmpdir):
+    sink = sinks.get_sink('file://{}'.format(tmpdir.join('logs')))
+    with sink.open('run.jsonl.gz') as writer:
+        for e in ENTRIES:
+            writer.write(e)
+    assert writer.entries == 2
+    assert writer.location == str(tmpdir.join('logs', 'run.jsonl.gz'))
+
+    with open(writer.location, 'rb') as f:
+        assert _read_jsonl(f.read()) == sinks.jsonable(ENTRIES)
+
+
+@mock_s3
+def test_s3_sink():
+    client = boto3.client('s3', region_name='us-east-1')
+    client.create_bucket(Bucket='reaper-logs')
+
+    sink = sinks.S3Sink('s3://reaper-logs/some/prefix/', client=client)
+    with sink.open('run.jsonl.gz') as writer:
+        for e in ENTRIES:
+            writer.write(e)
+    assert writer.location == 's3://reaper-logs/some/prefix/run.jsonl.gz'
+
+    body = client.get_object(Bucket='reaper-logs', Key='some/prefix/run.jsonl.gz')['Body'].read()
+    assert _read_jsonl(body) == sinks.jsonable(ENTRIES)
+
+
+def test_get_sink():
+    assert isinstance(sinks.get_sink('/tmp/logs'), sinks.FileSink)
+    assert isinstance(sinks.get_sink('s3://bucket'), sinks.S3Sink)
+    with pytest.raises(ValueError):
+        sinks.get_sink('ftp://somewhere/logs')
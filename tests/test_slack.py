@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `ec2_reaper.slack`."""
+
+import json
+import sys
+from datetime import datetime
+
+import requests
+
+from ec2_reaper import slack
+from ec2_reaper.stats import ReapStats
+
+if sys.version_info < (3, 0) or (sys.version_info >= (3, 5) and
+                                 sys.version_info < (3, 6)):
+    from mock import patch
+else:
+    from unittest.mock import patch
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.text = 'nope'
+
+
+class FakeSession(object):
+    """Hands out canned responses in order, then 200s."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.posts = []
+
+    def post(self, url, headers=None, data=None, timeout=None):
+        self.posts.append(json.loads(data))
+        r = self.responses.pop(0) if self.responses else FakeResponse(200)
+        if isinstance(r, Exception):
+            raise r
+        return r
+
+
+def _attachments(n, size=10):
+    return [{'title': 'i-{:08d}'.format(i), 'text': 'x' * size, 'ts': datetime(2017, 1, 1)}
+            for i in range(n)]
+
+
+def test_chunk():
+    assert slack.chunk([]) == []
+    assert [len(c) for c in slack.chunk(_attachments(45), max_attachments=20)] == [20, 20, 5]
+    # split on size as well as count
+    assert [len(c) for c in slack.chunk(_attachments(10, size=100), max_bytes=500)] == [3, 3, 3, 1]
+    # an oversized attachment still gets sent, on its own
+    assert [len(c) for c in slack.chunk(_attachments(2, size=1000), max_bytes=500)] == [1, 1]
+
+
+def test_post_chunks():
+    session = FakeSession()
+    stats = ReapStats()
+    with patch.object(slack, 'get_http_session', return_value=session):
+        assert slack.post('https://hooks', 'hello', _attachments(45), stats=stats) == 200
+    assert [p['text'] for p in session.posts] == ['hello (1/3)', 'hello (2/3)', 'hello (3/3)']
+    assert sum(len(p['attachments']) for p in session.posts) == 45
+    assert stats.slack_posts == 3
+
+
+@patch.object(slack, '_sleep')
+def test_post_retries(mock_sleep):
+    session = FakeSession(FakeResponse(429, {'Retry-After': '7'}),
+                          FakeResponse(503),
+                          requests.ConnectionError('reset'))
+    with patch.object(slack, 'get_http_session', return_value=session):
+        assert slack.post('https://hooks', 'hello', backoff=0.5) == 200
+    assert len(session.posts) == 4
+    # Retry-After wins over backoff, which doubles each attempt
+    assert [c[0][0] for c in mock_sleep.call_args_list] == [7.0, 1.0, 2.0]
+
+
+@patch.object(slack, '_sleep')
+def test_post_gives_up(mock_sleep):
+    session = FakeSession(*[FakeResponse(500)] * 5)
+    with patch.object(slack, 'get_http_session', return_value=session):
+        assert slack.post('https://hooks', 'hello', retries=2) == 500
+    assert len(session.posts) == 3
+
+    # client errors aren't retried
+    session = FakeSession(FakeResponse(400))
+    with patch.object(slack, 'get_http_session', return_value=session):
+        assert slack.post('https://hooks', 'hello') == 400
+    assert len(session.posts) == 1
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `ec2_reaper.state`."""
+
+import boto3
+from moto import mock_ec2
+
+from ec2_reaper import ec2_reaper
+from ec2_reaper.matcher import TagMatcher
+from ec2_reaper.state import StateStore
+from ec2_reaper.stats import ReapStats
+
+TAGS = [{'tag': 'Name', 'includes': [], 'excludes': ['*']}]
+
+
+def test_record_and_history():
+    store = StateStore()
+    store.bind(TAGS)
+    fp = StateStore.fingerprint(TagMatcher(TAGS), {})
+
+    known = store.lookup(['i-1', 'i-2'])
+    assert known == {}
+    store.record('us-east-1', [('i-1', 100.0, fp, True, False), ('i-2', 100.0, fp, False, True)],
+                 known, {}, now=1000)
+    assert store.instance('i-1').tag_match == 1
+    assert len(store.history()) == 2
+
+    # nothing changed: no history, just last_seen
+    known = store.lookup(['i-1', 'i-2'])
+    store.record('us-east-1', [('i-1', 100.0, fp, True, False), ('i-2', 100.0, fp, False, True)],
+                 known, {}, now=2000)
+    assert len(store.history()) == 2
+    assert store.instance('i-1').last_seen == 2000
+    assert store.instance('i-1').last_changed == 1000
+
+    # old enough now, so it gets reaped
+    known = store.lookup(['i-1'])
+    store.record('us-east-1', [('i-1', 100.0, fp, True, True)], known,
+                 {'i-1': {'id': 'i-1', 'reaped': True}}, now=3000)
+    reaps = store.history(reaped=True)
+    assert [(h['id'], h['at'], h['dry_run']) for h in reaps] == [('i-1', 3000, 0)]
+    assert [h['at'] for h in store.history(id='i-1', since=2000)] == [3000]
+
+
+def test_bind_forgets_decisions():
+    store = StateStore()
+    store.bind(TAGS)
+    store.record('us-east-1', [('i-1', 100.0, '[null]', True, True)], {}, {})
+    store.bind(TAGS)
+    assert store.instance('i-1').fingerprint == '[null]'
+    store.bind([{'tag': 'Owner', 'includes': [], 'excludes': ['*']}])
+    assert store.instance('i-1').fingerprint is None
+
+
+@mock_ec2
+def test_reap_incremental(tmpdir, launch):
+    untagged = launch(2)
+    tagged = launch(tags=[{'Key': 'Name', 'Value': 'somename'}])
+    path = str(tmpdir.join('state.db'))
+
+    with StateStore(path) as state:
+        stats = ReapStats()
+        reaperlog = ec2_reaper.reap(TAGS, min_age=0, regions=['us-west-2'], state=state, stats=stats)
+        assert sorted(e['id'] for e in reaperlog if e['tag_match']) == sorted(untagged)
+        assert stats.totals()['unchanged'] == 0
+
+    # a fresh process picks up where the last one left off
+    with StateStore(path) as state:
+        stats = ReapStats()
+        again = ec2_reaper.reap(TAGS, min_age=0, regions=['us-west-2'], state=state, stats=stats)
+        assert stats.totals()['unchanged'] == 3
+        assert sorted((e['id'], e['tag_match']) for e in again) == \
+            sorted((e['id'], e['tag_match']) for e in reaperlog)
+
+        # retagging forces a fresh decision
+        boto3.client('ec2', region_name='us-west-2').delete_tags(
+            Resources=tagged, Tags=[{'Key': 'Name'}])
+        stats = ReapStats()
+        again = ec2_reaper.reap(TAGS, min_age=0, regions=['us-west-2'], state=state, stats=stats)
+        assert stats.totals()['unchanged'] == 2
+        assert all(e['tag_match'] for e in again)
+
+        # dry-run reaps are in the history
+        assert len(state.history(id=untagged[0], reaped=True)) == 3
+        assert state.history(id=tagged[0])[-1]['tag_match'] == 1
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `ec2_reaper.stats`."""
+
+from botocore.exceptions import ClientError
+from moto import mock_ec2
+
+from ec2_reaper import ec2_reaper
+from ec2_reaper import stats
+
+
+@mock_ec2
+def test_reap_stats(launch):
+    # moto pages by reservation
+    for n in range(7):
+        launch()
+    s = stats.ReapStats()
+    reaperlog = ec2_reaper.reap(min_age=0, regions=['us-west-2'], debug=True, page_size=5,
+                                stats=s)
+    assert len(reaperlog) == 7
+
+    r = s.regions['us-west-2']
+    assert (r.pages, r.instances, r.api_calls, r.terminate_calls) == (2, 7, 2, 0)
+    assert r.scan_seconds >= r.describe_seconds > 0
+    assert s.totals()['instances'] == 7
+    assert s.total_seconds > 0
+
+    # moto can't page past instances terminated mid-scan, so terminate in one page
+    s = stats.ReapStats()
+    ec2_reaper.reap(min_age=0, regions=['us-west-2'], debug=False, stats=s)
+    r = s.regions['us-west-2']
+    assert (r.pages, r.api_calls, r.terminate_calls) == (1, 2, 1)
+    assert r.terminate_seconds > 0
+
+
+def test_api_error_counts_throttles():
+    r = stats.RegionStats('us-east-1')
+    r.api_error(ClientError({'Error': {'Code': 'RequestLimitExceeded'}}, 'DescribeInstances'))
+    r.api_error(ClientError({'Error': {'Code': 'UnauthorizedOperation'}}, 'DescribeInstances'))
+    r.api_call(0.1, {'ResponseMetadata': {'RetryAttempts': 2}})
+    assert (r.api_calls, r.throttles, r.retries) == (3, 1, 2)
+
+
+def test_to_emf():
+    s = stats.ReapStats()
+    s.region('us-east-1').instances = 3
+    s.region('us-west-2').instances = 4
+    s.slack_post(0.5)
+
+    docs = s.to_emf('Test', timestamp=1500000000)
+    assert len(docs) == 3
+    overall, east = docs[0], docs[1]
+    assert overall['_aws']['Timestamp'] == 1500000000000
+    assert overall['_aws']['CloudWatchMetrics'][0]['Namespace'] == 'Test'
+    assert overall['_aws']['CloudWatchMetrics'][0]['Dimensions'] == [[]]
+    assert overall['Instances'] == 7
+    assert overall['SlackPosts'] == 1
+    assert east['_aws']['CloudWatchMetrics'][0]['Dimensions'] == [['Region']]
+    assert east['Region'] == 'us-east-1'
+    assert east['Instances'] == 3
+    # every declared metric has a value
+    for doc in docs:
+        for m in doc['_aws']['CloudWatchMetrics'][0]['Metrics']:
+            assert m['Name'] in doc
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `ec2_reaper.summary`."""
+
+from ec2_reaper.summary import ReapSummary
+
+
+def _entry(tag_match, age_match, reaped, **kwargs):
+    entry = {'id': 'i-11111111', 'tag_match': tag_match, 'age_match': age_match,
+             'reaped': reaped, 'region': 'us-east-1', 'tags': [], 'launch_time': None}
+    entry.update(kwargs)
+    return entry
+
+
+ENTRIES = [
+    _entry(True, False, False),
+    _entry(False, True, False),
+    _entry(True, True, True),
+    _entry(True, True, False, error='boom'),
+]
+
+
+def test_counts():
+    summary = ReapSummary().update(ENTRIES)
+    assert summary.as_dict() == {'reaped': 1, 'matches_under_min_age': 1,
+                                 'tag_matches': 3, 'instances': 4}
+    assert summary.errors == 1
+    # nothing is held on to by default
+    assert summary.reaped is None
+    assert summary.too_young is None
+    assert summary.log is None
+
+
+def test_keep():
+    summary = ReapSummary(keep_matches=True, keep_log=True).update(iter(ENTRIES))
+    assert summary.reaped == [ENTRIES[2]]
+    assert summary.too_young == [ENTRIES[0]]
+    assert summary.log == ENTRIES
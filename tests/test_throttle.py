@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `ec2_reaper.throttle`."""
+
+import sys
+
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+from moto import mock_ec2
+
+from ec2_reaper import ec2_reaper
+from ec2_reaper import stats
+from ec2_reaper import throttle
+
+if sys.version_info >= (3, 3):
+    from unittest.mock import MagicMock, patch
+else:
+    from mock import MagicMock, patch
+
+THROTTLED = ClientError({'Error': {'Code': 'RequestLimitExceeded'}}, 'TerminateInstances')
+
+
+@pytest.fixture(autouse=True)
+def _reset():
+    throttle.reset()
+    yield
+    throttle.reset()
+
+
+def test_aimd():
+    limiter = throttle.Limiter(rate=4, burst=10, max_rate=5, min_rate=1)
+    limiter.success()
+    assert limiter.rate == 4.5
+    limiter.observe({'ResponseMetadata': {'RetryAttempts': 0}})
+    limiter.success()
+    assert limiter.rate == 5
+
+    limiter.observe(error=THROTTLED)
+    assert limiter.rate == 2.5
+    # botocore retrying a call means we were going too fast
+    limiter.observe({'ResponseMetadata': {'RetryAttempts': 1}})
+    limiter.throttled()
+    assert limiter.rate == 1
+    assert limiter.state()['throttles'] == 3
+
+    # other errors don't move the rate
+    limiter.observe(error=ClientError({'Error': {'Code': 'InvalidInstanceID.NotFound'}}, 'X'))
+    assert limiter.rate == 1
+
+
+def test_acquire_waits_for_tokens():
+    limiter = throttle.Limiter(rate=2, burst=2, max_rate=2)
+    with patch('ec2_reaper.throttle.time.sleep') as sleep:
+        assert limiter.acquire() == 0
+        assert limiter.acquire() == 0
+        wait = limiter.acquire()
+    assert 0 < wait <= 0.5
+    sleep.assert_called_once_with(wait)
+    assert limiter.state()['wait_seconds'] == wait
+
+
+def test_throttle_empties_bucket():
+    limiter = throttle.Limiter(rate=10, burst=100, max_rate=10)
+    limiter.throttled()
+    with patch('ec2_reaper.throttle.time.sleep') as sleep:
+        limiter.acquire()
+    assert sleep.called
+
+
+def test_get_limiter(monkeypatch):
+    describe = throttle.get_limiter('us-east-1', throttle.DESCRIBE)
+    assert throttle.get_limiter('us-east-1', throttle.DESCRIBE) is describe
+    assert throttle.get_limiter('us-east-1', throttle.DESCRIBE, '111111111111') is not describe
+    assert throttle.get_limiter('us-east-1', throttle.TERMINATE).rate == 5
+
+    monkeypatch.setenv('THROTTLE_TERMINATE_RATE', '2')
+    assert throttle.get_limiter('us-west-2', throttle.TERMINATE).rate == 2
+
+    monkeypatch.setenv('THROTTLE', 'off')
+    assert throttle.get_limiter('us-east-1', throttle.DESCRIBE) is throttle.NO_LIMIT
+
+
+def test_terminate_backs_off():
+    client = MagicMock()
+    client.terminate_instances.side_effect = THROTTLED
+    rstats = stats.RegionStats('us-east-1')
+    batch = [{'id': 'i-1', 'reaped': False}, {'id': 'i-2', 'reaped': False}]
+    with patch('ec2_reaper.throttle.time.sleep'):
+        ec2_reaper._terminate(client, batch, rstats)
+
+    limiter = throttle.get_limiter('us-east-1', throttle.TERMINATE)
+    # the whole batch is retried, never split into single calls
+    assert client.terminate_instances.call_count == ec2_reaper.TERMINATE_ATTEMPTS == 3
+    assert all(c[1]['InstanceIds'] == ['i-1', 'i-2'] for c in client.terminate_instances.call_args_list)
+    assert limiter.throttles == rstats.throttles == 3
+    assert limiter.rate == throttle.DEFAULTS[throttle.TERMINATE]['rate'] / 8
+    assert all('error' in e and not e['reaped'] for e in batch)
+
+
+def test_terminate_retries_after_throttle():
+    client = MagicMock()
+    client.terminate_instances.side_effect = [
+        THROTTLED, {'TerminatingInstances': [{'InstanceId': 'i-1'}, {'InstanceId': 'i-2'}]}]
+    batch = [{'id': 'i-1', 'reaped': False}, {'id': 'i-2', 'reaped': False}]
+    with patch('ec2_reaper.throttle.time.sleep') as sleep:
+        ec2_reaper._terminate(client, batch, stats.RegionStats('us-east-1'))
+    # the limiter made the retry wait
+    assert sleep.called
+    assert client.terminate_instances.call_count == 2
+    assert all(e['reaped'] and 'error' not in e for e in batch)
+
+
+@mock_ec2
+def test_reap_reports_limits():
+    client = boto3.client('ec2', region_name='us-west-2')
+    client.run_instances(ImageId='ami-1234abcd', MinCount=1, MaxCount=1)
+    s = stats.ReapStats()
+    ec2_reaper.reap(min_age=0, regions=['us-west-2'], debug=False, stats=s)
+
+    r = s.as_dict()['regions'][0]
+    assert r['limits']['describe']['calls'] == 1
+    assert r['limits']['terminate']['calls'] == 1
+    assert r['limits']['describe']['rate'] > throttle.DEFAULTS[throttle.DESCRIBE]['rate']
+    assert 'limits' not in s.totals()
+    assert s.totals()['wait_seconds'] == 0
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `ec2_reaper.watch`."""
+
+import sys
+import threading
+
+import boto3
+from click.testing import CliRunner
+from moto import mock_ec2
+
+from ec2_reaper import cli
+from ec2_reaper import scheduler
+from ec2_reaper import watch
+from ec2_reaper.summary import ReapSummary
+
+if sys.version_info < (3, 0) or (sys.version_info >= (3, 5) and
+                                 sys.version_info < (3, 6)):
+    from mock import patch
+else:
+    from unittest.mock import patch
+
+
+def _summary(tag_match=False, age_match=False):
+    summary = ReapSummary()
+    summary.add({'id': 'i-1', 'tag_match': tag_match, 'age_match': age_match, 'reaped': tag_match and age_match})
+    return summary
+
+
+def test_next_interval():
+    # nothing found: back off, up to the max
+    assert watch.next_interval(300, _summary(), 300, 30, 3600) == 600
+    assert watch.next_interval(3000, _summary(), 300, 30, 3600) == 3600
+    # matches waiting to get old enough: tighten, down to the min
+    assert watch.next_interval(300, _summary(tag_match=True), 300, 30, 3600) == 150
+    assert watch.next_interval(40, _summary(tag_match=True), 300, 30, 3600) == 30
+    # an interval outside of the bounds isn't pulled towards them
+    assert watch.next_interval(10, _summary(tag_match=True), 10, 30, 3600) == 10
+    # something was reaped: back to normal
+    assert watch.next_interval(3600, _summary(True, True), 300, 30, 3600) == 300
+
+
+def test_jittered():
+    for n in range(100):
+        assert 90 <= watch.jittered(100, 0.1) <= 110
+    assert watch.jittered(100, 0) == 100
+
+
+def test_watch_rechecks_expiries():
+    expiries = scheduler.ExpiryQueue()
+    sweeps, rechecks = [], []
+    stop = threading.Event()
+
+    def _sweep(stop):
+        sweeps.append(1)
+        # due straight away
+        expiries.push('i-1', 'us-east-1', 0)
+        return _summary(tag_match=True)
+
+    def _recheck(stop):
+        rechecks.append(expiries.pop_due())
+        if len(sweeps) == 2:
+            stop.set()
+
+    assert watch.watch(_sweep, recheck=_recheck, expiries=expiries, interval=0.05,
+                       min_interval=0.01, jitter=0, stop=stop) == 2
+    assert rechecks == [{(None, 'us-east-1'): ['i-1']}] * 2
+
+
+def test_failed_recheck_backs_off():
+    expiries = scheduler.ExpiryQueue()
+    expiries.push('i-1', 'us-east-1', 0)
+    calls = []
+
+    def _recheck(stop):
+        calls.append(1)
+        raise RuntimeError('boom')
+
+    with patch.object(watch, 'RECHECK_RETRY', 0.05):
+        watch._wait(threading.Event(), watch.time.time() + 0.2, _recheck, expiries)
+    # not a busy loop, even though i-1 stays due
+    assert 2 <= len(calls) <= 5
+
+
+def test_watch_survives_errors():
+    calls = []
+
+    def _sweep(stop):
+        calls.append(1)
+        raise RuntimeError('boom')
+
+    assert watch.watch(_sweep, interval=0.01, jitter=0, max_sweeps=3) == 3
+    assert len(calls) == 3
+
+
+@mock_ec2
+def test_cli_watch():
+    boto3.client('ec2', region_name='us-west-2').run_instances(
+        ImageId='ami-1234abcd', MinCount=1, MaxCount=1)
+    real_watch = watch.watch
+    sweeps = []
+
+    def _watch(sweep, **kwargs):
+        kwargs.pop('stop')
+        return real_watch(lambda stop: sweeps.append(sweep(stop)) or sweeps[-1],
+                          max_sweeps=2, **kwargs)
+
+    runner = CliRunner()
+    with patch.object(watch, 'watch', _watch), patch.object(watch, 'handle_signals'):
+        result = runner.invoke(cli.main, ['-d', '--watch', '--interval', '1', '--jitter', '0',
+                                          '--regions', 'us-west-2'])
+    assert result.exit_code == 0
+    assert [s.too_young_count for s in sweeps] == [1, 1]
+
+
+def test_cli_jitter_range():
+    result = CliRunner().invoke(cli.main, ['--watch', '--jitter', '2'])
+    assert result.exit_code == 2
+    assert 'between 0 and 1' in result.output